@@ -7,14 +7,21 @@ Handles:
 - Recognition history & mood storage
 """
 
-from fastapi import FastAPI, UploadFile, File, Query, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Query, Form, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
-import sqlite3, os, io, time, sounddevice as sd, numpy as np, librosa
-from datetime import datetime
+import os, io, csv, json, time, asyncio, numpy as np
 
-# Import recognition logic
-from live_recognize import recognize_audio, load_audio, DB
+# Import recognition logic (cheap: the index opens in the startup hook, not at import)
+from live_recognize import get_recognizer, get_db, start_db_watcher, recognize_bytes, RESULT_CACHE
+from audio_decode import resample
+from recognition_pool import RecognitionPool, PoolSaturated, EXECUTOR
+from batch_recognizer import MicroBatcher
+from batch_scan import scan_record, FIELDS as SCAN_FIELDS
+from streaming_recognize import StreamingRecognizer, SR as STREAM_SR, MAX_SECONDS as MAX_STREAM_SECONDS
+from user_store import UserStore, HISTORY_PAGE, HISTORY_PAGE_MAX
+import metrics
 
 app = FastAPI(title="Serenity Audio Recognition API")
 
@@ -29,41 +36,39 @@ app.add_middleware(
 
 # ===== DB SETUP =====
 DB_PATH = "serenity_users.db"
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            mood TEXT DEFAULT 'neutral'
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            song TEXT,
-            emotion TEXT,
-            timestamp TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
+WARM_UP = True   # run a synthetic query at startup so the first real request isn't the cold one
+MAX_BATCH_FILES = 200   # clips per /recognize/batch request; bigger scans belong to batch_scan.py
+# pooled WAL connections; history writes are batched off the request path
+users = UserStore(DB_PATH)
+
+@app.on_event("shutdown")
+def close_user_store():
+    users.close()
+
+# open + warm the index, then pick up newly trained songs without restarting (hot-swaps it)
+@app.on_event("startup")
+def watch_fingerprint_db():
+    recognizer = get_recognizer()
+    if WARM_UP:
+        recognizer.warm_up()
+    recognizer.start_watcher()
+
+# CPU-bound recognition runs here, never on the event loop (process workers watch the index themselves)
+recognition_pool = RecognitionPool(initializer=start_db_watcher if EXECUTOR == "process" else None)
+# concurrent uploads within BATCH_WINDOW_MS share one STFT pass and one posting lookup
+batcher = MicroBatcher(recognition_pool)
+
+# pool/batching/cache/history counters are sampled into gauges at every /metrics scrape
+metrics.export_stats("serenity_pool", recognition_pool.stats, "Recognition pool")
+metrics.export_stats("serenity_batching", batcher.stats, "Micro-batching")
+metrics.export_stats("serenity_history_writes", users.stats, "Batched history writes")
+if RESULT_CACHE is not None and EXECUTOR == "thread":
+    metrics.export_stats("serenity_result_cache", RESULT_CACHE.stats, "Result cache")
 
 # ===== HELPERS =====
 def log_recognition(user_id, song, emotion="neutral"):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO history (user_id, song, emotion, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, song, emotion, datetime.now().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    # queued; the store's writer thread commits it with the next batch
+    users.log_recognition(user_id, song, emotion)
 
 
 # ===================================
@@ -76,9 +81,12 @@ def home():
         "message": "🎧 Serenity Audio Recognition API",
         "routes": {
             "/recognize [POST]": "Upload .mp3/.wav file to recognize",
-            "/recognize/live [GET]": "Record via mic and recognize",
+            "/recognize/stream [WS]": "Stream mic audio chunks, answer as soon as confident",
+            "/recognize/batch [POST]": "Upload many clips, results streamed back as JSONL/CSV lines",
             "/user/login [POST]": "Authenticate or create new user",
-            "/user/history/{user_id} [GET]": "Get user recognition history"
+            "/user/history/{user_id} [GET]": "Get user recognition history (paged: limit, cursor)",
+            "/stats [GET]": "Recognition pool, batching and result cache counters",
+            "/metrics [GET]": "Prometheus metrics: per-stage latency histograms, counts, index size, RSS"
         }
     }
 
@@ -91,8 +99,15 @@ async def recognize_uploaded(
 ):
     start = time.time()
     try:
-        y, _ = librosa.load(io.BytesIO(await audio.read()), sr=22050, mono=True)
-        result = recognize_audio(y, DB)
+        data = await audio.read()
+        try:
+            result, timing = await batcher.recognize(data)
+        except PoolSaturated as e:
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)},
+                content={"status": "busy", "message": str(e)},
+            )
         end = time.time()
 
         if result:
@@ -110,6 +125,7 @@ async def recognize_uploaded(
                 "confidence": primary_match["confidence"],
                 "offset": primary_match["offset"],
                 "processing_time": round(end - start, 2),
+                "timing": timing,
                 "similar_songs": [
                     {
                         "song": song["song"],
@@ -119,52 +135,187 @@ async def recognize_uploaded(
                 ]
             }
         else:
-            return {"status": "no_match", "message": "No song match found."}
+            return {"status": "no_match", "message": "No song match found.", "timing": timing}
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
+# 📦 BATCH RECOGNITION (offline scans: not logged to any user's history)
+async def _scan_upload(name, data):
+    """One batch item through the shared pool; waits out saturation instead of failing."""
+    started = time.perf_counter()
+    while True:
+        try:
+            (result, stages), timing = await recognition_pool.submit(recognize_bytes, data)
+            return scan_record(name, result, dict(stages, **timing), started)
+        except PoolSaturated as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            return scan_record(name, None, {}, started, error=str(e))
+
+
+@app.post("/recognize/batch")
+async def recognize_batch_upload(files: List[UploadFile] = File(...), format: str = Form(default="jsonl")):
+    if format not in ("jsonl", "csv"):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "format must be jsonl or csv"})
+    if len(files) > MAX_BATCH_FILES:
+        return JSONResponse(status_code=413, content={
+            "status": "error", "message": f"At most {MAX_BATCH_FILES} files per batch; use batch_scan.py for more"})
+    uploads = [(file.filename, await file.read()) for file in files]
+
+    async def lines():
+        if format == "csv":
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=SCAN_FIELDS)
+            writer.writeheader()
+        # half the workers at most, so interactive /recognize requests keep getting through
+        limit = asyncio.Semaphore(max(recognition_pool.max_workers // 2, 1))
+
+        async def run(name, data):
+            async with limit:
+                return await _scan_upload(name, data)
+
+        for task in asyncio.as_completed([run(name, data) for name, data in uploads]):
+            record = await task
+            if format == "csv":
+                writer.writerow(record)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            else:
+                yield json.dumps(record) + "\n"
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(lines(), media_type=media_type)
+
+
+# 📊 SERVICE STATS (result cache lives in the workers when EXECUTOR == "process")
+@app.get("/stats")
+def service_stats():
+    return {
+        "pool": recognition_pool.stats(),
+        "batching": batcher.stats(),
+        "result_cache": RESULT_CACHE.stats() if RESULT_CACHE is not None and EXECUTOR == "thread" else None,
+        "history_writes": users.stats(),
+    }
+
+
+# 📈 PROMETHEUS METRICS
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # Note: Live recognition now handled through the /recognize endpoint with uploaded audio
 # The /recognize/live endpoint is removed as recording happens in the browser
 
 
+# 🎙️ STREAMING RECOGNITION (early exit)
+@app.websocket("/recognize/stream")
+async def recognize_stream_ws(
+    websocket: WebSocket,
+    user_id: int = Query(...),
+    emotion: str = Query(default="neutral"),
+    sample_rate: int = Query(default=STREAM_SR),
+    format: str = Query(default="f32")
+):
+    """
+    Client sends binary mono PCM chunks (float32, or int16 with format=s16) and
+    may send the text "end" to force an answer. The server replies with a
+    "listening" update per chunk (an "error" for a malformed chunk) and closes
+    after the final result, or with code 1013 when the recognition pool is full.
+    """
+    await websocket.accept()
+    rec = StreamingRecognizer(get_db())
+    start = time.time()
+
+    async def answer(final):
+        matches = rec.matches
+        if matches and (final or rec.confident()):
+            top = matches[0]
+            log_recognition(user_id, top["song"], emotion)
+            await websocket.send_json({
+                "status": "success",
+                "song": top["song"],
+                "votes": top["votes"],
+                "confidence": top["confidence"],
+                "offset": top["offset"],
+                "audio_seconds": round(rec.seconds, 2),
+                "processing_time": round(time.time() - start, 2),
+                "similar_songs": [
+                    {"song": m["song"], "votes": m["votes"], "confidence": m["confidence"]}
+                    for m in matches[1:3]
+                ]
+            })
+            return True
+        if final:
+            await websocket.send_json({"status": "no_match", "message": "No song match found.",
+                                       "audio_seconds": round(rec.seconds, 2)})
+            return True
+        await websocket.send_json({"status": "listening", "audio_seconds": round(rec.seconds, 2),
+                                   "leader": matches[0]["song"] if matches else None})
+        return False
+
+    dtype = np.int16 if format == "s16" else np.float32
+    width = np.dtype(dtype).itemsize
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") == "end":
+                await recognition_pool.submit(rec.finish, local=True)
+                await answer(final=True)
+                break
+            data = message.get("bytes")
+            if not data:
+                continue
+            if len(data) % width:
+                await websocket.send_json({"status": "error", "message": (
+                    f"Chunk of {len(data)} bytes is not whole {format} samples ({width} bytes each)")})
+                continue
+            chunk = np.frombuffer(data, dtype=dtype).astype(np.float32)
+            if dtype == np.int16:
+                chunk /= 32768.0
+            if sample_rate != STREAM_SR:
+                # per-chunk polyphase resampling; edge effects are below the peak threshold
+                chunk = resample(chunk, sample_rate, STREAM_SR)
+            # STFT/peaks/lookup for the chunk run off the event loop, under the pool's admission limit
+            await recognition_pool.submit(rec.feed, chunk, local=True)
+            if await answer(final=rec.seconds >= MAX_STREAM_SECONDS):
+                break
+        await websocket.close()
+    except PoolSaturated as e:
+        await websocket.close(code=1013, reason=str(e))   # 1013: try again later
+    except WebSocketDisconnect:
+        pass
+
+
 # 👤 USER LOGIN
 @app.post("/user/login")
 def user_login(username: str = Form(...)):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE username=?", (username,))
-    user = c.fetchone()
-    if not user:
-        c.execute("INSERT INTO users (username) VALUES (?)", (username,))
-        conn.commit()
-        user_id = c.lastrowid
-    else:
-        user_id = user[0]
-    conn.close()
-    return {"status": "ok", "user_id": user_id}
-
-
-# 🕒 FETCH HISTORY
+    return {"status": "ok", "user_id": users.login(username)}
+
+
+# 🕒 FETCH HISTORY (newest first; pass next_cursor back as cursor for the next page)
 @app.get("/user/history/{user_id}")
-def user_history(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT song, emotion, timestamp FROM history WHERE user_id=?", (user_id,))
-    rows = c.fetchall()
-    conn.close()
-    return {"history": [{"song": r[0], "emotion": r[1], "timestamp": r[2]} for r in rows]}
+def user_history(
+    user_id: int,
+    limit: int = Query(default=HISTORY_PAGE, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: str = Query(default=None)
+):
+    try:
+        rows, next_cursor = users.history(user_id, limit, cursor)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid cursor"})
+    return {"history": rows, "next_cursor": next_cursor}
 
 
 # 🎭 FETCH USER PROFILE + MOOD
 @app.get("/user/profile/{user_id}")
 def get_profile(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT username, mood FROM users WHERE id=?", (user_id,))
-    user = c.fetchone()
-    conn.close()
+    user = users.profile(user_id)
     if user:
         return {"username": user[0], "mood": user[1]}
     return {"error": "User not found"}
@@ -0,0 +1,147 @@
+# audio_decode.py
+"""
+Fast In-Memory Decode for Uploaded Query Audio
+librosa.load(BytesIO) falls back to audioread for MP3 and runs a high-quality
+resampler over the whole clip, which often costs more than recognition itself.
+
+    sniff container → WAV/PCM: np.frombuffer straight from the upload bytes
+                    → other:   soundfile (libsndfile), librosa as last resort
+                    → cap to MAX_QUERY_SECONDS before any conversion
+                    → mono → polyphase resample to SR (44.1k → 22.05k is 1:2, 48k is 147:320)
+"""
+
+import io, struct, time
+from math import gcd
+import numpy as np
+
+# ==== CONFIG ====
+SR = 22050
+MAX_QUERY_SECONDS = 15    # recognition never needs more than this much of a clip
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class DecodeError(ValueError):
+    """Raised when an upload can't be decoded as audio."""
+
+
+# ==== SNIFFING ====
+def sniff_format(data):
+    """Guess the container from magic bytes: wav, flac, ogg, mp3 or unknown."""
+    head = bytes(data[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return "unknown"
+
+
+# ==== WAV ====
+def parse_wav(data, max_seconds=MAX_QUERY_SECONDS):
+    """
+    Decode PCM/float WAV bytes without copying the payload until conversion.
+    Returns (samples float32 mono, sample_rate).
+    """
+    view = memoryview(data)
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        (size,) = struct.unpack("<I", view[pos + 4:pos + 8])
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            tag, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", view[body:body + 16])
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                (tag,) = struct.unpack("<H", view[body + 24:body + 26])
+            fmt = (tag, channels, rate, block_align, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise DecodeError("WAV data chunk before fmt chunk")
+            size = min(size, len(view) - body)     # tolerate streamed/truncated headers
+            return _wav_samples(view[body:body + size], *fmt, max_seconds=max_seconds)
+        pos = body + size + (size & 1)              # chunks are word-aligned
+    raise DecodeError("WAV file has no data chunk")
+
+
+def _wav_samples(payload, tag, channels, rate, block_align, bits, max_seconds):
+    n_frames = len(payload) // block_align
+    if max_seconds:
+        n_frames = min(n_frames, int(max_seconds * rate))
+    payload = payload[:n_frames * block_align]
+
+    if tag == WAVE_FORMAT_FLOAT and bits in (32, 64):
+        y = np.frombuffer(payload, dtype=f"<f{bits // 8}").astype(np.float32)
+    elif tag == WAVE_FORMAT_PCM and bits == 16:
+        y = np.frombuffer(payload, dtype="<i2").astype(np.float32) / 32768.0
+    elif tag == WAVE_FORMAT_PCM and bits == 32:
+        y = (np.frombuffer(payload, dtype="<i4") / 2147483648.0).astype(np.float32)
+    elif tag == WAVE_FORMAT_PCM and bits == 8:
+        y = (np.frombuffer(payload, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif tag == WAVE_FORMAT_PCM and bits == 24:
+        b = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        y = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.0
+    else:
+        raise DecodeError(f"Unsupported WAV encoding (format {tag:#x}, {bits} bits)")
+
+    if channels > 1:
+        y = y.reshape(-1, channels).mean(axis=1)
+    return y, rate
+
+
+# ==== RESAMPLING ====
+def resample(y, sr_in, sr_out=SR):
+    """Polyphase resampling; exact ratios for the common 44.1k/48k → 22.05k cases."""
+    if sr_in == sr_out:
+        return y
+    from scipy.signal import resample_poly   # deferred: scipy.signal is slow to import
+    g = gcd(int(sr_in), int(sr_out))
+    return resample_poly(y, sr_out // g, sr_in // g).astype(np.float32)
+
+
+# ==== ENTRY POINT ====
+def decode_audio(data, sr=SR, max_seconds=MAX_QUERY_SECONDS):
+    """
+    Decode an uploaded clip to mono float32 at `sr`, capped to max_seconds.
+    Returns (y, info) where info has format, source_sr, decode_ms and resample_ms.
+    """
+    start = time.perf_counter()
+    fmt = sniff_format(data)
+    if fmt == "wav":
+        y, source_sr = parse_wav(data, max_seconds)
+    else:
+        y, source_sr = _decode_compressed(data, max_seconds)
+    decoded = time.perf_counter()
+
+    y = resample(y, source_sr, sr)
+    done = time.perf_counter()
+    if not len(y):
+        raise DecodeError("Uploaded audio is empty")
+    return y, {
+        "format": fmt,
+        "source_sr": int(source_sr),
+        "decode_ms": round((decoded - start) * 1000, 1),
+        "resample_ms": round((done - decoded) * 1000, 1),
+    }
+
+
+def _decode_compressed(data, max_seconds):
+    """soundfile first (fast, handles FLAC/OGG/MP3), librosa/audioread as the fallback."""
+    try:
+        import soundfile as sf
+        with sf.SoundFile(io.BytesIO(data)) as f:
+            frames = int(max_seconds * f.samplerate) if max_seconds else -1
+            y = f.read(frames=frames, dtype="float32", always_2d=True)
+            return y.mean(axis=1) if y.shape[1] > 1 else y[:, 0], f.samplerate
+    except Exception:
+        pass
+    try:
+        import librosa
+        return librosa.load(io.BytesIO(data), sr=None, mono=True, duration=max_seconds or None)
+    except Exception as e:
+        raise DecodeError(f"Could not decode audio: {e}") from e
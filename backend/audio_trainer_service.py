@@ -1,15 +1,21 @@
 # audio_trainer_service.py
-from fastapi import FastAPI, UploadFile, File, Form, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Query, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-import os, pickle, random, librosa
-from fingerprint_train import fingerprint_file, SONG_DIR as FT_SONG_DIR, DB_PATH as FT_DB_PATH
-import live_recognize
+from typing import List
+import os
+from fingerprint_train import BUILD_PARAMS, INGEST_PARAMS, SONG_DIR as FT_SONG_DIR, DB_PATH as FT_DB_PATH
+from segment_store import SegmentStore
+from ingest_manifest import IngestManifest
+from train_queue import TrainQueue, TrainQueueFull, RETRY_AFTER as TRAIN_RETRY_AFTER
+from benchmark import run_benchmark, CODECS
+import metrics
+import live_recognize   # cheap to import; reload_db() only acts if this process serves an index
 
 # ================= CONFIG =================
 ADMIN_KEY = "secret123"  # change this in production
 SONG_DIR = "songs"
-DB_PATH = "fingerprints_db.pkl"
+DB_PATH = FT_DB_PATH
 
 app = FastAPI(title="🎵 Serenity Audio Trainer API (Admin Only)")
 
@@ -24,66 +30,109 @@ app.add_middleware(
 
 os.makedirs(SONG_DIR, exist_ok=True)
 
+# append-only index: /train writes a delta segment, /delete writes a tombstone
+store = SegmentStore(DB_PATH, BUILD_PARAMS)
+
+# digest + hash count of every indexed upload: unchanged and duplicate uploads are skipped
+ingest = IngestManifest(DB_PATH, INGEST_PARAMS)
+metrics.export_stats("serenity_ingest", ingest.stats, "Ingest manifest")
+
+# index gauges on /metrics describe the newest committed generation
+metrics.track_index(store.snapshot)
+
 # ================= UTILITIES =================
-def load_db():
-    if os.path.exists(DB_PATH):
-        with open(DB_PATH, "rb") as f:
-            data = pickle.load(f)
-        return data.get("db", {}), data.get("songs", [])
-    return {}, []
+def schedule_compaction(background_tasks):
+    """Merge segments after the response is sent, once enough deltas/tombstones pile up."""
+    if store.needs_compaction():
+        background_tasks.add_task(store.compact)
+
+def after_commit():
+    """Runs on the training writer thread after each committed batch."""
+    if store.needs_compaction():
+        store.compact()
+    # swap in the new generation if this process also serves queries (the API watcher polls for it)
+    try:
+        live_recognize.reload_db()
+    except Exception as e:
+        print("⚠️ Could not reload recognizer DB:", e)
+
+# /train jobs: parallel fingerprinting, one writer commits batches to `store`
+train_queue = TrainQueue(store, ingest, SONG_DIR, on_commit=after_commit)
+metrics.export_stats("serenity_train_queue", train_queue.stats, "Training queue")
 
-def save_db(db, songs):
-    with open(DB_PATH, "wb") as f:
-        pickle.dump({"db": db, "songs": songs}, f)
+@app.on_event("shutdown")
+def stop_train_queue():
+    train_queue.close()
 
 # ================= ROUTES =================
 @app.get("/")
 def home():
     return {"message": "🎧 Serenity Audio Trainer API running — Admin access only"}
 
+def job_response(job):
+    """202 while the job is in the queue, 200 once it has an outcome."""
+    return JSONResponse(status_code=200 if job.done else 202, content=job.to_dict())
+
 @app.post("/train")
-async def train_song(file: UploadFile = File(...), admin_key: str = Form(...)):
+async def train_song(file: UploadFile = File(...), admin_key: str = Form(...), force: bool = Form(default=False)):
     if admin_key != ADMIN_KEY:
         return JSONResponse(status_code=403, content={"error": "Unauthorized"})
-
-    os.makedirs(SONG_DIR, exist_ok=True)
-    song_path = os.path.join(SONG_DIR, file.filename)
-    with open(song_path, "wb") as f:
-        f.write(await file.read())
-
-    db, songs = load_db()
     try:
-        count = fingerprint_file(song_path, file.filename, db)
-        if file.filename not in songs:
-            songs.append(file.filename)
-        save_db(db, songs)
-
-        # reload recognizer in main API if it's running
+        job = train_queue.submit(file.filename, await file.read(), force=force)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except TrainQueueFull as e:
+        return JSONResponse(status_code=503, content={"error": str(e)},
+                            headers={"Retry-After": str(e.retry_after)})
+    except RuntimeError as e:   # fingerprinting pool failed twice in a row; the upload was cleaned up
+        return JSONResponse(status_code=503, content={"error": f"Training workers unavailable: {e}"},
+                            headers={"Retry-After": str(TRAIN_RETRY_AFTER)})
+    return job_response(job)
+
+@app.post("/train/bulk")
+async def train_songs(files: List[UploadFile] = File(...), admin_key: str = Form(...),
+                      force: bool = Form(default=False)):
+    # fingerprinted in parallel, committed together; poll /train/jobs for progress
+    if admin_key != ADMIN_KEY:
+        return JSONResponse(status_code=403, content={"error": "Unauthorized"})
+    jobs, rejected, full = [], [], False
+    for file in files:
         try:
-            live_recognize.reload_db()
-        except Exception as e:
-            print("⚠️ Could not reload recognizer DB:", e)
+            jobs.append(train_queue.submit(file.filename, await file.read(), force=force).to_dict())
+        except (TrainQueueFull, RuntimeError) as e:
+            full = True
+            rejected.append({"song": file.filename, "error": str(e)})
+        except ValueError as e:
+            rejected.append({"song": file.filename, "error": str(e)})
+    status = 202 if jobs else 503 if full else 400
+    return JSONResponse(status_code=status, content={"jobs": jobs, "rejected": rejected})
+
+@app.get("/train/jobs")
+def training_jobs(admin_key: str = Query(...), limit: int = Query(100)):
+    if admin_key != ADMIN_KEY:
+        return JSONResponse(status_code=403, content={"error": "Unauthorized"})
+    return dict(train_queue.jobs(limit), queue=train_queue.stats())
 
-        return {"status": "success", "song": file.filename, "hashes": count}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+@app.get("/train/jobs/{job_id}")
+def training_job(job_id: str, admin_key: str = Query(...)):
+    if admin_key != ADMIN_KEY:
+        return JSONResponse(status_code=403, content={"error": "Unauthorized"})
+    job = train_queue.job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job
 
 @app.delete("/delete")
-def delete_song(song_name: str = Query(...), admin_key: str = Query(...)):
+def delete_song(background_tasks: BackgroundTasks, song_name: str = Query(...), admin_key: str = Query(...)):
     if admin_key != ADMIN_KEY:
         return JSONResponse(status_code=403, content={"error": "Unauthorized"})
 
-    db, songs = load_db()
-    if song_name not in songs:
+    # tombstone the song's postings; compaction drops them later
+    if not store.delete_song(song_name):
         return JSONResponse(status_code=404, content={"error": "Song not found"})
-
-    # remove hashes
-    for h in list(db.keys()):
-        db[h] = [entry for entry in db[h] if entry[0] != song_name]
-        if not db[h]:
-            del db[h]
-    songs.remove(song_name)
-    save_db(db, songs)
+    schedule_compaction(background_tasks)
+    ingest.forget(song_name)
+    ingest.save()
 
     # delete file
     path = os.path.join(SONG_DIR, song_name)
@@ -96,33 +145,50 @@ def delete_song(song_name: str = Query(...), admin_key: str = Query(...)):
         print("⚠️ Reload failed:", e)
 
     return {"status": "deleted", "song": song_name}
-    if not songs:
-        return {"error": "No songs in DB"}
-
-    CLIP_SECONDS, N_TRIALS = 6, 3
-    total, correct = 0, 0
-    for song in songs:
-        full_path = os.path.join(SONG_DIR, song)
-        if not os.path.exists(full_path):
-            continue
-        for _ in range(N_TRIALS):
-            y, sr = librosa.load(full_path, sr=None, mono=True)
-            full_len = librosa.get_duration(y=y, sr=sr)
-            start = 0 if full_len <= CLIP_SECONDS else random.uniform(0, full_len - CLIP_SECONDS)
-            y_clip = y[int(start * sr): int((start + CLIP_SECONDS) * sr)]
-            tmp = f"temp_{song}.wav"
-            librosa.output.write_wav(tmp, y_clip, sr)
-            result = live_recognize.recognize_audio(y_clip, live_recognize.DB)
-            total += 1
-            if result and result["song"] == song:
-                correct += 1
-            os.remove(tmp)
-    acc = round((correct / total) * 100, 2) if total else 0
-    return {"accuracy": acc, "tested_clips": total, "songs_tested": len(songs)}
 
 @app.get("/songs")
 def list_songs(admin_key: str = Query(...)):
     if admin_key != ADMIN_KEY:
         return JSONResponse(status_code=403, content={"error": "Unauthorized"})
-    _, songs = load_db()
-    return {"songs": songs}
\ No newline at end of file
+    return {"songs": store.songs}
+
+@app.post("/compact")
+def compact_index(background_tasks: BackgroundTasks, admin_key: str = Form(...)):
+    if admin_key != ADMIN_KEY:
+        return JSONResponse(status_code=403, content={"error": "Unauthorized"})
+    background_tasks.add_task(store.compact)
+    return {"status": "scheduled", "segments": len(store.read_manifest()["segments"])}
+
+@app.post("/benchmark")
+def benchmark(
+    admin_key: str = Form(...),
+    corpus: str = Form("synthetic"),
+    songs: int = Form(10),
+    queries: int = Form(50),
+    negatives: int = Form(10),
+    clip_seconds: float = Form(6.0),
+    snr_db: float = Form(10.0),
+    gain_db: float = Form(0.0),
+    codec: str = Form("none"),
+    seed: int = Form(0),
+):
+    # synthetic: offline on generated songs; index: the live index, clips cut from SONG_DIR
+    if admin_key != ADMIN_KEY:
+        return JSONResponse(status_code=403, content={"error": "Unauthorized"})
+    if corpus not in ("synthetic", "index") or codec not in CODECS:
+        return JSONResponse(status_code=400, content={
+            "error": f"corpus must be synthetic or index, codec one of {', '.join(CODECS)}"})
+    try:
+        return run_benchmark(
+            corpus=corpus, songs=songs, queries=queries, negatives=negatives,
+            clip_seconds=clip_seconds, snr_db=snr_db, gain_db=gain_db, codec=codec, seed=seed,
+            song_dir=SONG_DIR, index_path=DB_PATH,
+            db=store.snapshot() if corpus == "index" else None,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # fingerprinting stage histograms, song/hash counters, index size, RSS
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
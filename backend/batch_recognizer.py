@@ -0,0 +1,95 @@
+# batch_recognizer.py
+"""
+Micro-Batched Recognition
+Collects /recognize uploads that arrive within a short window and runs them as
+one job: batched STFT, per-clip hashing, a single merged posting lookup, then
+votes split back per request (live_recognize.recognize_bytes_batch).
+
+Latency/throughput knob:
+    BATCH_WINDOW_MS  → how long the first request of a batch waits for company
+                       (0 disables batching: every request is its own job)
+    MAX_BATCH        → flush early once this many requests are waiting
+"""
+
+import asyncio, time
+from live_recognize import recognize_bytes, recognize_bytes_batch
+
+# ==== CONFIG ====
+BATCH_WINDOW_MS = 5
+MAX_BATCH = 16
+
+
+class MicroBatcher:
+    """Groups concurrent requests into batches and runs them on a RecognitionPool."""
+
+    def __init__(self, pool, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH):
+        self.pool = pool
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.requests = 0
+
+    async def recognize(self, data):
+        """
+        Recognize one uploaded blob. Returns (result, timing); timing adds the
+        decode/recognize stage times, batch_wait_ms and batch_size to the
+        pool's queue_wait_ms/compute_ms.
+        Raises PoolSaturated if the pool rejects the batch.
+        """
+        if self.window_ms <= 0 or self.max_batch <= 1:
+            (result, stages), timing = await self.pool.submit(recognize_bytes, data)
+            return result, dict(timing, **stages, batch_wait_ms=0.0, batch_size=1)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((data, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        flushed = time.perf_counter()
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            results, timing = await self.pool.submit(recognize_bytes_batch, [data for data, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, arrived), result in zip(batch, results):
+            if future.done():  # client went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                result, stages = result
+                future.set_result((result, dict(
+                    timing,
+                    **stages,
+                    batch_wait_ms=round((flushed - arrived) * 1000, 1),
+                    batch_size=len(batch),
+                )))
+
+    def stats(self):
+        return {
+            "window_ms": self.window_ms,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,242 @@
+# batch_scan.py
+"""
+Offline Batch Recognition
+Scans thousands of recorded clips (broadcast monitoring, dedup audits) against
+the index in one run, instead of one `python live_recognize.py clip` process
+(and one index open) per file:
+
+    inputs   → a directory (walked recursively), a manifest file (one path per
+               line, relative to the manifest, # comments) or - for stdin
+    workers  → SCAN_WORKERS processes, each opens the index once (the mmap'd
+               segments are shared through the page cache) and recognizes
+               files as they are handed out; at most IN_FLIGHT per worker queued
+    output   → one record per clip, written and flushed as soon as it finishes
+               (JSONL, or CSV for a .csv output), with per-item timing
+
+Records come back in completion order; `path` ties them to their input.
+Without --resume an existing output file is overwritten; --resume skips clips
+already present in it and appends. If a worker dies (e.g. out of memory) the
+clips it had in flight are recorded as errors and the scan stops; rerun with
+--resume to scan the rest.
+
+Usage:
+    python batch_scan.py clips/ [-o scan_results.jsonl] [--workers 8] [--index fingerprints_index] [--resume]
+    python batch_scan.py clips.txt -o results.csv
+"""
+
+import argparse, csv, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from fingerprint_core import SR, HOP_LENGTH
+from live_recognize import Recognizer, DB_PATH
+
+# ==== CONFIG ====
+SCAN_WORKERS = os.cpu_count() or 1
+IN_FLIGHT = 4            # queued files per worker; keeps memory flat on huge inputs
+PROGRESS_EVERY = 100     # print a progress line every this many clips
+OUTPUT = "scan_results.jsonl"
+CLIP_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+FIELDS = ("path", "status", "song", "votes", "confidence", "score", "offset", "offset_s",
+          "decode_ms", "resample_ms", "recognize_ms", "total_ms", "error")
+
+
+# ==== INPUTS ====
+def iter_inputs(source):
+    """Clip paths from a directory, a manifest file or "-" (stdin), lazily."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for fname in sorted(files):
+                if fname.lower().endswith(CLIP_EXTENSIONS) and not fname.startswith("."):
+                    yield os.path.join(root, fname)
+        return
+    lines = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+    base = os.getcwd() if source == "-" else os.path.dirname(os.path.abspath(source))
+    with lines:
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield os.path.join(base, line)
+
+
+# ==== RECORDS ====
+def scan_record(path, result, timing, started, error=None):
+    """One output row: top match (or no_match / error) with per-item timing."""
+    top = result[0] if result else None
+    return {
+        "path": path,
+        "status": "error" if error is not None else "match" if top else "no_match",
+        "song": top["song"] if top else None,
+        "votes": top["votes"] if top else None,
+        "confidence": round(top["confidence"], 4) if top else None,
+        "score": top.get("score") if top else None,
+        "offset": top["offset"] if top else None,
+        "offset_s": round(top["offset"] * HOP_LENGTH / SR, 2) if top else None,
+        "decode_ms": timing.get("decode_ms"),
+        "resample_ms": timing.get("resample_ms"),
+        "recognize_ms": timing.get("recognize_ms"),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "error": error,
+    }
+
+
+_scanner = None
+
+
+def _init_worker(index_path=DB_PATH):
+    """Open and warm the index once per worker (no result cache: scanned clips rarely repeat)."""
+    global _scanner
+    _scanner = Recognizer(path=index_path)
+    _scanner.warm_up()
+
+
+def scan_file(path):
+    """Worker entry point: recognize one clip → record; never raises."""
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        result, timing = _scanner.recognize_bytes(data)
+        return scan_record(path, result, timing, started)
+    except Exception as e:
+        return scan_record(path, None, {}, started, error=str(e))
+
+
+def scan(paths, workers=SCAN_WORKERS, index_path=DB_PATH, in_flight=IN_FLIGHT):
+    """Recognize every path, yielding records as they finish (workers=1 runs in-process)."""
+    if workers <= 1:
+        _init_worker(index_path)
+        for path in paths:
+            yield scan_file(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index_path,)) as pool:
+        pending = {}   # future → (path, submitted at)
+        try:
+            for path in paths:
+                pending[pool.submit(scan_file, path)] = (path, time.perf_counter())
+                if len(pending) >= workers * in_flight:
+                    yield from _finished(pending)
+            while pending:
+                yield from _finished(pending)
+        except BrokenProcessPool:
+            # clips that finished before the worker died keep their results; the rest are
+            # lost with the pool, and unsubmitted paths are left for --resume
+            lost = [f for f in pending if f.exception() is not None]
+            print(f"❌ A scan worker died; {len(lost)} in-flight clips recorded as errors, "
+                  f"rerun with --resume to scan the rest")
+            for future, (path, started) in pending.items():
+                if future in lost:
+                    yield scan_record(path, None, {}, started, error="scan worker died (out of memory?)")
+                else:
+                    yield future.result()
+
+
+def _finished(pending):
+    """
+    Wait for at least one future and yield the finished records. Futures lost to a
+    dead worker stay in `pending` and BrokenProcessPool is raised after the others.
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    broken = None
+    for future in done:
+        if isinstance(future.exception(), BrokenProcessPool):
+            broken = future.exception()
+            continue
+        record = future.result()
+        del pending[future]
+        yield record
+    if broken is not None:
+        raise broken
+
+
+# ==== OUTPUT ====
+class RecordWriter:
+    """Writes records to a JSONL or CSV (.csv) file, flushing each one."""
+
+    def __init__(self, path=OUTPUT, append=False):
+        self.fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+        header = not (append and os.path.exists(path) and os.path.getsize(path))
+        self._file = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        if self.fmt == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if header:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self.fmt == "csv":
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def scanned_paths(path):
+    """Paths already recorded in an earlier (possibly interrupted) output file."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            return {row["path"] for row in csv.DictReader(f)}
+        done = set()
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError):   # a line cut off by the interruption
+                pass
+        return done
+
+
+def summarize(records, wall):
+    """Status counts, per-item latency percentiles and throughput of a scan."""
+    counts = {}
+    for r in records:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    ms = np.array([r["total_ms"] for r in records]) if records else np.zeros(1)
+    return {
+        "clips": len(records), **counts,
+        "wall_s": round(wall, 2),
+        "clips_per_s": round(len(records) / wall, 2) if wall else None,
+        "item_ms": {"p50": round(float(np.percentile(ms, 50)), 1), "p95": round(float(np.percentile(ms, 95)), 1),
+                    "max": round(float(ms.max()), 1)},
+    }
+
+
+# ==== MAIN ENTRY ====
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize a directory or manifest of clips in one run.")
+    parser.add_argument("source", help="directory, manifest file (one path per line) or - for stdin")
+    parser.add_argument("-o", "--output", default=OUTPUT,
+                        help="results file, .jsonl or .csv (overwritten unless --resume)")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS)
+    parser.add_argument("--index", default=DB_PATH, help="index directory")
+    parser.add_argument("--resume", action="store_true", help="skip clips already in --output and append")
+    args = parser.parse_args(argv)
+
+    skip = scanned_paths(args.output) if args.resume else set()
+    paths = (p for p in iter_inputs(args.source) if p not in skip)
+    writer = RecordWriter(args.output, append=args.resume)
+    if skip:
+        print(f"⏭️ Skipping {len(skip)} clips already in {args.output}")
+
+    # only the summary needs the records; keep the small part
+    records, start = [], time.perf_counter()
+    try:
+        for record in scan(paths, workers=args.workers, index_path=args.index):
+            writer.write(record)
+            records.append({"status": record["status"], "total_ms": record["total_ms"]})
+            if len(records) % PROGRESS_EVERY == 0:
+                rate = len(records) / (time.perf_counter() - start)
+                print(f"📊 {len(records)} clips scanned ({rate:.1f}/s)")
+    finally:
+        writer.close()
+    summary = summarize(records, time.perf_counter() - start)
+    print(f"✅ Scan done, results in {args.output}: {json.dumps(summary)}")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
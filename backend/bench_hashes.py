@@ -0,0 +1,87 @@
+# bench_hashes.py
+"""
+Benchmark: legacy per-pair SHA1 hashing vs vectorized packed hashing.
+
+Generates a synthetic constellation map the size of a full song, runs both
+implementations, checks that they produce the same (f1, f2, dt, t1) pair set
+and prints timings.
+
+Usage:
+    python bench_hashes.py                  → 5-minute song, 30 peaks/sec
+    python bench_hashes.py --seconds 60 --peaks-per-sec 50 --repeat 5
+"""
+
+import argparse, hashlib, time
+import numpy as np
+from fingerprint_core import generate_hashes, unpack_hashes, FAN_VALUE, DT_MAX, N_FFT, SR, HOP_LENGTH
+
+
+def legacy_generate_hashes(peaks, fan_value=FAN_VALUE, pairs=None):
+    """The original per-pair loop (SHA1 of 'f1|f2|dt'), kept for comparison."""
+    peaks.sort(key=lambda x: x[1])
+    hashes = []
+    for i in range(len(peaks)):
+        f1, t1 = peaks[i]
+        for j in range(1, fan_value + 1):
+            if i + j < len(peaks):
+                f2, t2 = peaks[i + j]
+                dt = t2 - t1
+                if dt <= 0 or dt > DT_MAX:
+                    continue
+                key = f"{f1}|{f2}|{dt}"
+                h = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+                hashes.append((h, t1))
+                if pairs is not None:
+                    pairs.append((f1, f2, dt, t1))
+    return hashes
+
+
+def synthetic_peaks(seconds, peaks_per_sec, seed=0):
+    """Random constellation map in the same (freq-major) order np.where returns."""
+    rng = np.random.default_rng(seed)
+    n_frames = int(seconds * SR / HOP_LENGTH)
+    n_peaks = int(seconds * peaks_per_sec)
+    cells = rng.choice(n_frames * (N_FFT // 2 + 1), size=n_peaks, replace=False)
+    cells.sort()
+    freqs, times = np.divmod(cells, n_frames)
+    return [(int(f), int(t)) for f, t in zip(freqs, times)]
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--peaks-per-sec", type=float, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    peaks = synthetic_peaks(args.seconds, args.peaks_per_sec)
+    print(f"🎼 {len(peaks)} peaks ({args.seconds:.0f}s @ {args.peaks_per_sec:.0f} peaks/s), FAN_VALUE={FAN_VALUE}")
+
+    t_legacy, legacy = best_of(lambda: legacy_generate_hashes(list(peaks)), args.repeat)
+    t_vector, (hashes, times) = best_of(lambda: generate_hashes(peaks), args.repeat)
+
+    # correctness: identical pair sets
+    legacy_pairs = []
+    legacy_generate_hashes(list(peaks), pairs=legacy_pairs)
+    f1, f2, dt = unpack_hashes(hashes)
+    vector_pairs = list(zip(f1.tolist(), f2.tolist(), dt.tolist(), times.tolist()))
+    same = legacy_pairs == vector_pairs
+
+    print(f"   legacy loop + SHA1 : {t_legacy * 1000:9.1f} ms  ({len(legacy)} hashes)")
+    print(f"   vectorized packed  : {t_vector * 1000:9.1f} ms  ({len(hashes)} hashes)")
+    print(f"   speedup            : {t_legacy / t_vector:9.1f}x")
+    print(f"   identical pairs    : {'✅ yes' if same else '❌ NO'}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
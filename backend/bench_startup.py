@@ -0,0 +1,144 @@
+# bench_startup.py
+"""
+Startup Benchmark
+Cold-start cost of the recognition stack, every sample in a fresh interpreter:
+
+    import_<module>   → `import live_recognize / audio_api_service / audio_trainer_service`
+    open_index        → first Recognizer.db access (index open / mmap)
+    warm_up           → Recognizer.warm_up()
+    cold_first        → first recognize_bytes without warm-up (what the first user waited)
+    warm_first        → first recognize_bytes after warm-up
+    steady            → a later request, for reference
+
+Medians over --runs processes. --baseline prints the deltas against an earlier
+--json report, so import-time regressions show up run to run.
+
+Usage:
+    python bench_startup.py [--runs 5] [--clip query.wav] [--index fingerprints_index]
+                            [--json startup.json] [--baseline old.json]
+"""
+
+import argparse, json, os, platform, subprocess, sys, tempfile, wave
+import numpy as np
+
+# ==== CONFIG ====
+RUNS = 5
+MODULES = ("live_recognize", "audio_api_service", "audio_trainer_service")
+CLIP_SECONDS = 6
+CLIP_SR = 44100   # synthetic clip rate: exercises the resampler like a browser upload
+
+_CHILD = r"""
+import json, sys, time
+mode, arg = sys.argv[1], sys.argv[2]
+start = time.perf_counter()
+if mode == "import":
+    __import__(arg)
+    print(json.dumps({"import_" + arg: (time.perf_counter() - start) * 1000}))
+    sys.exit()
+import live_recognize
+rec = live_recognize.Recognizer(path=sys.argv[3])
+data = open(arg, "rb").read()
+out = {}
+t = time.perf_counter(); rec.db; out["open_index"] = (time.perf_counter() - t) * 1000
+if mode == "warm":
+    t = time.perf_counter(); rec.warm_up(); out["warm_up"] = (time.perf_counter() - t) * 1000
+t = time.perf_counter(); rec.recognize_bytes(data); first = (time.perf_counter() - t) * 1000
+out["warm_first" if mode == "warm" else "cold_first"] = first
+t = time.perf_counter(); rec.recognize_bytes(data); out["steady"] = (time.perf_counter() - t) * 1000
+print(json.dumps(out))
+"""
+
+
+def synthetic_clip(path, seconds=CLIP_SECONDS, sr=CLIP_SR):
+    """Write a seeded noise-and-tones WAV clip (16-bit mono) to path."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.05 * rng.standard_normal(len(t)) + 0.2 * np.sin(2 * np.pi * 440 * t) * np.sin(2 * np.pi * 0.5 * t)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((np.clip(y, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def _child(args, cwd):
+    """Run one measurement in a fresh interpreter → dict of milliseconds."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, "-c", _CHILD, *args], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run_startup_benchmark(runs=RUNS, clip=None, index_path=None, cwd=None, modules=MODULES):
+    """Measure imports, index open, warm-up and first-request latency. Returns a report dict."""
+    from segment_store import INDEX_DIR
+    index_path = index_path or INDEX_DIR
+    cwd = cwd or os.getcwd()
+    samples = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if clip is None:
+            clip = os.path.join(tmp, "clip.wav")
+            synthetic_clip(clip)
+        for n in range(runs):
+            print(f"⏱️ run {n + 1}/{runs}")
+            jobs = [("import", m) for m in modules] + [("cold", clip), ("warm", clip)]
+            for mode, arg in jobs:
+                for name, ms in _child([mode, arg, os.path.abspath(index_path)], cwd).items():
+                    samples.setdefault(name, []).append(ms)
+    results = {
+        name: {"median_ms": round(float(np.median(v)), 1), "min_ms": round(min(v), 1), "max_ms": round(max(v), 1)}
+        for name, v in samples.items()
+    }
+    return {
+        "params": {"runs": runs, "clip": clip if clip and os.path.exists(clip) else "synthetic",
+                   "index": index_path},
+        "results": results,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+    }
+
+
+def compare_reports(new, old):
+    """{metric: (old median, new median, change)} for every metric in both reports."""
+    return {
+        name: (old["results"][name]["median_ms"], row["median_ms"],
+               round(row["median_ms"] - old["results"][name]["median_ms"], 1))
+        for name, row in new["results"].items() if name in old.get("results", {})
+    }
+
+
+def print_report(report):
+    print(f"\n📋 startup over {report['params']['runs']} fresh processes")
+    print(f"{'stage':<34}{'median ms':>12}{'min':>10}{'max':>10}")
+    for name, row in report["results"].items():
+        print(f"{name:<34}{row['median_ms']:>12}{row['min_ms']:>10}{row['max_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import / warm-up / first-request latency benchmark.")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--clip", help="audio file to send as the first request (default: synthetic)")
+    parser.add_argument("--index", help="index path (default: the recognizer's)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_startup_benchmark(runs=args.runs, clip=args.clip, index_path=args.index)
+    print_report(report)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            deltas = compare_reports(report, json.load(f))
+        report["baseline"] = {"path": args.baseline, "deltas": deltas}
+        print(f"\n📈 vs {args.baseline}:")
+        for name, (old, new, change) in deltas.items():
+            print(f"   {name:<32}{old:>10} → {new:<10} ({change:+g} ms)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.json}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# benchmark.py
+"""
+Recognition Benchmark Suite
+Reproducible accuracy / latency runs against either
+
+    synthetic  → throwaway index of generated songs (runs fully offline)
+    songs      → throwaway index built from the audio files in a folder
+    index      → an existing on-disk index, clips cut from its song files
+
+Synthetic songs are random note sequences over a beat loop (and a bare-loop
+intro) shared by every song, so the catalogue has the same kind of
+"everywhere" hashes as real music.
+
+Every clip is cut at a seeded random position and degraded in order:
+gain (dB, clipped to ±1) → codec → additive white noise (SNR dB). Codecs:
+    none, lowpass (4 kHz band-limit + 8-bit), telephone (8 kHz μ-law), ogg (Vorbis via soundfile)
+
+The report (JSON) has accuracy, top-3 and offset accuracy, wrong matches
+(another song reported), false matches (top match >= FALSE_MATCH_VOTES on
+clips of songs that are not indexed), the share of those answered at all,
+p50/p95/p99 latency, throughput, peak RSS, index size and the parameters it
+ran with. --baseline prints the deltas against an earlier report, so index
+formats and parameters can be compared run to run.
+
+Usage:
+    python benchmark.py [--corpus synthetic|songs|index] [--songs 20] [--queries 100]
+                        [--snr 10] [--gain 0] [--codec none] [--workers 1]
+                        [--verify | --no-verify] [--stop-list] [--json report.json] [--baseline old.json]
+"""
+
+import argparse, json, os, platform, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from fingerprint_core import SR, HOP_LENGTH, HASH_SCHEME
+from fingerprint_index import IndexBuilder
+from segment_store import SegmentedIndex, open_index, INDEX_DIR
+from match_scoring import MAX_POSTINGS, IDF_WEIGHTING
+from match_verify import VERIFY
+
+try:
+    import resource   # peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
+# ==== CONFIG ====
+SONGS = 20
+SONG_SECONDS = 30
+QUERIES = 100
+NEGATIVES = 20        # clips of unindexed songs, for the false-match rate
+CLIP_SECONDS = 6
+SNR_DB = 10
+GAIN_DB = 0.0
+CODEC = "none"
+CODECS = ("none", "lowpass", "telephone", "ogg")
+OFFSET_TOLERANCE = 2  # frames; a match "lands" if its offset is this close to the cut
+FALSE_MATCH_VOTES = 20   # a negative clip whose top match has this many votes is a false match
+SONG_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+
+LOOP_HOPS = 64        # shared beat loop, frame-aligned so every bar fingerprints the same
+LOOP_TONES = (220.0, 330.0, 220.0, 440.0)   # Hz of the four decaying beat tones
+INTRO_SECONDS = 5     # every song opens with the bare loop
+
+
+# ==== CORPUS ====
+def _beat_loop(sr=SR):
+    """One bar of decaying tone bursts, identical in every song → very common hashes."""
+    loop = np.zeros(LOOP_HOPS * HOP_LENGTH)
+    beat = len(loop) // len(LOOP_TONES)
+    t = np.arange(beat) / sr
+    for i, freq in enumerate(LOOP_TONES):
+        loop[i * beat:(i + 1) * beat] = np.sin(2 * np.pi * freq * t) * np.exp(-t / 0.08)
+    return loop
+
+
+def synth_song(rng, seconds=SONG_SECONDS, sr=SR):
+    """Bare beat-loop intro, then two voices of random harmonic notes over the loop; mono float32."""
+    n = int(seconds * sr)
+    y = np.resize(_beat_loop(sr), n)
+    for _ in range(2):
+        pos = int(INTRO_SECONDS * sr)
+        while pos < n:
+            length = int(rng.uniform(0.15, 0.5) * sr)
+            freq = rng.uniform(200, 4000)
+            t = np.arange(min(length, n - pos)) / sr
+            env = np.exp(-3 * t / (length / sr))
+            note = sum(np.sin(2 * np.pi * freq * h * t) / h for h in (1, 2, 3))
+            y[pos:pos + len(t)] += rng.uniform(0.3, 1.0) * env * note
+            pos += length
+    y += 0.0005 * rng.standard_normal(n)
+    return (y / np.abs(y).max()).astype(np.float32)
+
+
+def make_corpus(n_songs=SONGS, seconds=SONG_SECONDS, seed=0, prefix="synth"):
+    rng = np.random.default_rng([seed, len(prefix)])
+    return {f"{prefix}_{i:03d}": synth_song(rng, seconds) for i in range(n_songs)}
+
+
+def load_corpus(song_dir, names=None, max_songs=None):
+    """Decode audio files (all, or only `names`) to mono float32 at SR."""
+    import librosa
+    files = sorted(f for f in os.listdir(song_dir) if f.lower().endswith(SONG_EXTENSIONS))
+    if names is not None:
+        files = [f for f in files if f in set(names)]
+    corpus = {}
+    for name in files[:max_songs]:
+        y, _ = librosa.load(os.path.join(song_dir, name), sr=SR, mono=True)
+        corpus[name] = y.astype(np.float32)
+    return corpus
+
+
+def benchmark_corpus(corpus="synthetic", songs=SONGS, negatives=NEGATIVES, seconds=SONG_SECONDS, seed=0,
+                     song_dir="songs", index_path=INDEX_DIR, db=None):
+    """
+    (indexed audio, unindexed audio, db) for a corpus kind; db is None unless
+    corpus="index" (the caller builds a throwaway index from the audio).
+    """
+    if corpus == "synthetic":
+        audio = make_corpus(songs, seconds, seed)
+        unknown = make_corpus(negatives, seconds, seed, prefix="unindexed")
+    elif corpus == "songs":
+        files = load_corpus(song_dir, max_songs=songs + negatives)
+        names = sorted(files)
+        audio = {name: files[name] for name in names[:songs]}
+        unknown = {name: files[name] for name in names[songs:]}
+    elif corpus == "index":
+        if db is None:
+            from fingerprint_train import BUILD_PARAMS
+            db = open_index(index_path, params=BUILD_PARAMS)
+        audio = load_corpus(song_dir, names=db.songs, max_songs=songs)
+        unknown = {}
+    else:
+        raise ValueError(f"Unknown corpus {corpus!r}; expected synthetic, songs or index")
+    if not audio:
+        raise ValueError(f"No songs to benchmark ({corpus} corpus)")
+    return audio, unknown, db
+
+
+def build_index(corpus):
+    """Fingerprint every song with the training front-end into an in-memory index."""
+    from fingerprint_train import fingerprint_audio
+    builder = IndexBuilder()
+    for name, y in corpus.items():
+        builder.add(name, *fingerprint_audio(y, name=name))
+    index = builder.build()
+    return SegmentedIndex([index], [set()], generation=0, params=index.params)
+
+
+# ==== DEGRADATION ====
+def apply_gain(y, gain_db):
+    return np.clip(y * 10 ** (gain_db / 20), -1.0, 1.0) if gain_db else y
+
+
+def add_noise(y, snr_db, rng):
+    if snr_db is None:
+        return y
+    noise = rng.standard_normal(len(y))
+    scale = np.sqrt(np.mean(y ** 2) / (np.mean(noise ** 2) * 10 ** (snr_db / 10)))
+    return y + scale * noise
+
+
+def apply_codec(y, codec, sr=SR):
+    """Simulate a lossy channel; everything except "ogg" is plain NumPy/SciPy."""
+    if codec == "none":
+        return y
+    from scipy.signal import resample_poly
+    if codec == "lowpass":
+        y = resample_poly(resample_poly(y, 8000, sr), sr, 8000)   # ≈ 4 kHz bandwidth
+        return np.round(y * 127) / 127
+    if codec == "telephone":
+        mu = 255.0
+        narrow = np.clip(resample_poly(y, 8000, sr), -1.0, 1.0)
+        coded = np.round(np.sign(narrow) * np.log1p(mu * np.abs(narrow)) / np.log1p(mu) * 127) / 127
+        return resample_poly(np.sign(coded) * np.expm1(np.abs(coded) * np.log1p(mu)) / mu, sr, 8000)
+    if codec == "ogg":
+        import io
+        import soundfile as sf
+        buf = io.BytesIO()
+        sf.write(buf, np.clip(y, -1.0, 1.0), sr, format="OGG", subtype="VORBIS")
+        buf.seek(0)
+        return sf.read(buf, dtype="float32")[0][:len(y)]
+    raise ValueError(f"Unknown codec {codec!r}; expected one of {', '.join(CODECS)}")
+
+
+def degrade(y, rng, snr_db=SNR_DB, gain_db=GAIN_DB, codec=CODEC):
+    y = apply_gain(np.asarray(y, dtype=np.float64), gain_db)
+    y = apply_codec(y, codec)
+    return add_noise(y, snr_db, rng).astype(np.float32)
+
+
+def make_queries(corpus, n_queries=QUERIES, clip_seconds=CLIP_SECONDS, seed=0, **degradation):
+    """Seeded clips cut from random positions: dicts with song, start_frame and clip."""
+    rng = np.random.default_rng([seed, n_queries])
+    names = list(corpus)
+    clip = int(clip_seconds * SR)
+    queries = []
+    for _ in range(n_queries):
+        name = names[rng.integers(len(names))]
+        start = int(rng.integers(0, max(len(corpus[name]) - clip, 1)))
+        queries.append({
+            "song": name,
+            "start_frame": start / HOP_LENGTH,
+            "clip": degrade(corpus[name][start:start + clip], rng, **degradation),
+        })
+    return queries
+
+
+# ==== RUN ====
+def _recognize(db, query, max_postings, idf, verify=VERIFY):
+    import live_recognize
+    start = time.perf_counter()
+    result = live_recognize.recognize_audio(query["clip"], db, max_postings=max_postings, idf=idf, verify=verify)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_queries(db, queries, workers=1, max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING, verify=VERIFY):
+    """Recognize every query (workers > 1: concurrently). Returns (per-query records, wall seconds)."""
+    if queries:
+        _recognize(db, queries[0], max_postings, idf, verify)   # warm-up: imports, engine buffers
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(lambda q: _recognize(db, q, max_postings, idf, verify), queries))
+    else:
+        outcomes = [_recognize(db, q, max_postings, idf, verify) for q in queries]
+    wall = time.perf_counter() - start
+
+    records = []
+    for query, (result, ms) in zip(queries, outcomes):
+        top = result[0] if result else None
+        records.append({
+            "song": query["song"],
+            "predicted": top["song"] if top else None,
+            "votes": top["votes"] if top else 0,
+            "offset_error": abs(top["offset"] - query["start_frame"]) if top else None,
+            "top3": bool(result) and query["song"] in [m["song"] for m in result],
+            "ms": ms,
+        })
+    return records, wall
+
+
+def summarize(records, wall, negatives=()):
+    """Accuracy and latency figures for one run (negatives: records of unindexed songs)."""
+    if not records:
+        return {"queries": 0}
+    ms = np.array([r["ms"] for r in records])
+    correct = [r for r in records if r["predicted"] == r["song"]]
+    landed = [r for r in correct if r["offset_error"] <= OFFSET_TOLERANCE]
+    summary = {
+        "queries": len(records),
+        "accuracy": round(len(correct) / len(records), 4),
+        "top3_accuracy": round(sum(r["top3"] for r in records) / len(records), 4),
+        "offset_accuracy": round(len(landed) / len(records), 4),
+        "wrong_match_rate": round(sum(r["predicted"] not in (None, r["song"]) for r in records) / len(records), 4),
+        "latency_ms": {
+            "mean": round(float(ms.mean()), 2),
+            "p50": round(float(np.percentile(ms, 50)), 2),
+            "p95": round(float(np.percentile(ms, 95)), 2),
+            "p99": round(float(np.percentile(ms, 99)), 2),
+            "max": round(float(ms.max()), 2),
+        },
+        "throughput_qps": round(len(records) / wall, 2) if wall else None,
+    }
+    if negatives:
+        votes = np.array([r["votes"] for r in negatives], dtype=np.float64)
+        summary["false_match_rate"] = round(float((votes >= FALSE_MATCH_VOTES).mean()), 4)
+        summary["negatives_answered"] = round(sum(r["predicted"] is not None for r in negatives) / len(negatives), 4)
+        summary["negative_votes"] = {"p50": float(np.percentile(votes, 50)),
+                                     "p95": float(np.percentile(votes, 95)), "max": float(votes.max())}
+    return summary
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def index_size(db, path=None):
+    size = {"songs": len(db.songs), "keys": len(db), "postings": db.num_postings, "bytes": db.nbytes}
+    if path and os.path.isdir(path):
+        size["disk_bytes"] = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    elif path and os.path.isfile(path):
+        size["disk_bytes"] = os.path.getsize(path)
+    return size
+
+
+def compare_stop_lists(db, queries, max_postings):
+    """Accuracy/latency/fan-out for baseline, stop-list, IDF and both."""
+    from live_recognize import query_hashes
+    hashes = [query_hashes(q["clip"])[0] for q in queries]
+    configs = {"baseline": (0, False), "stop-list": (max_postings, False),
+               "idf": (0, True), "stop+idf": (max_postings, True)}
+    report = {}
+    for label, (cap, idf) in configs.items():
+        records, wall = run_queries(db, queries, max_postings=cap, idf=idf)
+        row = summarize(records, wall)
+        report[label] = {
+            "max_postings": cap, "idf": idf,
+            "accuracy": row["accuracy"], "latency_ms": row["latency_ms"],
+            "postings": int(sum(len(db.lookup(h, max_postings=cap)[0]) for h in hashes)),
+        }
+    return report
+
+
+# ==== SUITE ====
+def run_benchmark(corpus="synthetic", songs=SONGS, seconds=SONG_SECONDS, queries=QUERIES,
+                  negatives=NEGATIVES, clip_seconds=CLIP_SECONDS, snr_db=SNR_DB, gain_db=GAIN_DB,
+                  codec=CODEC, workers=1, seed=0, song_dir="songs", index_path=INDEX_DIR,
+                  max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING, stop_list=False, db=None,
+                  verify=VERIFY):
+    """
+    Build (or open) an index, run the seeded query set and return the report dict.
+    corpus="index" with `db` given uses that snapshot instead of opening index_path.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}; expected one of {', '.join(CODECS)}")
+    started = time.perf_counter()
+    audio, unknown, db = benchmark_corpus(corpus, songs, negatives, seconds, seed, song_dir, index_path, db)
+
+    build_seconds = None
+    if db is None:
+        build_start = time.perf_counter()
+        db = build_index(audio)
+        build_seconds = round(time.perf_counter() - build_start, 2)
+
+    degradation = {"snr_db": snr_db, "gain_db": gain_db, "codec": codec}
+    query_set = make_queries(audio, queries, clip_seconds, seed, **degradation)
+    negative_set = make_queries(unknown, negatives, clip_seconds, seed, **degradation) if unknown else []
+
+    records, wall = run_queries(db, query_set, workers, max_postings, idf, verify)
+    negative_records, _ = run_queries(db, negative_set, 1, max_postings, idf, verify)
+
+    report = {
+        "params": {
+            "corpus": corpus, "songs": len(audio), "song_seconds": seconds, "queries": queries,
+            "negatives": len(negative_set), "clip_seconds": clip_seconds, "seed": seed,
+            "workers": workers, "max_postings": max_postings, "idf": idf, "verify": verify,
+            "hash_scheme": HASH_SCHEME, "index_params": db.params, **degradation,
+        },
+        "results": summarize(records, wall, negative_records),
+        "index": dict(index_size(db, index_path if corpus == "index" else None),
+                      build_seconds=build_seconds),
+        "peak_rss_mb": peak_rss_mb(),
+        "total_seconds": None,
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "machine": platform.machine(), "cpus": os.cpu_count()},
+    }
+    if stop_list:
+        # a small catalogue never reaches the service's absolute cap
+        report["stop_list"] = compare_stop_lists(db, query_set, min(max_postings, 5 * len(audio)))
+    report["total_seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def compare_reports(report, baseline):
+    """Deltas of the headline numbers: {metric: (baseline, current, change)}."""
+    def pick(r):
+        res = r.get("results", {})
+        lat = res.get("latency_ms", {})
+        return {
+            "accuracy": res.get("accuracy"), "offset_accuracy": res.get("offset_accuracy"),
+            "wrong_match_rate": res.get("wrong_match_rate"), "false_match_rate": res.get("false_match_rate"),
+            "negatives_answered": res.get("negatives_answered"),
+            "p50_ms": lat.get("p50"), "p95_ms": lat.get("p95"), "p99_ms": lat.get("p99"),
+            "throughput_qps": res.get("throughput_qps"), "peak_rss_mb": r.get("peak_rss_mb"),
+            "index_bytes": r.get("index", {}).get("bytes"),
+        }
+    old, new = pick(baseline), pick(report)
+    return {k: (old[k], new[k], None if old[k] is None or new[k] is None else round(new[k] - old[k], 4))
+            for k in new}
+
+
+# ==== MAIN ENTRY ====
+def print_report(report):
+    p, r, idx = report["params"], report["results"], report["index"]
+    lat = r["latency_ms"]
+    print(f"\n📋 {p['corpus']} corpus: {p['songs']} songs, {p['queries']} clips × {p['clip_seconds']:g} s "
+          f"(snr {p['snr_db']} dB, gain {p['gain_db']:g} dB, codec {p['codec']}, seed {p['seed']})")
+    print(f"🎯 accuracy {r['accuracy']:.1%}  top-3 {r['top3_accuracy']:.1%}  offset {r['offset_accuracy']:.1%}"
+          + f"  wrong {r['wrong_match_rate']:.1%}"
+          + (f"  false matches {r['false_match_rate']:.1%}  negatives answered {r['negatives_answered']:.1%}"
+             if "false_match_rate" in r else ""))
+    print(f"⏱️ latency p50 {lat['p50']} ms  p95 {lat['p95']} ms  p99 {lat['p99']} ms  "
+          f"→ {r['throughput_qps']} queries/s with {p['workers']} worker(s)")
+    print(f"💾 index {idx['postings']} postings, {idx['bytes'] / 1e6:.1f} MB"
+          + (f", built in {idx['build_seconds']} s" if idx.get("build_seconds") is not None else "")
+          + (f"  |  peak RSS {report['peak_rss_mb']} MB" if report["peak_rss_mb"] else ""))
+    if "stop_list" in report:
+        print(f"\n{'config':<12}{'accuracy':>10}{'p50 ms':>10}{'p95 ms':>10}{'postings':>12}")
+        for label, row in report["stop_list"].items():
+            print(f"{label:<12}{row['accuracy']:>10.1%}{row['latency_ms']['p50']:>10.2f}"
+                  f"{row['latency_ms']['p95']:>10.2f}{row['postings']:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproducible recognition accuracy/latency benchmark.")
+    parser.add_argument("--corpus", choices=("synthetic", "songs", "index"), default="synthetic")
+    parser.add_argument("--songs", type=int, default=SONGS, help="songs to index (and load)")
+    parser.add_argument("--seconds", type=float, default=SONG_SECONDS, help="synthetic song length")
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--negatives", type=int, default=NEGATIVES, help="clips of unindexed songs")
+    parser.add_argument("--clip", type=float, default=CLIP_SECONDS, help="clip length in seconds")
+    parser.add_argument("--snr", type=float, default=SNR_DB, help="white-noise SNR in dB")
+    parser.add_argument("--gain", type=float, default=GAIN_DB, help="gain in dB before clipping")
+    parser.add_argument("--codec", choices=CODECS, default=CODEC)
+    parser.add_argument("--workers", type=int, default=1, help="concurrent recognition threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--song-dir", default="songs")
+    parser.add_argument("--index", default=INDEX_DIR, help="index path for --corpus index")
+    parser.add_argument("--max-postings", type=int, default=MAX_POSTINGS)
+    parser.add_argument("--idf", action="store_true", default=IDF_WEIGHTING)
+    parser.add_argument("--verify", action="store_true", default=VERIFY,
+                        help="run the second-pass verification (match_verify)")
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="skip the second-pass verification")
+    parser.add_argument("--stop-list", action="store_true", help="also compare stop-list/IDF voting")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        corpus=args.corpus, songs=args.songs, seconds=args.seconds, queries=args.queries,
+        negatives=args.negatives, clip_seconds=args.clip, snr_db=args.snr, gain_db=args.gain,
+        codec=args.codec, workers=args.workers, seed=args.seed, song_dir=args.song_dir,
+        index_path=args.index, max_postings=args.max_postings, idf=args.idf, stop_list=args.stop_list,
+        verify=args.verify,
+    )
+    print_report(report)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            deltas = compare_reports(report, json.load(f))
+        report["baseline"] = {"path": args.baseline, "deltas": deltas}
+        print(f"\n📈 vs {args.baseline}:")
+        for metric, (old, new, change) in deltas.items():
+            print(f"   {metric:<18}{str(old):>14} → {str(new):<14}" + (f" ({change:+g})" if change is not None else ""))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.json}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# fingerprint_core.py
+"""
+Shared Fingerprint Core
+Spectrogram → constellation → peak-pair hashes, used by both training
+(fingerprint_train) and recognition (live_recognize).
+
+Each pair of peaks (f1, t1) → (f2, t2) is packed into one uint32 hash:
+
+    bit  31 ........................................ 0
+         [  unused  ][ f1 : F_BITS ][ f2 : F_BITS ][ dt : DT_BITS ]
+
+and stored together with its anchor frame t1.
+"""
+
+import threading, time
+import numpy as np
+
+# ==== CONFIG ====
+SR = 22050            # lower sample rate saves memory but keeps accuracy
+N_FFT = 1024          # FFT window size, fixes the number of frequency bins
+HOP_LENGTH = 512      # hop length for STFT
+PEAK_NEIGHBORHOOD = (10, 10)  # local maximum neighborhood (freq bins, frames)
+FREQ_BIN_IGNORE = 3   # ignore the very lowest frequencies
+FAN_VALUE = 10        # number of right-side peaks to link for hashing
+DT_MAX = 200          # max time delta (frames) for linking peaks
+AMP_MIN = -25         # fixed dB threshold (relative to the loudest bin)
+ADAPTIVE_PERCENTILE = 85   # adaptive threshold: top 15% brightest bins
+MIN_PEAK_AMPLITUDE = -25   # queries: adaptive threshold never drops below this
+MAX_QUERY_PEAKS = 1000     # queries: keep only the strongest peaks per threshold
+TOP_DB = 80.0         # dynamic range floor, as librosa.amplitude_to_db
+
+F_BITS = (N_FFT // 2).bit_length()   # bins 0 .. N_FFT // 2
+DT_BITS = DT_MAX.bit_length()        # dt 1 .. DT_MAX
+HASH_DTYPE = np.uint32
+TIME_DTYPE = np.uint32
+HASH_SCHEME = f"pair-u32-{F_BITS}.{F_BITS}.{DT_BITS}"   # recorded in the index header
+
+assert 2 * F_BITS + DT_BITS <= 32, "hash layout does not fit in uint32"
+
+# frames before/after t that the time-axis max filter reads (scipy's even-size window)
+LOCAL_MAX_CONTEXT = (PEAK_NEIGHBORHOOD[1] // 2, (PEAK_NEIGHBORHOOD[1] - 1) // 2)
+
+
+# ==== HASH PACKING ====
+def pack_hashes(f1, f2, dt):
+    """Pack (f1, f2, dt) integer arrays into uint32 hashes."""
+    f1 = np.asarray(f1, dtype=np.uint32)
+    f2 = np.asarray(f2, dtype=np.uint32)
+    dt = np.asarray(dt, dtype=np.uint32)
+    return ((f1 << (F_BITS + DT_BITS)) | (f2 << DT_BITS) | dt).astype(HASH_DTYPE)
+
+
+def unpack_hashes(hashes):
+    """Inverse of pack_hashes: returns (f1, f2, dt) arrays."""
+    h = np.asarray(hashes, dtype=np.uint32)
+    f_mask = (1 << F_BITS) - 1
+    dt_mask = (1 << DT_BITS) - 1
+    return (h >> (F_BITS + DT_BITS)) & f_mask, (h >> DT_BITS) & f_mask, h & dt_mask
+
+
+# ==== PEAK-PAIR HASHING ====
+def _sort_peaks(peaks):
+    """(N, 2) int64 array of (f, t) peaks ordered by (t, f)."""
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
+    return peaks[np.lexsort((peaks[:, 0], peaks[:, 1]))]
+
+
+def _link_peaks(f, t, fan_value, dt_max, first_partner=0, n_anchors=None):
+    """
+    Pair each peak with the next `fan_value` peaks; partners before first_partner
+    are skipped, and only the first n_anchors peaks (default: all) act as anchors.
+    """
+    n = len(t)
+
+    # (n_anchors, fan_value) grid of partner indices: row i holds i+1 .. i+fan_value
+    anchor = np.arange(n if n_anchors is None else n_anchors)[:, None]
+    partner = anchor + np.arange(1, fan_value + 1)[None, :]
+    valid = (partner < n) & (partner >= first_partner)
+    partner = np.minimum(partner, max(n - 1, 0))
+    dt = t[partner] - t[anchor]
+    valid &= (dt > 0) & (dt <= dt_max)
+
+    rows, cols = np.nonzero(valid)   # row-major → anchor-major, like the loop
+    hashes = pack_hashes(f[rows], f[partner[rows, cols]], dt[rows, cols])
+    return hashes, t[rows].astype(TIME_DTYPE)
+
+
+def generate_hashes(peaks, fan_value=FAN_VALUE, dt_max=DT_MAX):
+    """
+    Generate peak-pair hashes (Shazam-like), fully vectorized.
+    peaks: sequence of (f, t) pairs or an (N, 2) array.
+    Peaks are ordered by (t, f); each peak is linked to the next `fan_value`
+    peaks, keeping pairs with 0 < dt <= dt_max.
+    Returns (hashes, anchor_times) arrays in the same order the
+    per-peak loop would emit them.
+    """
+    peaks = _sort_peaks(peaks)
+    return _link_peaks(peaks[:, 0], peaks[:, 1], fan_value, dt_max)
+
+
+def extend_hashes(context, new_peaks, fan_value=FAN_VALUE, dt_max=DT_MAX):
+    """
+    Incremental generate_hashes for peaks that arrive in time order.
+    context: the last `fan_value` peaks already hashed (as returned by the previous call).
+    new_peaks: peaks that all sort after the context.
+    Returns (hashes, anchor_times, new_context); over a whole stream this emits
+    exactly the pairs of generate_hashes, grouped by the later peak's batch.
+    """
+    context = np.asarray(context, dtype=np.int64).reshape(-1, 2)
+    peaks = np.concatenate([context, _sort_peaks(new_peaks)])
+    hashes, times = _link_peaks(peaks[:, 0], peaks[:, 1], fan_value, dt_max, first_partner=len(context))
+    return hashes, times, peaks[-fan_value:]
+
+
+def carry_hashes(pending, new_peaks, final=False, fan_value=FAN_VALUE, dt_max=DT_MAX):
+    """
+    Incremental generate_hashes that keeps the whole-file (anchor-major) order.
+    pending: peaks not yet used as anchors (as returned by the previous call).
+    new_peaks: peaks that all sort after pending. A peak is used as an anchor once
+    its `fan_value` partners are known; final=True flushes the rest.
+    Returns (hashes, anchor_times, pending); concatenated over a stream this is
+    exactly generate_hashes of all peaks.
+    """
+    pending = np.asarray(pending, dtype=np.int64).reshape(-1, 2)
+    peaks = np.concatenate([pending, _sort_peaks(new_peaks)])
+    ready = len(peaks) if final else max(len(peaks) - fan_value, 0)
+    hashes, times = _link_peaks(peaks[:, 0], peaks[:, 1], fan_value, dt_max, n_anchors=ready)
+    return hashes, times, peaks[ready:]
+
+
+# ==== CONSTELLATION ENGINE ====
+def hann_window(n):
+    """Periodic Hann window, the same values as scipy.signal.get_window("hann", n, fftbins=True)."""
+    # scipy builds it as general_cosine over n + 1 points and drops the last; importing
+    # scipy.signal for this alone costs about a second of startup
+    fac = np.linspace(-np.pi, np.pi, n + 1)
+    w = np.zeros(n + 1)
+    w += 0.5
+    w += 0.5 * np.cos(fac)
+    return w[:n]
+
+
+class ConstellationEngine:
+    """
+    Spectrogram → constellation map, shared by training and queries.
+    - The STFT window is built once; the padded-signal buffer is reused across calls.
+    - One separable max filter feeds both the adaptive and the fixed threshold.
+    - The percentile threshold uses np.partition instead of a full sort.
+    - Peaks come out as (N, 2) int arrays of (f, t).
+    - `timings` holds per-stage milliseconds of the last call.
+    Not thread-safe: use get_engine() for a per-thread instance.
+    """
+
+    def __init__(self, n_fft=N_FFT, hop_length=HOP_LENGTH):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = hann_window(n_fft).astype(np.float32)
+        self._buf = np.zeros(0, dtype=np.float32)
+        self.timings = {}
+
+    def _stage(self, name, start):
+        now = time.perf_counter()
+        self.timings[name] = round((now - start) * 1000, 3)
+        return now
+
+    # ---- spectrogram ----
+    def magnitude(self, y):
+        """|STFT| with centred zero padding (librosa.stft defaults). y: (N,) or (B, N)."""
+        y = np.asarray(y, dtype=np.float32)
+        pad = self.n_fft // 2
+        n = y.shape[-1] + 2 * pad
+        if y.ndim == 1:
+            if len(self._buf) < n:
+                self._buf = np.zeros(n, dtype=np.float32)
+            padded = self._buf[:n]
+            padded[:pad] = 0.0
+            padded[pad:n - pad] = y
+            padded[n - pad:] = 0.0
+        else:
+            padded = np.zeros(y.shape[:-1] + (n,), dtype=np.float32)
+            padded[..., pad:n - pad] = y
+        n_frames = 1 + (n - self.n_fft) // self.hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.n_fft, axis=-1)
+        frames = frames[..., ::self.hop_length, :][..., :n_frames, :]
+        return np.abs(np.fft.rfft(frames * self.window, axis=-1)).swapaxes(-1, -2)
+
+    @staticmethod
+    def to_db(S, ref=None, top_db=TOP_DB, floor=None):
+        """
+        Same math as librosa.amplitude_to_db(S + 1e-6, ref=np.max).
+        A block of a longer signal passes the whole signal's ref (max of S + 1e-6)
+        and floor (max dB - top_db) to get exactly the whole-signal values.
+        """
+        power = np.square(S + 1e-6)
+        ref_power = np.square(np.max(S + 1e-6) if ref is None else ref)
+        S_db = 10.0 * np.log10(np.maximum(1e-10, power))
+        S_db -= 10.0 * np.log10(np.maximum(1e-10, ref_power))
+        if floor is None and top_db is not None:
+            floor = S_db.max() - top_db
+        if floor is not None:
+            S_db = np.maximum(S_db, floor)
+        return S_db
+
+    def spectrogram_db(self, y):
+        start = time.perf_counter()
+        S = self.magnitude(y)
+        start = self._stage("stft_ms", start)
+        S_db = self.to_db(S)
+        self._stage("db_ms", start)
+        return S_db
+
+    # ---- peaks ----
+    @staticmethod
+    def local_max(S_db):
+        """
+        Local-maximum mask for a PEAK_NEIGHBORHOOD box, as two 1-D max passes
+        (same result as maximum_filter(footprint=ones), edges mirrored).
+        Frame t sees frames t-5 .. t+4 (LOCAL_MAX_CONTEXT), so a streaming caller
+        that keeps that much context around a block gets the same mask as the
+        whole-file pass.
+        """
+        from scipy.ndimage import maximum_filter1d   # deferred: ~0.4 s import, warm_up() pays it
+
+        size_f, size_t = PEAK_NEIGHBORHOOD
+        filtered = maximum_filter1d(S_db, size_f, axis=0, mode="reflect")
+        filtered = maximum_filter1d(filtered, size_t, axis=1, mode="reflect")
+        return filtered == S_db
+
+    @staticmethod
+    def percentile_ranks(n, q=ADAPTIVE_PERCENTILE):
+        """(lo, hi, gamma): np.percentile's linear method reads sorted[lo] and sorted[hi]."""
+        virtual = q / 100 * (n - 1)
+        lo = int(np.floor(virtual))
+        return lo, min(lo + 1, n - 1), virtual - lo
+
+    @staticmethod
+    def interpolate(a, b, gamma):
+        """np.percentile's lerp between the two order statistics (same rounding)."""
+        gamma = np.asarray(gamma, dtype=a.dtype)
+        diff = b - a
+        return b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma
+
+    @classmethod
+    def percentile(cls, S_db, q=ADAPTIVE_PERCENTILE):
+        """np.percentile(S_db, q) (linear interpolation) via np.partition."""
+        flat = S_db.ravel()
+        lo, hi, gamma = cls.percentile_ranks(len(flat), q)
+        part = np.partition(flat, (lo, hi))
+        return cls.interpolate(part[lo], part[hi], gamma)
+
+    @staticmethod
+    def _select(S_db, mask, limit=None):
+        """(f, t) peaks of a mask above FREQ_BIN_IGNORE, optionally only the `limit` strongest."""
+        mask[:FREQ_BIN_IGNORE] = False
+        freqs, times = np.nonzero(mask)
+        if limit is not None and len(freqs) > limit:
+            strongest = np.argsort(S_db[freqs, times])[-limit:]
+            freqs, times = freqs[strongest], times[strongest]
+        return np.stack([freqs, times], axis=1)
+
+    def peaks(self, S_db, mode="train"):
+        """
+        Constellation map of a dB spectrogram.
+        mode="train": local maxima in the top (100 - ADAPTIVE_PERCENTILE)% bins.
+        mode="query": union of adaptive (>= max(percentile, MIN_PEAK_AMPLITUDE)) and
+                      fixed (>= AMP_MIN) peaks, each capped to MAX_QUERY_PEAKS.
+        """
+        start = time.perf_counter()
+        local_max = self.local_max(S_db)
+        start = self._stage("max_filter_ms", start)
+        thresh = self.percentile(S_db)
+        start = self._stage("threshold_ms", start)
+
+        if mode == "train":
+            peaks = self._select(S_db, local_max & (S_db >= thresh))
+        else:
+            adaptive = self._select(S_db, local_max & (S_db >= max(thresh, MIN_PEAK_AMPLITUDE)), MAX_QUERY_PEAKS)
+            fixed = self._select(S_db, local_max & (S_db >= AMP_MIN), MAX_QUERY_PEAKS)
+            n_t = S_db.shape[1]
+            cells = np.union1d(adaptive[:, 0] * n_t + adaptive[:, 1], fixed[:, 0] * n_t + fixed[:, 1])
+            peaks = np.stack(np.divmod(cells, n_t), axis=1)
+        self._stage("peaks_ms", start)
+        return peaks
+
+    def hashes(self, S_db, mode="train"):
+        """Constellation + peak-pair hashes → (hashes, anchor_times)."""
+        peaks = self.peaks(S_db, mode)
+        start = time.perf_counter()
+        out = generate_hashes(peaks)
+        self._stage("hash_ms", start)
+        self.timings["peaks"] = len(peaks)
+        return out
+
+
+_local = threading.local()
+
+
+def get_engine():
+    """Per-thread ConstellationEngine (buffers are reused, so engines aren't shared)."""
+    engine = getattr(_local, "engine", None)
+    if engine is None:
+        engine = _local.engine = ConstellationEngine()
+    return engine
@@ -0,0 +1,432 @@
+# fingerprint_index.py
+"""
+Compact Fingerprint Index
+Replaces the pickled {sha1_hex: [(song, t), ...]} dict with packed NumPy arrays.
+
+Layout (CSR-style):
+    keys[k]                      → unique hash key, sorted ascending
+    offsets[k] : offsets[k + 1]  → slice of postings belonging to keys[k]
+    song_ids[p], times[p]        → one posting (interned song ID, anchor frame)
+    songs[song_id]               → song name
+
+On disk the arrays live in one file behind a small JSON header, each array
+page-aligned so the file can be opened with np.memmap: startup is near-instant
+and every worker process shares the same physical pages via the page cache.
+
+    [MAGIC][u32 header length][JSON header][pad] [keys][pad] [offsets] ...
+
+Optional constellation store (for match verification, see match_verify):
+    peaks[peak_offsets[s] : peak_offsets[s + 1]]  → song s's peaks, packed
+                                                    (t << F_BITS) | f, sorted
+It is recovered from the postings themselves (every hash encodes both of its
+peaks), so builds need no extra input; files without it still load.
+
+Usage:
+    python fingerprint_index.py convert fingerprints_db.pkl [fingerprints_index]
+
+convert writes the legacy pickle as the base segment of a SegmentStore
+directory (the one live_recognize serves), replacing any segments already
+there; an output path ending in .fpidx writes a single standalone file instead.
+"""
+
+import os, json, pickle, struct, hashlib
+import numpy as np
+from fingerprint_core import unpack_hashes, F_BITS
+
+# ==== CONFIG ====
+INDEX_PATH = "fingerprints_index.fpidx"
+FORMAT_VERSION = 1
+MAGIC = b"SRNFPIDX"
+ALIGN = 4096          # page alignment for every array section
+KEY_DTYPE = np.uint32      # packed peak-pair hash, see fingerprint_core
+SONG_DTYPE = np.uint32
+TIME_DTYPE = np.uint32
+OFFSET_DTYPE = np.int64
+ARRAY_NAMES = ("keys", "offsets", "song_ids", "times")
+PEAK_ARRAYS = ("peaks", "peak_offsets")   # optional, older files don't have them
+PEAK_DTYPE = np.uint32
+STATS_TOP = 20        # heaviest keys listed in the header's posting stats
+
+
+class IndexFormatError(ValueError):
+    """Raised when an index file is corrupt or was built with other parameters."""
+
+
+# ==== INDEX ====
+class FingerprintIndex:
+    """Read-only posting index over sorted hash keys."""
+
+    def __init__(self, keys, offsets, song_ids, times, songs, params=None, stats=None,
+                 peaks=None, peak_offsets=None):
+        self.keys = keys
+        self.offsets = offsets
+        self.song_ids = song_ids
+        self.times = times
+        self.peaks = peaks
+        self.peak_offsets = peak_offsets
+        self.songs = list(songs)
+        self.params = dict(params or {})
+        self._stats = stats
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def num_postings(self):
+        return len(self.song_ids)
+
+    @property
+    def nbytes(self):
+        arrays = (self.keys, self.offsets, self.song_ids, self.times, self.peaks, self.peak_offsets)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def song_name(self, song_id):
+        return self.songs[int(song_id)]
+
+    def song_peaks(self, song_id):
+        """Sorted packed peaks ((t << F_BITS) | f) of one song, or None without a peak store."""
+        if self.peaks is None:
+            return None
+        return self.peaks[self.peak_offsets[song_id]:self.peak_offsets[song_id + 1]]
+
+    @property
+    def stats(self):
+        """Posting-list length statistics (stored in the header at save time)."""
+        if self._stats is None:
+            self._stats = posting_stats(self.keys, np.diff(self.offsets))
+        return self._stats
+
+    def posting_counts(self, query_keys):
+        """Posting-list length of every query key (0 for unknown keys)."""
+        q = np.asarray(query_keys, dtype=self.keys.dtype)
+        counts = np.zeros(len(q), dtype=np.int64)
+        if len(self.keys) and len(q):
+            pos = np.searchsorted(self.keys, q)
+            pos_c = np.minimum(pos, len(self.keys) - 1)
+            found = self.keys[pos_c] == q
+            counts[found] = self.offsets[pos_c[found] + 1] - self.offsets[pos_c[found]]
+        return counts
+
+    def lookup(self, query_keys, max_postings=None):
+        """
+        Gather all postings for the given query keys.
+        Returns (query_idx, song_ids, times) arrays, where query_idx[i] is the
+        position in query_keys that produced posting i.
+        Keys with more than max_postings postings are skipped (stop-list).
+        """
+        q = np.asarray(query_keys, dtype=self.keys.dtype)
+        if not len(self.keys) or not len(q):
+            empty = np.empty(0, dtype=np.intp)
+            return empty, self.song_ids[:0], self.times[:0]
+
+        pos = np.searchsorted(self.keys, q)
+        found = self.keys[np.minimum(pos, len(self.keys) - 1)] == q
+        q_idx = np.flatnonzero(found)
+        k = pos[q_idx]
+
+        starts = self.offsets[k]
+        lengths = self.offsets[k + 1] - starts
+        if max_postings:
+            keep = lengths <= max_postings
+            q_idx, starts, lengths = q_idx[keep], starts[keep], lengths[keep]
+        # expand [start, start + length) ranges without a Python loop
+        run_starts = np.cumsum(lengths) - lengths
+        idx = np.repeat(starts - run_starts, lengths) + np.arange(lengths.sum())
+        return np.repeat(q_idx, lengths), self.song_ids[idx], self.times[idx]
+
+    def postings(self, key):
+        """Return (song_ids, times) for a single hash key."""
+        _, song_ids, times = self.lookup([key])
+        return song_ids, times
+
+    def save(self, path=INDEX_PATH, params=None):
+        """Write the index atomically (tmp file + rename), so open maps stay valid."""
+        params = dict(params if params is not None else self.params)
+        names = ARRAY_NAMES + (PEAK_ARRAYS if self.peaks is not None else ())
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in names}
+
+        header = {"version": FORMAT_VERSION, "params": params, "songs": self.songs,
+                  "stats": self.stats, "arrays": {}}
+        # array offsets depend on header size, so lay out twice until stable
+        header_len = 0
+        while True:
+            pos = _align(len(MAGIC) + 4 + header_len)
+            for name, arr in arrays.items():
+                header["arrays"][name] = {"dtype": arr.dtype.str, "offset": pos, "length": len(arr)}
+                pos = _align(pos + arr.nbytes)
+            blob = json.dumps(header).encode("utf-8")
+            if len(blob) == header_len:
+                break
+            header_len = len(blob)
+
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(blob)) + blob)
+            for name, arr in arrays.items():
+                f.seek(header["arrays"][name]["offset"])
+                f.write(arr.tobytes())
+            f.truncate(pos)
+        os.replace(tmp, path)
+        self.params = params
+
+    @classmethod
+    def load(cls, path=INDEX_PATH, params=None):
+        """
+        Memory-map an index file (zero-copy, read-only).
+        If `params` is given, the build parameters stored in the header must match.
+        """
+        header = read_header(path)
+        if params is not None:
+            check_params(header["params"], params, path)
+
+        arrays = {}
+        for name in ARRAY_NAMES + tuple(n for n in PEAK_ARRAYS if n in header["arrays"]):
+            spec = header["arrays"][name]
+            dtype = np.dtype(spec["dtype"])
+            if spec["length"] == 0:
+                arrays[name] = np.empty(0, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r",
+                                         offset=spec["offset"], shape=(spec["length"],))
+        return cls(songs=header["songs"], params=header["params"], stats=header.get("stats"), **arrays)
+
+    @classmethod
+    def empty(cls):
+        return IndexBuilder().build()
+
+
+def lookup_batch(index, key_arrays, max_postings=None):
+    """
+    One merged lookup for several queries: keys shared between queries are
+    looked up once. Returns one (query_idx, song_ids, times) tuple per query.
+    """
+    sizes = [len(keys) for keys in key_arrays]
+    if not sum(sizes):
+        return [index.lookup(keys) for keys in key_arrays]
+    all_keys = np.concatenate([np.asarray(keys, dtype=KEY_DTYPE) for keys in key_arrays])
+    unique_keys, inverse = np.unique(all_keys, return_inverse=True)
+    inverse = inverse.ravel()
+
+    u_idx, song_ids, times = index.lookup(unique_keys, max_postings=max_postings)
+    order = np.argsort(u_idx, kind="stable")
+    song_ids, times = song_ids[order], times[order]
+    counts = np.bincount(u_idx, minlength=len(unique_keys))
+    starts = np.cumsum(counts) - counts
+
+    # expand postings back to every query hash, then split per query
+    lengths = counts[inverse]
+    run_starts = np.cumsum(lengths) - lengths
+    idx = np.repeat(starts[inverse] - run_starts, lengths) + np.arange(lengths.sum())
+    q_all = np.repeat(np.arange(len(all_keys)), lengths)
+
+    results = []
+    bounds = np.cumsum([0] + sizes)
+    cuts = np.searchsorted(q_all, bounds)
+    for b in range(len(key_arrays)):
+        sel = slice(cuts[b], cuts[b + 1])
+        results.append((q_all[sel] - bounds[b], song_ids[idx[sel]], times[idx[sel]]))
+    return results
+
+
+def posting_stats(keys, counts, top=STATS_TOP):
+    """
+    Summary of posting-list lengths, used to pick a stop-list cap (MAX_POSTINGS).
+    keys/counts: unique keys and their posting counts.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if not len(counts):
+        return {"keys": 0, "postings": 0, "mean": 0.0, "max": 0, "p50": 0, "p90": 0, "p99": 0,
+                "p999": 0, "top": []}
+    heavy = np.argsort(counts, kind="stable")[::-1][:top]
+    p50, p90, p99, p999 = np.percentile(counts, [50, 90, 99, 99.9])
+    return {
+        "keys": int(len(counts)),
+        "postings": int(counts.sum()),
+        "mean": round(float(counts.mean()), 3),
+        "max": int(counts.max()),
+        "p50": float(p50), "p90": float(p90), "p99": float(p99), "p999": float(p999),
+        "top": [[int(keys[i]), int(counts[i])] for i in heavy],
+    }
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def read_header(path):
+    """Read and validate the JSON header of an index file."""
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + 4)
+        if len(prefix) < len(MAGIC) + 4 or prefix[:len(MAGIC)] != MAGIC:
+            raise IndexFormatError(f"{path} is not a fingerprint index file")
+        (header_len,) = struct.unpack("<I", prefix[len(MAGIC):])
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header.get("version") != FORMAT_VERSION:
+        raise IndexFormatError(
+            f"{path} has format version {header.get('version')}, expected {FORMAT_VERSION}")
+    return header
+
+
+def check_params(stored, expected, path="index"):
+    """Raise IndexFormatError if stored build parameters differ from the expected ones."""
+    mismatched = {k: (stored.get(k), v) for k, v in expected.items() if stored.get(k) != v}
+    if mismatched:
+        details = ", ".join(f"{k}={a} (expected {b})" for k, (a, b) in mismatched.items())
+        raise IndexFormatError(f"{path} was built with different parameters: {details}")
+
+
+# ==== BUILDER ====
+class IndexBuilder:
+    """Accumulates per-song hash arrays and builds a FingerprintIndex."""
+
+    def __init__(self, songs=None):
+        self.songs = []
+        self._song_ids = {}
+        self._keys, self._song_col, self._times = [], [], []
+        for name in songs or []:
+            self.song_id(name)
+
+    def song_id(self, name):
+        """Intern a song name and return its integer ID."""
+        sid = self._song_ids.get(name)
+        if sid is None:
+            sid = self._song_ids[name] = len(self.songs)
+            self.songs.append(name)
+        return sid
+
+    def add(self, song, keys, times):
+        """Add all (key, t) postings for one song."""
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        times = np.asarray(times, dtype=TIME_DTYPE)
+        sid = self.song_id(song)
+        self._keys.append(keys)
+        self._song_col.append(np.full(len(keys), sid, dtype=SONG_DTYPE))
+        self._times.append(times)
+        return len(keys)
+
+    def add_index(self, index, exclude=()):
+        """Copy every posting of an existing index, skipping songs in `exclude`."""
+        exclude = set(exclude)
+        remap = np.array(
+            [self.song_id(name) if name not in exclude else -1 for name in index.songs],
+            dtype=np.int64,
+        )
+        lengths = np.diff(index.offsets)
+        keys = np.repeat(index.keys, lengths)
+        new_ids = remap[index.song_ids] if len(remap) else np.empty(0, dtype=np.int64)
+        keep = new_ids >= 0
+        self._keys.append(keys[keep].astype(KEY_DTYPE))
+        self._song_col.append(new_ids[keep].astype(SONG_DTYPE))
+        self._times.append(np.asarray(index.times)[keep].astype(TIME_DTYPE))
+
+    @classmethod
+    def from_index(cls, index, exclude=()):
+        builder = cls()
+        builder.add_index(index, exclude=exclude)
+        return builder
+
+    def build(self):
+        """Sort all postings by (key, song, t) and pack them into CSR arrays."""
+        keys = np.concatenate(self._keys) if self._keys else np.empty(0, KEY_DTYPE)
+        song_col = np.concatenate(self._song_col) if self._song_col else np.empty(0, SONG_DTYPE)
+        times = np.concatenate(self._times) if self._times else np.empty(0, TIME_DTYPE)
+
+        order = np.lexsort((times, song_col, keys))
+        keys, song_col, times = keys[order], song_col[order], times[order]
+
+        unique_keys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(OFFSET_DTYPE)
+        peaks, peak_offsets = constellation_store(keys, song_col, times, len(self.songs))
+        return FingerprintIndex(unique_keys, offsets, song_col, times, self.songs,
+                                peaks=peaks, peak_offsets=peak_offsets)
+
+
+def constellation_store(keys, song_col, times, n_songs):
+    """
+    Per-song peak sets from postings: hash (f1, f2, dt) at t holds peaks
+    (f1, t) and (f2, t + dt). Returns (peaks, peak_offsets), see the module doc.
+    """
+    f1, f2, dt = unpack_hashes(keys)
+    song = np.concatenate([song_col, song_col]).astype(np.uint64)
+    t = np.concatenate([times, times + dt]).astype(np.uint64)
+    f = np.concatenate([f1, f2]).astype(np.uint64)
+    packed = np.unique((song << np.uint64(32)) | (t << np.uint64(F_BITS)) | f)
+    peak_offsets = np.searchsorted(packed >> np.uint64(32), np.arange(n_songs + 1, dtype=np.uint64))
+    return (packed & np.uint64(0xFFFFFFFF)).astype(PEAK_DTYPE), peak_offsets.astype(OFFSET_DTYPE)
+
+
+# ==== MIGRATION ====
+def legacy_hash_map(hex_hashes):
+    """
+    Recover packed keys for legacy SHA1("f1|f2|dt")[:20] hashes.
+    SHA1 can't be inverted, but the (f1, f2, dt) space is small enough to enumerate once.
+    """
+    from fingerprint_core import pack_hashes, N_FFT, DT_MAX
+
+    wanted = set(hex_hashes)
+    found = {}
+    n_bins = N_FFT // 2 + 1
+    for f1 in range(n_bins):
+        for f2 in range(n_bins):
+            prefix = f"{f1}|{f2}|"
+            for dt in range(1, DT_MAX + 1):
+                h = hashlib.sha1((prefix + str(dt)).encode("utf-8")).hexdigest()[:20]
+                if h in wanted:
+                    found[h] = int(pack_hashes(f1, f2, dt))
+        if len(found) == len(wanted):
+            break
+        if f1 % 64 == 0:
+            print(f"   … scanned f1={f1}/{n_bins - 1}, recovered {len(found)}/{len(wanted)} hashes")
+    return found
+
+
+def convert_pickle(pkl_path, out_path=None, params=None):
+    """
+    Convert a legacy fingerprints_db.pkl into the compact index format, stored as the
+    only segment of the SegmentStore at out_path (default INDEX_DIR), or as one file
+    if out_path ends in .fpidx.
+    """
+    with open(pkl_path, "rb") as f:
+        payload = pickle.load(f)
+    db = payload.get("db", {})
+    key_map = legacy_hash_map(db.keys())
+
+    builder = IndexBuilder(payload.get("songs", []))
+    keys, song_col, times = [], [], []
+    for h, entries in db.items():
+        k = key_map.get(h)
+        if k is None:
+            continue
+        for song, t in entries:
+            keys.append(k)
+            song_col.append(builder.song_id(song))
+            times.append(t)
+    builder._keys.append(np.array(keys, dtype=KEY_DTYPE))
+    builder._song_col.append(np.array(song_col, dtype=SONG_DTYPE))
+    builder._times.append(np.array(times, dtype=TIME_DTYPE))
+
+    index = builder.build()
+    if out_path is not None and out_path.endswith(".fpidx"):
+        index.save(out_path, params=params)
+    else:
+        from segment_store import SegmentStore, INDEX_DIR   # imports this module
+        out_path = out_path or INDEX_DIR
+        SegmentStore(out_path, params, strict=False).replace_all(index)
+    print(f"✅ Converted {len(key_map)}/{len(db)} hashes / {index.num_postings} postings "
+          f"for {len(index.songs)} songs → {out_path}")
+    return index
+
+
+# ==== RUN ====
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != "convert":
+        print("Usage: python fingerprint_index.py convert <fingerprints_db.pkl> [index_dir | out.fpidx]")
+        sys.exit(1)
+    from fingerprint_train import BUILD_PARAMS, DB_PATH
+    out = sys.argv[3] if len(sys.argv) > 3 else DB_PATH
+    if not os.path.exists(sys.argv[2]):
+        print(f"❌ File not found: {sys.argv[2]}")
+        sys.exit(1)
+    # legacy pickles were built with the training defaults
+    convert_pickle(sys.argv[2], out, params=BUILD_PARAMS)
@@ -0,0 +1,247 @@
+# fingerprint_stream.py
+"""
+Streaming Fingerprinting (bounded memory for long files)
+Whole-file fingerprinting holds the decoded signal, |STFT| and the dB matrix
+at once, which is gigabytes for an hour-long mix. This mode reads the file in
+blocks and produces exactly the same hashes:
+
+    pass 1  decode blocks (soundfile) → mono → soxr stream resample → STFT frames
+            → |S| spilled to a scratch file, global max of |S| tracked
+    pass 2+ dB blocks from the spill: global dB max (→ top_db floor) and the
+            adaptive percentile by exact histogram selection (a few passes)
+    last    dB blocks with LOCAL_MAX_CONTEXT frames on both sides → peaks
+            → carry_hashes → (hashes, times) per block
+
+Memory stays at a few blocks regardless of duration; the scratch file is
+n_frames x (N_FFT // 2 + 1) float32 and lives only during the call.
+
+Matches librosa.load(path, sr=SR, mono=True) + ConstellationEngine exactly for
+every format libsndfile decodes (soxr's stream resampler is sample-identical
+to soxr.resample). Other formats raise StreamingUnsupported.
+
+Usage:
+    for hashes, times in stream_fingerprint("mix.mp3"):
+        builder.add(song_id, hashes, times)
+"""
+
+import tempfile, time
+import numpy as np
+import soundfile as sf
+from fingerprint_core import ConstellationEngine, carry_hashes, SR, N_FFT, HOP_LENGTH, TOP_DB, \
+    ADAPTIVE_PERCENTILE, LOCAL_MAX_CONTEXT
+
+try:
+    import soxr
+except ImportError:   # comes with librosa >= 0.10; without it only files at SR can stream
+    soxr = None
+
+# ==== CONFIG ====
+READ_BLOCK = 1 << 16         # samples per soundfile read
+BLOCK_FRAMES = 2048          # STFT frames per processing block (~47 s at SR / HOP_LENGTH)
+HIST_BINS = 4096             # buckets per percentile refinement pass
+COLLECT_LIMIT = 1 << 20      # gather candidate values once this few remain
+RESAMPLE_QUALITY = "soxr_hq" # librosa.load's default res_type
+
+
+class StreamingUnsupported(ValueError):
+    """The file can't be streamed with the same result as librosa.load."""
+
+
+# ==== DECODE ====
+def iter_samples(path, sr=SR, blocksize=READ_BLOCK):
+    """
+    Mono float32 blocks at `sr` whose concatenation equals librosa.load(path, sr=sr, mono=True)[0].
+    """
+    try:
+        f = sf.SoundFile(path)
+    except (sf.LibsndfileError, RuntimeError) as e:
+        raise StreamingUnsupported(f"libsndfile can't decode {path}: {e}") from e
+    with f:
+        native_sr = f.samplerate
+        resampler = None
+        if native_sr != sr:
+            if soxr is None:
+                raise StreamingUnsupported("soxr is not installed")
+            resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality=RESAMPLE_QUALITY)
+
+        n_in, n_out, held = 0, 0, np.zeros(0, dtype=np.float32)
+        for block in f.blocks(blocksize=blocksize, dtype="float32", always_2d=True):
+            y = block[:, 0] if block.shape[1] == 1 else np.mean(block, axis=1)   # librosa.to_mono
+            n_in += len(y)
+            if resampler is None:
+                yield y
+                continue
+            # hold a little back: librosa fixes the total length to ceil(n_in * ratio) at the end
+            held = np.concatenate([held, resampler.resample_chunk(y, last=False)])
+            if len(held) > blocksize:
+                out, held = held[:-blocksize], held[-blocksize:]
+                n_out += len(out)
+                yield out
+        if resampler is not None:
+            held = np.concatenate([held, resampler.resample_chunk(np.zeros(0, np.float32), last=True)])
+            target = int(np.ceil(n_in * float(sr) / native_sr)) - n_out
+            if target < 0:
+                raise StreamingUnsupported("resampler overshot the held-back tail")
+            yield held[:target] if len(held) >= target else np.pad(held, (0, target - len(held)))
+
+
+# ==== STFT ====
+def iter_magnitude(samples, engine):
+    """|STFT| blocks (bins, frames) of a sample stream, centred like engine.magnitude."""
+    n_fft, hop = engine.n_fft, engine.hop_length
+    pad = n_fft // 2
+    buf = np.zeros(pad, dtype=np.float32)   # leading centre padding
+
+    def frames_of(buf):
+        n = len(buf)
+        if n < n_fft:
+            return None, buf
+        n_frames = 1 + (n - n_fft) // hop
+        frames = np.lib.stride_tricks.sliding_window_view(buf, n_fft)[::hop][:n_frames]
+        S = np.abs(np.fft.rfft(frames * engine.window, axis=-1)).T
+        return S, buf[n_frames * hop:]
+
+    for y in samples:
+        buf = np.concatenate([buf, y])
+        S, buf = frames_of(buf)
+        if S is not None:
+            yield S
+    S, _ = frames_of(np.concatenate([buf, np.zeros(pad, dtype=np.float32)]))
+    if S is not None:
+        yield S
+
+
+class _Spill:
+    """Frame-major float32 scratch file of |S| so later passes re-read instead of re-decoding."""
+
+    def __init__(self, n_bins):
+        self.n_bins = n_bins
+        self.n_frames = 0
+        self.file = tempfile.TemporaryFile()
+
+    def append(self, S):
+        self.file.write(np.ascontiguousarray(S.T, dtype=np.float32).tobytes())
+        self.n_frames += S.shape[1]
+
+    def read(self, start, stop):
+        """|S| of frames [start, stop) → (bins, frames)."""
+        self.file.seek(start * self.n_bins * 4)
+        data = np.fromfile(self.file, dtype=np.float32, count=(stop - start) * self.n_bins)
+        return data.reshape(stop - start, self.n_bins).T
+
+    def blocks(self, block_frames=BLOCK_FRAMES):
+        for start in range(0, self.n_frames, block_frames):
+            yield start, self.read(start, min(start + block_frames, self.n_frames))
+
+    def close(self):
+        self.file.close()
+
+
+# ==== EXACT PERCENTILE ====
+def order_statistics(passes, ranks, bins=HIST_BINS, limit=COLLECT_LIMIT):
+    """
+    Values at `ranks` (0-based, ascending) of n numbers that only exist as a stream.
+    passes() starts a new pass: an iterable of 1-D blocks. Each pass narrows a
+    value range holding the ranks with a histogram; once at most `limit` values
+    remain, one more pass collects and partitions them. Exact, O(bins + limit) memory.
+    """
+    lo, hi = -np.inf, np.inf   # closed range [lo, hi] known to hold every target rank
+    below = 0                  # values < lo
+    while True:
+        vmin, vmax, count = np.inf, -np.inf, 0
+        for v in passes():
+            v = v[(v >= lo) & (v <= hi)]
+            if len(v):
+                vmin, vmax, count = min(vmin, v.min()), max(vmax, v.max()), count + len(v)
+        lo, hi = vmin, vmax
+        if lo == hi:
+            return [lo] * len(ranks)
+        if count <= limit:
+            kept = np.concatenate([v[(v >= lo) & (v <= hi)] for v in passes()])
+            kept.sort()
+            return [kept[r - below] for r in ranks]
+
+        edges = np.linspace(float(lo), float(hi), bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        for v in passes():
+            v = v[(v >= lo) & (v <= hi)]
+            counts += np.bincount(np.minimum(np.searchsorted(edges, v, side="right") - 1, bins - 1),
+                                  minlength=bins)
+        cumulative = below + np.cumsum(counts)
+        first = int(np.searchsorted(cumulative, ranks[0], side="right"))
+        last = int(np.searchsorted(cumulative, ranks[-1], side="right"))
+        below = int(cumulative[first - 1]) if first else below
+        # bin j holds edges[j] <= v < edges[j + 1] (the last bin also holds hi)
+        lo = edges[first]
+        hi = np.nextafter(edges[last + 1], -np.inf) if last < bins - 1 else hi
+
+
+# ==== PIPELINE ====
+def stream_fingerprint(path, sr=SR, block_frames=BLOCK_FRAMES, engine=None, timings=None, name=None):
+    """
+    Yield (hashes, times) blocks for one file; together they equal
+    fingerprint_train.fingerprint_audio(librosa.load(path, sr=sr)[0]).
+    timings (optional dict) receives per-pass milliseconds.
+    """
+    engine = engine or ConstellationEngine(N_FFT, HOP_LENGTH)
+    timings = {} if timings is None else timings
+    spill = _Spill(engine.n_fft // 2 + 1)
+    try:
+        # pass 1: decode + STFT once, keep |S| on disk
+        start = time.perf_counter()
+        ref = None
+        for S in iter_magnitude(iter_samples(path, sr), engine):
+            spill.append(S)
+            block_max = np.max(S + 1e-6)
+            ref = block_max if ref is None else max(ref, block_max)
+        timings["decode_stft_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if not spill.n_frames:
+            return
+
+        # dB before the top_db floor; the floor and the percentile commute (both monotone)
+        def db_blocks():
+            for _, S in spill.blocks(block_frames):
+                yield engine.to_db(S, ref=ref, top_db=None).ravel()
+
+        start = time.perf_counter()
+        db_min, db_max = np.inf, -np.inf
+        for v in db_blocks():
+            db_min, db_max = min(db_min, v.min()), max(db_max, v.max())
+        floor = db_max - TOP_DB
+        print(f"🎶 {name or path}: dB range {max(db_min, floor):.1f} → {db_max:.1f} "
+              f"(streamed, {spill.n_frames} frames)")
+        n = spill.n_frames * spill.n_bins
+        lo, hi, gamma = engine.percentile_ranks(n, ADAPTIVE_PERCENTILE)
+        a, b = order_statistics(db_blocks, [lo, hi])
+        thresh = engine.interpolate(np.maximum(a, floor), np.maximum(b, floor), gamma)
+        timings["threshold_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+        # last pass: peaks with max-filter context, hashes in whole-file order
+        start = time.perf_counter()
+        before, after = LOCAL_MAX_CONTEXT
+        pending, n_peaks = np.zeros((0, 2), dtype=np.int64), 0
+        for b0 in range(0, spill.n_frames, block_frames):
+            b1 = min(b0 + block_frames, spill.n_frames)
+            c0, c1 = max(b0 - before, 0), min(b1 + after, spill.n_frames)
+            S_db = engine.to_db(spill.read(c0, c1), ref=ref, floor=floor)
+            local_max = engine.local_max(S_db)[:, b0 - c0:b1 - c0]
+            S_db = S_db[:, b0 - c0:b1 - c0]
+            peaks = engine._select(S_db, local_max & (S_db >= thresh))
+            peaks[:, 1] += b0
+            n_peaks += len(peaks)
+            hashes, times, pending = carry_hashes(pending, peaks, final=b1 == spill.n_frames)
+            yield hashes, times
+        timings["peaks_hash_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        timings["peaks"] = n_peaks
+        timings["frames"] = spill.n_frames
+    finally:
+        spill.close()
+
+
+def stream_duration(path):
+    """Seconds of audio per the file header, or None if libsndfile can't read it."""
+    try:
+        info = sf.info(path)
+    except (sf.LibsndfileError, RuntimeError):
+        return None
+    return info.frames / info.samplerate if info.samplerate else None
@@ -1,110 +1,255 @@
 # fingerprint_train.py
 import os
-import pickle
-import hashlib
+import time
 import numpy as np
-import librosa
-from scipy.ndimage import maximum_filter
+from concurrent.futures import ProcessPoolExecutor
+from fingerprint_core import get_engine, SR, N_FFT, HOP_LENGTH, FAN_VALUE, HASH_SCHEME, PEAK_NEIGHBORHOOD, \
+    FREQ_BIN_IGNORE, DT_MAX, AMP_MIN, ADAPTIVE_PERCENTILE, TOP_DB
+from fingerprint_index import IndexBuilder
+from segment_store import SegmentStore, INDEX_DIR
+from metrics import TRAIN_STAGE_SECONDS, TRAIN_PEAKS, TRAIN_HASHES, TRAIN_SONGS, observe_stages, profiled
+from fingerprint_stream import stream_fingerprint, stream_duration, StreamingUnsupported, RESAMPLE_QUALITY
+from ingest_manifest import IngestManifest, iter_songs, find_duplicate, NEAR_DUPLICATE_COVERAGE
 
 # =============== CONFIG ===============
 SONG_DIR = "songs"
-DB_PATH = "fingerprints_db.pkl"
-
-# Tuned parameters for Hindi MP3 songs (4–5 min duration)
-SR = 22050            # lower sample rate saves memory but keeps accuracy
-N_FFT = 1024          # FFT window size ; 2048
-HOP_LENGTH = 512      # hop length for STFT
-PEAK_NEIGHBORHOOD = (10, 10)  # local maximum neighborhood ; 15 , 15
-FAN_VALUE = 10        # number of right-side peaks to link for hashing ; 10
-FREQ_BIN_IGNORE = 3   # ignore the very lowest frequencies
-DT_MAX = 200          # max time delta (frames) for linking peaks
-AMP_MIN = -25         # minimum dB level (used if adaptive thresholding fails)
+DB_PATH = INDEX_DIR
+STREAM_MIN_SECONDS = 600   # longer files are fingerprinted block by block (same hashes, flat memory)
+
+# Tuned parameters for Hindi MP3 songs (4–5 min duration) live in fingerprint_core:
+# SR, N_FFT, HOP_LENGTH, PEAK_NEIGHBORHOOD, FREQ_BIN_IGNORE, thresholds, FAN_VALUE, DT_MAX
+
+# stored in the index header and checked when the recognizer opens it
+BUILD_PARAMS = {"SR": SR, "N_FFT": N_FFT, "HOP_LENGTH": HOP_LENGTH, "FAN_VALUE": FAN_VALUE,
+                "HASH_SCHEME": HASH_SCHEME}
+
+# everything else that changes a file's hashes; the ingest manifest re-fingerprints when it differs
+INGEST_PARAMS = dict(BUILD_PARAMS, MONO=True, RES_TYPE=RESAMPLE_QUALITY, PEAK_NEIGHBORHOOD=PEAK_NEIGHBORHOOD,
+                     FREQ_BIN_IGNORE=FREQ_BIN_IGNORE, DT_MAX=DT_MAX, AMP_MIN=AMP_MIN,
+                     ADAPTIVE_PERCENTILE=ADAPTIVE_PERCENTILE, TOP_DB=TOP_DB)
 
 # =============== FUNCTIONS ===============
-def stft_peaks(S_db, adaptive=True):
+def iter_fingerprint(path):
     """
-    Detects local maxima (peaks) in spectrogram (constellation map).
-    If adaptive=True, uses top 15% of intensities instead of fixed threshold.
+    Fingerprint one audio file → iterator of (hashes, times) blocks.
+    Files of STREAM_MIN_SECONDS or more that libsndfile can read are streamed
+    (fingerprint_stream); everything else is one whole-file block.
     """
-    # Local maximum filter
-    footprint = np.ones(PEAK_NEIGHBORHOOD)
-    local_max = maximum_filter(S_db, footprint=footprint) == S_db
-
-    if adaptive:
-        # dynamically pick top 15% brightest points
-        adaptive_thresh = np.percentile(S_db, 85)
-        detected_peaks = np.where(local_max & (S_db >= adaptive_thresh))
-    else:
-        detected_peaks = np.where(local_max & (S_db >= AMP_MIN))
-
-    freqs = detected_peaks[0]
-    times = detected_peaks[1]
-    mask = freqs >= FREQ_BIN_IGNORE
-    peaks = list(zip(freqs[mask], times[mask]))
-    return peaks
+    duration = stream_duration(path)
+    if duration is not None and duration >= STREAM_MIN_SECONDS:
+        timings, emitted = {}, 0
+        try:
+            for block in stream_fingerprint(path, timings=timings, name=os.path.basename(path)):
+                emitted += 1
+                yield block
+        except StreamingUnsupported as e:
+            if emitted:   # a whole-file retry would add those blocks twice
+                raise
+            print(f"⚠️ Streaming not possible for {os.path.basename(path)} ({e}), loading it whole.")
+        else:
+            observe_stages(TRAIN_STAGE_SECONDS, timings)
+            TRAIN_PEAKS.inc(timings.get("peaks", 0))
+            return
+    import librosa   # deferred: only whole-file loads need it
+    with TRAIN_STAGE_SECONDS.time("load"):
+        y, sr = librosa.load(path, sr=SR, mono=True)
+    yield fingerprint_audio(y, name=os.path.basename(path))
 
 
-def generate_hashes(peaks, fan_value=FAN_VALUE):
+def compute_fingerprint(path):
     """
-    Generate peak-pair hashes (Shazam-like).
-    Each hash = SHA1(f1|f2|dt)[:20], stores with t1.
+    Fingerprint one audio file → (hashes, times) arrays.
+    Pure function (no shared state), so it can run in a worker process.
     """
-    peaks.sort(key=lambda x: x[1])
-    hashes = []
-    for i in range(len(peaks)):
-        f1, t1 = peaks[i]
-        for j in range(1, fan_value + 1):
-            if i + j < len(peaks):
-                f2, t2 = peaks[i + j]
-                dt = t2 - t1
-                if dt <= 0 or dt > DT_MAX:
-                    continue
-                key = f"{f1}|{f2}|{dt}"
-                h = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
-                hashes.append((h, t1))
-    return hashes
+    blocks = list(iter_fingerprint(path))
+    if len(blocks) == 1:
+        return blocks[0]
+    return np.concatenate([h for h, _ in blocks]), np.concatenate([t for _, t in blocks])
 
 
-def fingerprint_file(path, song_id, db):
-    """Create and store fingerprint hashes for one song."""
-    try:
-        y, sr = librosa.load(path, sr=SR, mono=True)
-        S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
-        S_db = librosa.amplitude_to_db(S + 1e-6, ref=np.max)
+def fingerprint_audio(y, name="audio"):
+    """Fingerprint mono float audio already at SR → (hashes, times) arrays."""
+    engine = get_engine()
+    engine.timings.clear()
+    S_db = engine.spectrogram_db(y)
 
-        # debug info
-        print(f"🎶 {os.path.basename(path)}: dB range {S_db.min():.1f} → {S_db.max():.1f}")
+    # debug info
+    print(f"🎶 {name}: dB range {S_db.min():.1f} → {S_db.max():.1f}")
 
-        peaks = stft_peaks(S_db, adaptive=True)
-        hashes = generate_hashes(peaks, fan_value=FAN_VALUE)
+    hashes, times = engine.hashes(S_db, mode="train")
+    observe_stages(TRAIN_STAGE_SECONDS, engine.timings)
+    TRAIN_PEAKS.inc(engine.timings.get("peaks", 0))
+    return hashes, times
 
-        for h, t in hashes:
-            db.setdefault(h, []).append((song_id, t))
 
-        print(f"✅ Fingerprinted {os.path.basename(path)}, produced {len(hashes)} hashes")
-        return len(hashes)
+def fingerprint_file(path, song_id, db):
+    """Create fingerprint hashes for one song and add them to an IndexBuilder."""
+    try:
+        count = 0
+        with profiled("fingerprint"):
+            # long files arrive block by block and go straight into the builder
+            for hashes, times in iter_fingerprint(path):
+                with TRAIN_STAGE_SECONDS.time("add"):
+                    count += db.add(song_id, hashes, times)
+        TRAIN_HASHES.inc(count)
+        TRAIN_SONGS.labels("ok").inc()
+
+        print(f"✅ Fingerprinted {song_id}, produced {count} hashes")
+        return count
 
     except Exception as e:
+        TRAIN_SONGS.labels("error").inc()
         print(f"❌ Error processing {path}: {e}")
         return 0
 
 
-# =============== MAIN SCRIPT ===============
-if __name__ == "__main__":
-    db = {}
-    song_list = []
+def _fingerprint_task(path):
+    """Worker entry point: never raises, returns (hashes, times, error)."""
+    try:
+        hashes, times = compute_fingerprint(path)
+        return hashes, times, None
+    except Exception as e:
+        return None, None, str(e)
 
-    print("🎵 Starting fingerprinting (adaptive STFT-peak + hash pairs)...")
-    for fname in sorted(os.listdir(SONG_DIR)):
-        if not fname.lower().endswith((".mp3", ".wav")):
+
+def list_songs(song_dir=SONG_DIR):
+    """Sorted (song_id, path) pairs for every .mp3/.wav in song_dir (dotfiles are in-flight uploads)."""
+    return [
+        (fname, os.path.join(song_dir, fname))
+        for fname in sorted(os.listdir(song_dir))
+        if fname.lower().endswith((".mp3", ".wav")) and not fname.startswith(".")
+    ]
+
+
+def bulk_ingest(songs, db=None, workers=None):
+    """
+    Fingerprint many songs on a process pool and merge them into one IndexBuilder.
+    songs: iterable of (song_id, path). Workers return compact hash arrays;
+    only this process touches the builder. workers=1 runs in-process.
+    Results merge in input order, so song IDs are stable; a song is interned only
+    once its fingerprint succeeds (failed songs never show up in index.songs).
+    """
+    db = db if db is not None else IndexBuilder()
+    songs = list(songs)
+    workers = workers or os.cpu_count() or 1
+
+    paths = [path for _, path in songs]
+    stats = {"files": 0, "failed": 0, "hashes": 0, "seconds": 0.0, "workers": workers}
+    start = time.time()
+
+    def merge(results):
+        for n, ((song_id, path), (hashes, times, error)) in enumerate(zip(songs, results), 1):
+            if error is not None:
+                stats["failed"] += 1
+                TRAIN_SONGS.labels("error").inc()
+                print(f"❌ Error processing {path}: {error}")
+            else:
+                with TRAIN_STAGE_SECONDS.time("add"):
+                    db.add(song_id, hashes, times)
+                stats["files"] += 1
+                stats["hashes"] += len(hashes)
+                TRAIN_HASHES.inc(len(hashes))
+                TRAIN_SONGS.labels("ok").inc()
+            elapsed = max(time.time() - start, 1e-9)
+            print(f"[{n}/{len(songs)}] {song_id}: {0 if hashes is None else len(hashes)} hashes "
+                  f"— {n / elapsed:.2f} files/s, {stats['hashes'] / elapsed:,.0f} hashes/s")
+
+    if workers == 1 or not paths:
+        merge(map(_fingerprint_task, paths))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            merge(pool.map(_fingerprint_task, paths))
+
+    stats["seconds"] = time.time() - start
+    return db, stats
+
+
+def drop_near_duplicates(index, new_songs, reference=None, min_coverage=NEAR_DUPLICATE_COVERAGE):
+    """
+    Check every newly fingerprinted song against the kept songs before it in
+    the index (copied songs first, then new ones in order; the first copy wins)
+    and against `reference`, the live index if given (a re-trained song is not
+    compared with its own old copy).
+    Returns (index without the duplicates, {name: (kept song, coverage)}).
+    """
+    new = set(new_songs)
+    allowed = np.array([name not in new for name in index.songs], dtype=bool)
+    if reference is not None:
+        ref_allowed = np.array([name not in new for name in reference.songs], dtype=bool)
+    position = {name: sid for sid, name in enumerate(index.songs)}
+    duplicates = {}
+    for name, hashes, times in iter_songs(index):
+        if name not in new:
             continue
-        path = os.path.join(SONG_DIR, fname)
-        song_id = fname
-        song_list.append(song_id)
-        fingerprint_file(path, song_id, db)
+        match = find_duplicate(index, hashes, times, allowed, min_coverage)
+        if match is None and reference is not None:
+            match = find_duplicate(reference, hashes, times, ref_allowed, min_coverage)
+        if match is None:
+            allowed[position[name]] = True
+            continue
+        duplicates[name] = match[:2]
+        TRAIN_SONGS.labels("duplicate").inc()
+        print(f"♻️ {name} duplicates {match[0]} ({match[1]:.0%} of its hashes at one offset), not indexed")
+    if duplicates:
+        index = IndexBuilder.from_index(index, exclude=duplicates).build()
+    return index, duplicates
+
+
+def incremental_rebuild(song_dir, out, workers=None, force=False):
+    """
+    Full rebuild of `out` from song_dir that only fingerprints new or changed
+    files: unchanged songs keep their postings, duplicates are left out.
+    force=True ignores the ingest manifest.
+    """
+    store = SegmentStore(out, BUILD_PARAMS, strict=False)
+    ingest = IngestManifest(out, INGEST_PARAMS)
+    if force or store.read_manifest()["params"] != BUILD_PARAMS:
+        ingest.reset()
+    live = set(store.songs)
+    plan = ingest.plan(list_songs(song_dir), live)
+    TRAIN_SONGS.labels("unchanged").inc(len(plan["reuse"]))
+    TRAIN_SONGS.labels("duplicate").inc(len(plan["duplicates"]))
+    print(f"🗂️ {len(plan['reuse'])} unchanged, {len(plan['fingerprint'])} to fingerprint, "
+          f"{len(plan['duplicates'])} duplicate files skipped")
+    for name, (of, _) in plan["duplicates"].items():
+        print(f"♻️ {name} duplicates {of}, skipped")
+
+    db = store.copy_songs(plan["reuse"], IndexBuilder())
+    db, stats = bulk_ingest(plan["fingerprint"], db=db, workers=workers)
+    index, near = drop_near_duplicates(db.build(), [name for name, _ in plan["fingerprint"]])
+    store.replace_all(index)
+
+    # the manifest now describes exactly the new base segment (failed songs have no postings)
+    ingest.reset()
+    counts = np.bincount(np.asarray(index.song_ids, dtype=np.int64), minlength=len(index.songs))
+    for name, count in zip(index.songs, counts.tolist()):
+        if count:
+            ingest.record(name, *plan["digests"][name], count)
+    for name, (of, coverage) in {**plan["duplicates"], **near}.items():
+        ingest.record_duplicate(name, *plan["digests"][name], of, coverage)
+    ingest.save()
+
+    stats.update(reused=len(plan["reuse"]), duplicates=len(plan["duplicates"]) + len(near))
+    return index, stats
 
-    # Save fingerprint DB
-    with open(DB_PATH, "wb") as f:
-        pickle.dump({"db": db, "songs": song_list}, f)
 
-    print(f"✅ Fingerprinting complete. Saved to {DB_PATH}")
+# =============== MAIN SCRIPT ===============
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the fingerprint index from a song folder.")
+    parser.add_argument("--songs", default=SONG_DIR, help="folder with .mp3/.wav files")
+    parser.add_argument("--out", default=DB_PATH, help="index directory to write")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="re-fingerprint every file, ignoring the ingest manifest")
+    args = parser.parse_args()
+
+    print("🎵 Starting fingerprinting (adaptive STFT-peak + hash pairs)...")
+    # Unchanged songs keep their postings; the compact index becomes the new base segment
+    index, stats = incremental_rebuild(args.songs, args.out, workers=args.workers, force=args.force)
+    print(f"📦 {len(index)} unique hashes, {index.num_postings} postings, {index.nbytes / 1e6:.1f} MB")
+
+    secs = max(stats["seconds"], 1e-9)
+    print(f"⚡ {stats['files']} files ({stats['failed']} failed) in {secs:.1f}s with {stats['workers']} workers "
+          f"— {stats['files'] / secs:.2f} files/s, {stats['hashes'] / secs:,.0f} hashes/s")
+    print(f"♻️ {stats['reused']} unchanged songs reused, {stats['duplicates']} duplicates left out")
+    print(f"✅ Fingerprinting complete. Saved to {args.out}")
@@ -0,0 +1,193 @@
+# ingest_manifest.py
+"""
+Content-Addressed Ingest Manifest
+Records what went into the index so training never does the same work twice.
+INGEST.json sits next to MANIFEST.json in the index directory:
+
+    {"version": 1, "params": {...decode + build params...},
+     "songs":      {name: {"digest": blake2b of the file, "bytes": size, "hashes": count}},
+     "duplicates": {name: {"digest": ..., "bytes": ..., "of": kept song, "coverage": 0.97}}}
+
+Before a song is fingerprinted or inserted:
+
+    unchanged        same name and file digest as the indexed copy → skipped
+    exact duplicate  another kept song has the same file digest → skipped
+    near duplicate   offset-coherent votes against the index cover at least
+                     NEAR_DUPLICATE_COVERAGE of the song's hashes (re-encode,
+                     other sample rate, gain change) → not inserted
+
+Entries are only trusted for songs that are live in the SegmentStore and when
+the stored params equal the current ones; anything else is re-fingerprinted.
+"""
+
+import hashlib, json, os, threading
+import numpy as np
+from match_scoring import score_offsets, MAX_POSTINGS
+
+# ==== CONFIG ====
+INGEST_FILE = "INGEST.json"
+FORMAT_VERSION = 1
+DIGEST_CHUNK = 1 << 20            # bytes per read while hashing a file
+# share of a song's hashes matching another song at one offset. Gain-only and
+# resampled copies measure ~0.8-0.98; remixes, radio edits and tracks sharing
+# samples stay well below, so they are indexed (/train force=true skips the check)
+NEAR_DUPLICATE_COVERAGE = 0.6
+
+
+# ==== DIGESTS ====
+def content_digest(data):
+    """blake2b digest (hex) of an in-memory upload."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path):
+    """(blake2b hex digest, size in bytes) of a file, read in chunks."""
+    h, size = hashlib.blake2b(digest_size=16), 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+# ==== NEAR DUPLICATES ====
+def iter_songs(index):
+    """(name, hashes, times) for every song with postings in a FingerprintIndex."""
+    keys = np.repeat(index.keys, np.diff(index.offsets))
+    song_ids = np.asarray(index.song_ids)
+    order = np.argsort(song_ids, kind="stable")
+    bounds = np.searchsorted(song_ids[order], np.arange(len(index.songs) + 1))
+    for sid, name in enumerate(index.songs):
+        sel = order[bounds[sid]:bounds[sid + 1]]
+        if len(sel):
+            yield name, keys[sel], np.asarray(index.times)[sel]
+
+
+def find_duplicate(reference, hashes, times, allowed=None, min_coverage=NEAR_DUPLICATE_COVERAGE):
+    """
+    Song of `reference` (any index with lookup()) that a new song duplicates.
+    allowed: optional bool array over reference song IDs; others are ignored.
+    Returns (name, coverage, offset) or None.
+    """
+    if not len(hashes):
+        return None
+    q_idx, song_ids, ref_times = reference.lookup(hashes, max_postings=MAX_POSTINGS)
+    if allowed is not None:
+        keep = allowed[song_ids]
+        q_idx, song_ids, ref_times = q_idx[keep], song_ids[keep], ref_times[keep]
+    offsets = ref_times.astype(np.int64) - np.asarray(times, dtype=np.int64)[q_idx]
+    ranked = score_offsets(song_ids, offsets, len(hashes), top_offsets=1, top_n=1)
+    if not ranked or ranked[0][3] < min_coverage:
+        return None
+    sid, _, offset, coverage = ranked[0]
+    return reference.song_name(sid), round(coverage, 4), offset
+
+
+# ==== MANIFEST ====
+class IngestManifest:
+    """INGEST.json of one index directory. Thread-safe; save() writes atomically."""
+
+    def __init__(self, index_dir, params):
+        self.path = os.path.join(index_dir, INGEST_FILE)
+        self.params = json.loads(json.dumps(params))   # tuples → lists, as stored
+        self._lock = threading.Lock()
+        self.songs, self.duplicates = {}, {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # entries made with other decode/build params describe other hashes
+            if data.get("version") == FORMAT_VERSION and data.get("params") == self.params:
+                self.songs, self.duplicates = data["songs"], data["duplicates"]
+
+    def save(self):
+        with self._lock:
+            data = {"version": FORMAT_VERSION, "params": self.params,
+                    "songs": self.songs, "duplicates": self.duplicates}
+            tmp = f"{self.path}.tmp-{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    # ---- lookups ----
+    def unchanged(self, name, digest, live):
+        """Manifest entry if `name` is live and indexed from exactly this content, else None."""
+        entry = self.songs.get(name)
+        return entry if entry is not None and name in live and entry["digest"] == digest else None
+
+    def same_content(self, digest, live, exclude=None):
+        """A live song other than `exclude` indexed from exactly this content, or None."""
+        for name, entry in self.songs.items():
+            if entry["digest"] == digest and name != exclude and name in live:
+                return name
+        return None
+
+    # ---- updates ----
+    def reset(self):
+        with self._lock:
+            self.songs, self.duplicates = {}, {}
+
+    def record(self, name, digest, size, hashes):
+        with self._lock:
+            self.duplicates.pop(name, None)
+            self.songs[name] = {"digest": digest, "bytes": size, "hashes": int(hashes)}
+
+    def record_duplicate(self, name, digest, size, of, coverage=1.0):
+        with self._lock:
+            self.songs.pop(name, None)
+            self.duplicates[name] = {"digest": digest, "bytes": size, "of": of, "coverage": coverage}
+
+    def forget(self, name):
+        """Drop a song (and duplicates pointing at it, so they are reconsidered)."""
+        with self._lock:
+            self.songs.pop(name, None)
+            self.duplicates.pop(name, None)
+            for dup in [d for d, entry in self.duplicates.items() if entry["of"] == name]:
+                del self.duplicates[dup]
+
+    def plan(self, songs, live):
+        """
+        Sort (name, path) pairs for a rebuild → dict with
+            reuse:       names whose indexed postings can be copied as they are
+            fingerprint: (name, path) pairs that need decoding
+            duplicates:  {name: (of, coverage)} skipped without decoding
+            digests:     {name: (digest, size)} for every song
+        Indexed copies win over new files with the same content.
+        """
+        songs = list(songs)
+        digests = {name: file_digest(path) for name, path in songs}
+        plan = {"reuse": [], "fingerprint": [], "duplicates": {}, "digests": digests}
+        by_digest = {}
+        for name, _ in songs:
+            digest = digests[name][0]
+            if digest not in by_digest and self.unchanged(name, digest, live):
+                plan["reuse"].append(name)
+                by_digest[digest] = name
+
+        pending = []
+        for name, path in songs:
+            digest = digests[name][0]
+            if by_digest.get(digest) == name:
+                continue
+            if digest in by_digest:
+                plan["duplicates"][name] = (by_digest[digest], 1.0)
+            elif name in self.duplicates and self.duplicates[name]["digest"] == digest:
+                pending.append((name, path))   # decided once every kept song is known
+            else:
+                plan["fingerprint"].append((name, path))
+                by_digest[digest] = name
+
+        kept = set(by_digest.values())
+        for name, path in pending:
+            entry = self.duplicates[name]
+            if entry["of"] in kept:
+                plan["duplicates"][name] = (entry["of"], entry["coverage"])
+            else:   # its original is gone or changed: look again
+                plan["fingerprint"].append((name, path))
+        return plan
+
+    def stats(self):
+        with self._lock:
+            return {"songs": len(self.songs), "duplicates": len(self.duplicates),
+                    "bytes": sum(entry["bytes"] for entry in self.songs.values())}
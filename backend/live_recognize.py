@@ -3,155 +3,440 @@
 Unified Audio Recognition Module
 Handles both uploaded audio and live microphone input using the same recognition pipeline.
 Optimized for speed: no disk I/O, in-memory processing, adaptive STFT peak detection.
+
+Importing this module is cheap: the index is opened by the process's Recognizer
+on first use (get_recognizer()), and sounddevice/librosa are only imported by
+the mic/file loaders that need them, so headless servers never touch PortAudio.
 """
 
-import sounddevice as sd
 import numpy as np
-import librosa
-import pickle, hashlib, os, time
-from scipy.ndimage import maximum_filter
-from collections import defaultdict, Counter
+import os, time, threading, io, wave
+import multiprocessing as mp
+from fingerprint_core import get_engine, SR, N_FFT, HOP_LENGTH, FAN_VALUE, HASH_SCHEME
+from fingerprint_index import lookup_batch
+from audio_decode import decode_audio
+from segment_store import open_index, index_generation, INDEX_DIR, SegmentedIndex
+from sharded_index import ShardPool, ShardedIndex
+from match_scoring import score_offsets, idf_weights, MAX_POSTINGS, IDF_WEIGHTING, TOP_MATCHES
+from match_verify import verify_matches, VERIFY, VERIFY_TOP_K
+from result_cache import ResultCache, pcm_digest, hash_sketch, CACHE_ENABLED
+from metrics import (QUERY_STAGE_SECONDS, QUERY_SECONDS, QUERY_PEAKS, QUERY_HASHES, QUERY_POSTINGS,
+                     RECOGNITIONS, observe_stages, track_index, profiled)
 
 # ==== CONFIG ====
-SR = 22050
-N_FFT = 1024          # Matched with training
-HOP_LENGTH = 512
-PEAK_NEIGHBORHOOD = (10, 10)
-FAN_VALUE = 10        # Matched with training
-FREQ_BIN_IGNORE = 3   # Matched with training
-DT_MAX = 200
-DB_PATH = "fingerprints_db.pkl"
-AMP_MIN = -25         # Matched with training
+# SR, HOP_LENGTH, peak neighborhood and thresholds are shared with training (fingerprint_core)
+DB_PATH = INDEX_DIR
 RECORD_DURATION = 7  # seconds
+RELOAD_INTERVAL = 2.0  # seconds between index generation checks
+SHARDS = 0           # > 1: partition the index by hash range over this many shard processes
+WARMUP_SECONDS = RECORD_DURATION  # synthetic clip length used by Recognizer.warm_up()
 
-# Adaptive threshold settings
-ADAPTIVE_PERCENTILE = 85  # Matched with training
-MIN_PEAK_AMPLITUDE = -25  # Matched with training AMP_MIN
-
-# ==== LOAD DATABASE (once) ====
-print("📂 Loading fingerprint database...")
-with open(DB_PATH, "rb") as f:
-    payload = pickle.load(f)
-DB = payload["db"]
-SONG_LIST = payload["songs"]
-print(f"✅ Loaded {len(DB)} fingerprints for {len(SONG_LIST)} songs.")
-
-
-# ==== PEAK + HASH FUNCTIONS ====
-def stft_peaks(S_db, adaptive=True):
-    """Detect spectral peaks using adaptive thresholding with enhanced sensitivity."""
-    footprint = np.ones(PEAK_NEIGHBORHOOD)
-    local_max = maximum_filter(S_db, footprint=footprint) == S_db
-    
-    if adaptive:
-        # Use more sensitive adaptive thresholding
-        adaptive_thresh = np.percentile(S_db, ADAPTIVE_PERCENTILE)
-        # Ensure threshold doesn't go below minimum peak amplitude
-        adaptive_thresh = max(adaptive_thresh, MIN_PEAK_AMPLITUDE)
-        # Use a combination of adaptive and minimum thresholds
-        detected_peaks = np.where(
-            local_max & 
-            (S_db >= adaptive_thresh) &
-            (S_db >= MIN_PEAK_AMPLITUDE)
-        )
-    else:
-        detected_peaks = np.where(local_max & (S_db >= AMP_MIN))
-    
-    freqs = detected_peaks[0]
-    times = detected_peaks[1]
-    mask = freqs >= FREQ_BIN_IGNORE
-    
-    # Additional filtering for stronger peaks
-    peaks = list(zip(freqs[mask], times[mask]))
-    if len(peaks) > 1000:  # If too many peaks, keep only the strongest ones
-        peak_values = [S_db[f, t] for f, t in peaks]
-        strongest_indices = np.argsort(peak_values)[-1000:]  # Keep top 1000 peaks
-        peaks = [peaks[i] for i in strongest_indices]
-    
-    return peaks
-
-
-def generate_hashes(peaks, fan_value=FAN_VALUE):
-    """Generate unique peak-pair hashes (Shazam-like)."""
-    peaks.sort(key=lambda x: x[1])
-    hashes = []
-    for i in range(len(peaks)):
-        f1, t1 = peaks[i]
-        for j in range(1, fan_value + 1):
-            if i + j < len(peaks):
-                f2, t2 = peaks[i + j]
-                dt = t2 - t1
-                if dt <= 0 or dt > DT_MAX:
-                    continue
-                key = f"{f1}|{f2}|{dt}"
-                h = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
-                hashes.append((h, t1))
-    return hashes
+# must match the parameters the index was built with
+BUILD_PARAMS = {"SR": SR, "N_FFT": N_FFT, "HOP_LENGTH": HOP_LENGTH, "FAN_VALUE": FAN_VALUE,
+                "HASH_SCHEME": HASH_SCHEME}
+
+# repeated uploads (retries, popular clips) are answered from here; see result_cache
+RESULT_CACHE = ResultCache() if CACHE_ENABLED else None
+
+# ==== LOAD DATABASE (memory-mapped, hot-swappable) ====
+_shard_pool = None
+
+
+def open_db(path=DB_PATH, params=BUILD_PARAMS, shards=SHARDS):
+    """Open the newest index generation: in-process, or served by the shard pool."""
+    global _shard_pool
+    if not os.path.exists(path):   # nothing trained yet: serve "no match" until the first build
+        print(f"⚠️ No fingerprint index at {path} yet.")
+        return SegmentedIndex([], [], generation=None, params=params)
+    # spawned children (shards, process-pool workers) re-import this module;
+    # only the top-level process owns a shard pool
+    if shards > 1 and mp.parent_process() is None:
+        if _shard_pool is None:
+            _shard_pool = ShardPool(path, shards, params)
+        return ShardedIndex(_shard_pool)
+    return open_index(path, params=params)
+
+
+def _wav_bytes(y, sr):
+    """16-bit mono WAV of y, for exercising the upload decode path."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((np.clip(y, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+class Recognizer:
+    """
+    The serving side of one index: the current snapshot (opened on first use,
+    hot-swapped by reload()), the generation watcher and the result cache.
+    Take `db` once per request and keep using it: a reload swaps the reference,
+    never mutates the old snapshot.
+    """
+
+    def __init__(self, path=DB_PATH, params=BUILD_PARAMS, shards=SHARDS, cache=None):
+        self.path = path
+        self.params = params
+        self.shards = shards
+        self.cache = cache
+        self._db = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def db(self):
+        db = self._db
+        if db is None:
+            with self._lock:
+                if self._db is None:
+                    print("📂 Loading fingerprint database...")
+                    self._db = open_db(self.path, self.params, self.shards)
+                    print(f"✅ Loaded {len(self._db)} fingerprints for {len(self._db.songs)} songs.")
+                db = self._db
+        return db
+
+    @property
+    def loaded(self):
+        return self._db is not None
+
+    def reload(self, force=False):
+        """Open the newest index generation and swap it in. Returns True if swapped."""
+        with self._lock:
+            if self._db is None:   # never opened: the first request opens the newest anyway
+                return False
+            if not os.path.exists(self.path) or (not force and index_generation(self.path) == self._db.generation):
+                return False
+            new_db = self._db = open_db(self.path, self.params, self.shards)
+        print(f"🔄 Reloaded fingerprint DB: generation {new_db.generation}, {len(new_db.songs)} songs.")
+        return True
+
+    def start_watcher(self, interval=RELOAD_INTERVAL):
+        """Poll for a new index generation in a daemon thread and hot-swap it in."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:  # a half-written index must not kill the watcher
+                    print("⚠️ DB reload failed:", e)
+
+        self._watcher = threading.Thread(target=watch, name="fingerprint-db-watcher", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def warm_up(self, seconds=WARMUP_SECONDS):
+        """
+        Run one synthetic upload through decode → resample → STFT → peaks →
+        lookup → vote before the first real request: opens the index, pays the
+        deferred scipy imports, plans the FFT sizes and faults in the code paths.
+        Nothing is cached or counted in the metrics. Returns the milliseconds spent.
+        """
+        start = time.perf_counter()
+        db = self.db
+        rng = np.random.default_rng(0)
+        y, _ = decode_audio(_wav_bytes(0.1 * rng.standard_normal(int(seconds * 44100)), 44100), sr=SR)
+        q_hashes, q_times = query_hashes(y)
+        if isinstance(db, ShardedIndex):
+            db.score(q_hashes, q_times)
+        else:
+            q_idx, song_ids, song_times = db.lookup(q_hashes, max_postings=MAX_POSTINGS)
+            score_offsets(song_ids, song_times.astype(np.int64) - q_times[q_idx].astype(np.int64), len(q_hashes))
+        # batched uploads use a 2-D STFT
+        get_engine().magnitude(np.zeros((2, len(y)), dtype=np.float32))
+        ms = round((time.perf_counter() - start) * 1000, 1)
+        print(f"🔥 Recognizer warmed up in {ms} ms.")
+        return ms
+
+    def recognize(self, y, max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING):
+        return recognize_audio(y, self.db, max_postings=max_postings, idf=idf, cache=self.cache)
+
+    def recognize_bytes(self, data, sr=SR):
+        """
+        Decode an uploaded audio blob and recognize it against the current DB snapshot.
+        Returns (matches, timing) where timing reports decode/resample time separately.
+        """
+        with profiled("recognize"):
+            y, info = decode_audio(data, sr=sr)
+            observe_stages(QUERY_STAGE_SECONDS, info)
+            start = time.perf_counter()
+            result = recognize_audio(y, self.db, cache=self.cache)
+        return result, {"decode_ms": info["decode_ms"], "resample_ms": info["resample_ms"],
+                        "recognize_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    def recognize_bytes_batch(self, blobs, sr=SR):
+        """Batch version of recognize_bytes; failed items come back as Exception objects."""
+        ys, infos = [], []
+        with profiled("recognize_batch"):
+            for data in blobs:
+                try:
+                    y, info = decode_audio(data, sr=sr)
+                    observe_stages(QUERY_STAGE_SECONDS, info)
+                    ys.append(y)
+                    infos.append(info)
+                except Exception as e:
+                    ys.append(e)
+                    infos.append(None)
+            decoded = [y for y in ys if not isinstance(y, Exception)]
+            start = time.perf_counter()
+            matches = iter(recognize_batch(decoded, self.db, cache=self.cache))
+        recognize_ms = round((time.perf_counter() - start) * 1000, 1)
+        results = []
+        for y, info in zip(ys, infos):
+            match = y if isinstance(y, Exception) else next(matches)
+            if isinstance(match, Exception):   # decode failed, or recognize_batch rejected the clip
+                results.append(match)
+                continue
+            results.append((match, {"decode_ms": info["decode_ms"], "resample_ms": info["resample_ms"],
+                                    "recognize_ms": recognize_ms}))
+        return results
+
+
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer():
+    """This process's Recognizer (created on first call; the index opens on first use)."""
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                _recognizer = Recognizer(cache=RESULT_CACHE)
+                track_index(lambda: _recognizer._db)   # None until opened; a scrape must not open it
+    return _recognizer
+
+
+def get_db():
+    """Current index snapshot of this process's Recognizer (opens it on first call)."""
+    return get_recognizer().db
+
+
+def reload_db(force=False):
+    """Swap in the newest generation if this process serves one; never opens the DB just to reload it."""
+    return _recognizer.reload(force) if _recognizer is not None else False
+
+
+def start_db_watcher(interval=RELOAD_INTERVAL):
+    return get_recognizer().start_watcher(interval)
 
 
 # ==== CORE RECOGNITION ====
-def recognize_audio(y, db):
-    """Recognize song directly from numpy audio array with enhanced sensitivity."""
-    # Normalize audio
-    y = librosa.util.normalize(y)
-    
-    # Apply pre-emphasis to enhance high frequencies
-    y_emph = np.append(y[0], y[1:] - 0.97 * y[:-1])
-    
-    # Generate STFT
-    S = np.abs(librosa.stft(y_emph, n_fft=N_FFT, hop_length=HOP_LENGTH))
-    S_db = librosa.amplitude_to_db(S + 1e-6, ref=np.max)
-    
-    # Get peaks with both adaptive and fixed thresholds
-    peaks_adaptive = stft_peaks(S_db, adaptive=True)
-    peaks_fixed = stft_peaks(S_db, adaptive=False)
-    peaks = list(set(peaks_adaptive + peaks_fixed))  # Combine unique peaks
-    
-    q_hashes = generate_hashes(peaks)
-
-    if not q_hashes:
+def prepare_audio(y):
+    """Normalize and apply pre-emphasis to enhance high frequencies."""
+    # peak normalization, same values as librosa.util.normalize(y)
+    y = np.asarray(y)
+    if not np.isfinite(y).all():
+        raise ValueError("Audio buffer is not finite everywhere")
+    peak = np.max(np.abs(y))
+    y = y / y.dtype.type(peak if peak >= np.finfo(y.dtype).tiny else 1.0)
+    return np.append(y[0], y[1:] - 0.97 * y[:-1])
+
+
+def spectrogram_hashes(S_db):
+    """Peak-pair hashes of a dB spectrogram → (q_hashes, q_times)."""
+    # union of adaptive and fixed threshold peaks, each capped to the strongest 1000
+    return get_engine().hashes(S_db, mode="query")
+
+
+def query_hashes(y):
+    """Full query front-end for one clip: STFT → peaks → hashes (stage times in get_engine().timings)."""
+    return spectrogram_hashes(get_engine().spectrogram_db(prepare_audio(y)))
+
+
+def score_matches(q_hashes, q_times, postings, db, max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING, verify=VERIFY):
+    """
+    Vote on (song, offset) bins for one query and format the top 3 songs.
+    postings=None on a ShardedIndex: the shards vote and only histograms come back.
+    idf=True weights every vote by how rare its hash is in the catalogue.
+    verify=True re-checks the top VERIFY_TOP_K candidates (match_verify) and
+    keeps those whose calibrated score passes, best score first.
+    """
+    if not len(q_hashes):
         print("⚠️ No peaks found in query.")
         return None
 
-    votes = defaultdict(list)
-    for h, q_t in q_hashes:
-        if h in db:
-            for song_id, song_t in db[h]:
-                offset = song_t - q_t
-                votes[song_id].append(offset)
-
-    if not votes:
+    # the verifier needs the postings; sharded lookups only return histograms
+    verify = verify and postings is not None
+    if postings is None:
+        top_matches = db.score(q_hashes, q_times, max_postings=max_postings, idf=idf)
+    else:
+        q_idx, song_ids, song_times = postings
+        offsets = song_times.astype(np.int64) - q_times[q_idx].astype(np.int64)
+        weights = None
+        if idf and len(q_idx):
+            weights = idf_weights(db.posting_counts(q_hashes), len(db.songs))[q_idx]
+        top_matches = score_offsets(song_ids, offsets, len(q_hashes), weights=weights,
+                                    top_n=VERIFY_TOP_K if verify else TOP_MATCHES)
+    if verify and top_matches:
+        with QUERY_STAGE_SECONDS.time("verify"):
+            verified = verify_matches(top_matches, q_hashes, q_times, postings, db, top_n=TOP_MATCHES)
+        if not verified:
+            print("❌ No verified match.")
+            return None
+        return [
+            {
+                "song": db.song_name(song_id),
+                "votes": votes,
+                "offset": offset,
+                "confidence": confidence,
+                "score": details["score"],
+                "coherent_votes": details["coherent"],
+                "alignment": details["alignment"],
+            }
+            for song_id, votes, offset, confidence, details in verified
+        ]
+    if not top_matches:
         print("❌ No match found.")
         return None
 
-    results = []
-    for song_id, offsets in votes.items():
-        offset_counts = Counter(int(round(o)) for o in offsets)
-        # Get top 3 offsets and sum their votes for more robust matching
-        top_offsets = offset_counts.most_common(3)
-        total_votes = sum(count for _, count in top_offsets)
-        best_offset = top_offsets[0][0]  # Use the most common offset
-        
-        # Calculate confidence score (normalized between 0 and 1)
-        confidence = total_votes / len(q_hashes) if q_hashes else 0
-        results.append((song_id, total_votes, best_offset, confidence))
-
-    # Sort by votes and get top 3 results
-    results.sort(key=lambda x: x[1], reverse=True)
-    top_matches = results[:3]
-    
     # Convert to list of dictionaries with song info
     return [
         {
-            "song": match[0],
-            "votes": match[1],
-            "offset": match[2],
-            "confidence": match[3]
+            "song": db.song_name(song_id),
+            "votes": votes,
+            "offset": offset,
+            "confidence": confidence
         }
-        for match in top_matches
+        for song_id, votes, offset, confidence in top_matches
     ]
 
 
+def _cache_tag(db, max_postings, idf, verify):
+    """Cache entries are only valid for one index generation and one set of query options."""
+    return (db.generation, max_postings, bool(idf), bool(verify))
+
+
+def _observe_front_end(engine, q_hashes):
+    """Per-stage times and peak/hash counts of the engine call that just ran."""
+    observe_stages(QUERY_STAGE_SECONDS, engine.timings)
+    QUERY_PEAKS.inc(engine.timings.get("peaks", 0))
+    QUERY_HASHES.inc(len(q_hashes))
+
+
+def _lookup_and_vote(q_hashes, q_times, postings, db, max_postings, idf, verify):
+    """score_matches with vote timing and outcome counting."""
+    if postings is not None:
+        QUERY_POSTINGS.inc(len(postings[0]))
+    # on a ShardedIndex the shards look up and vote in one round trip
+    with QUERY_STAGE_SECONDS.time("vote" if postings is not None else "lookup_vote"):
+        result = score_matches(q_hashes, q_times, postings, db, max_postings=max_postings, idf=idf, verify=verify)
+    RECOGNITIONS.labels("match" if result else "no_match").inc()
+    return result
+
+
+def recognize_audio(y, db, max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING, cache=None, verify=VERIFY):
+    """
+    Recognize song directly from numpy audio array with enhanced sensitivity.
+    cache: optional ResultCache, checked by PCM digest, then by hash sketch.
+    """
+    start = time.perf_counter()
+    if cache is not None:
+        tag, digest = _cache_tag(db, max_postings, idf, verify), pcm_digest(y)
+        hit, result = cache.get(digest, tag)
+        if hit:
+            RECOGNITIONS.labels("cached").inc()
+            return result
+    engine = get_engine()
+    with QUERY_STAGE_SECONDS.time("prepare"):
+        y = prepare_audio(y)
+    engine.timings.clear()
+    q_hashes, q_times = spectrogram_hashes(engine.spectrogram_db(y))
+    _observe_front_end(engine, q_hashes)
+    if cache is not None:
+        sketch = hash_sketch(q_hashes)
+        hit, result = cache.get_similar(sketch, tag)
+        if hit:
+            RECOGNITIONS.labels("cached").inc()
+            return result
+    postings = None
+    if not isinstance(db, ShardedIndex):
+        with QUERY_STAGE_SECONDS.time("lookup"):
+            postings = db.lookup(q_hashes, max_postings=max_postings)
+    result = _lookup_and_vote(q_hashes, q_times, postings, db, max_postings, idf, verify)
+    if cache is not None:
+        cache.put(digest, sketch, result, tag)
+    QUERY_SECONDS.observe(time.perf_counter() - start)
+    return result
+
+
+def recognize_batch(ys, db, max_postings=MAX_POSTINGS, idf=IDF_WEIGHTING, cache=None, verify=VERIFY):
+    """
+    Recognize several clips in one pass: one batched STFT over the zero-padded
+    clips, per-clip peaks/hashes, then a single deduplicated posting lookup.
+    Clips answered by the cache (if given) skip whatever stages they can.
+    Returns one result (or Exception) per clip, in order.
+    """
+    results = [None] * len(ys)
+    prepared = {}
+    tag, digests, sketches = _cache_tag(db, max_postings, idf, verify), {}, {}
+    for i, y in enumerate(ys):
+        try:
+            y = np.asarray(y, dtype=np.float32)
+            if cache is not None:
+                digests[i] = pcm_digest(y)
+                hit, results[i] = cache.get(digests[i], tag)
+                if hit:
+                    RECOGNITIONS.labels("cached").inc()
+                    continue
+            with QUERY_STAGE_SECONDS.time("prepare"):
+                prepared[i] = prepare_audio(y)
+        except Exception as e:
+            results[i] = e
+    if not prepared:
+        return results
+
+    # zero padding == the STFT's constant centre padding, so valid frames are unchanged
+    engine = get_engine()
+    batch = np.zeros((len(prepared), max(len(y) for y in prepared.values())), dtype=np.float32)
+    for row, y in enumerate(prepared.values()):
+        batch[row, :len(y)] = y
+    with QUERY_STAGE_SECONDS.time("batch_stft"):
+        S = engine.magnitude(batch)
+
+    hashes = {}
+    for row, (i, y) in enumerate(prepared.items()):
+        with QUERY_STAGE_SECONDS.time("db"):
+            S_db = engine.to_db(S[row, :, :1 + len(y) // HOP_LENGTH])
+        engine.timings.clear()
+        q_hashes, q_times = spectrogram_hashes(S_db)
+        _observe_front_end(engine, q_hashes)
+        if cache is not None:
+            sketches[i] = hash_sketch(q_hashes)
+            hit, results[i] = cache.get_similar(sketches[i], tag)
+            if hit:
+                RECOGNITIONS.labels("cached").inc()
+                continue
+        hashes[i] = q_hashes, q_times
+    if not hashes:
+        return results
+
+    if isinstance(db, ShardedIndex):
+        postings = [None] * len(hashes)
+    else:
+        with QUERY_STAGE_SECONDS.time("batch_lookup"):
+            postings = lookup_batch(db, [q_hashes for q_hashes, _ in hashes.values()], max_postings=max_postings)
+    for (i, (q_hashes, q_times)), hits in zip(hashes.items(), postings):
+        results[i] = _lookup_and_vote(q_hashes, q_times, hits, db, max_postings, idf, verify)
+        if cache is not None:
+            cache.put(digests[i], sketches[i], results[i], tag)
+    return results
+
+
+def recognize_bytes(data, sr=SR):
+    """Module-level entry for executors (picklable): get_recognizer().recognize_bytes."""
+    return get_recognizer().recognize_bytes(data, sr)
+
+
+def recognize_bytes_batch(blobs, sr=SR):
+    """Module-level entry for executors (picklable): get_recognizer().recognize_bytes_batch."""
+    return get_recognizer().recognize_bytes_batch(blobs, sr)
+
+
 # ==== AUDIO LOADER (Unified Input Handler) ====
 def load_audio(source=None, sr=SR, duration=RECORD_DURATION):
     """
@@ -164,10 +449,12 @@ def load_audio(source=None, sr=SR, duration=RECORD_DURATION):
         print("🎧 Using provided NumPy audio array.")
         return source, sr
     elif isinstance(source, str):
+        import librosa
         print(f"📀 Loading audio from file: {os.path.basename(source)}")
         y, sr_loaded = librosa.load(source, sr=sr, mono=True)
         return y, sr_loaded
     else:
+        import sounddevice as sd   # needs PortAudio; only the mic path imports it
         print(f"🎙️ Recording via mic for {duration} seconds...")
         audio = sd.rec(int(duration * sr), samplerate=sr, channels=1, dtype='float32')
         sd.wait()
@@ -181,15 +468,20 @@ def main(source=None):
     Usage:
         python live_recognize.py            → live mic
         python live_recognize.py path/to.mp3 → file input
+    Many files: python batch_scan.py (opens the index once for the whole run).
     """
     start = time.time()
     y, sr = load_audio(source)
     print("🎧 Recognizing now...")
-    result = recognize_audio(y, DB)
+    result = recognize_audio(y, get_db())
     end = time.time()
 
     if result:
-        print(f"\n✅ Match: {result['song']}  (votes={result['votes']}, offset={result['offset']})")
+        top = result[0]
+        print(f"\n✅ Match: {top['song']}  (votes={top['votes']}, offset={top['offset']}, "
+              f"confidence={top['confidence']:.2f})")
+        for other in result[1:]:
+            print(f"   also: {other['song']}  (votes={other['votes']})")
     else:
         print("\n❌ No match found.")
     print(f"⏱️ Total processing time: {end - start:.2f} sec")
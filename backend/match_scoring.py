@@ -0,0 +1,131 @@
+# match_scoring.py
+"""
+Vectorized Offset-Histogram Scoring
+Turns matched postings into ranked song candidates without per-posting Python work.
+
+For every posting that matched a query hash:
+    offset = song_t - query_t
+A true match piles its votes into a few (song, offset) bins. Each song is
+scored by the sum of its TOP_OFFSETS fullest bins.
+
+Hashes that occur all over the catalogue (low drones, silence artifacts) add
+nothing but work: lookups skip keys with more than MAX_POSTINGS postings, and
+IDF_WEIGHTING optionally scales each vote down by how common its hash is.
+"""
+
+import numpy as np
+
+# ==== CONFIG ====
+TOP_OFFSETS = 3       # offset bins summed per song
+TOP_MATCHES = 3       # candidates returned
+DENSE_BINS_MAX = 1 << 24   # use a dense bincount when songs × offset span fits
+MAX_POSTINGS = 2000   # stop-list: skip hashes with more postings than this (0 = off)
+IDF_WEIGHTING = False # weight votes by log(1 + songs / postings of the hash)
+
+
+# ==== WEIGHTING ====
+def idf_weights(posting_counts, n_songs):
+    """Per-hash vote weight: 1 + log(songs / postings) style IDF, ≈ 1 for rare hashes."""
+    counts = np.maximum(np.asarray(posting_counts, dtype=np.float64), 1.0)
+    return np.log1p(max(n_songs, 1) / counts)
+
+
+# ==== HISTOGRAM ====
+def offset_histogram(song_ids, offsets, weights=None):
+    """
+    Group-by over (song, offset): a dense bincount when the bin space is small,
+    otherwise a sort-based np.unique.
+    Returns (bin_songs, bin_offsets, bin_counts) sorted by (song, offset).
+    With `weights`, each posting adds its weight instead of 1.
+    """
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if not len(song_ids):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, (empty if weights is None else empty.astype(np.float64))
+
+    o_min = offsets.min()
+    span = int(offsets.max() - o_min) + 1
+    combined = song_ids * span + (offsets - o_min)
+
+    n_bins = (int(song_ids.max()) + 1) * span
+    if n_bins <= max(DENSE_BINS_MAX, 4 * len(combined)):
+        counts = np.bincount(combined, weights=weights, minlength=n_bins)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    elif weights is None:
+        keys, counts = np.unique(combined, return_counts=True)
+    else:
+        keys, inverse = np.unique(combined, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+
+    bin_songs, bin_offsets = np.divmod(keys, span)
+    return bin_songs, bin_offsets + o_min, counts
+
+
+# ==== SCORING ====
+def score_histogram(bin_songs, bin_offsets, bin_counts, n_query_hashes,
+                    top_offsets=TOP_OFFSETS, top_n=TOP_MATCHES):
+    """
+    Rank songs from a (song, offset) histogram.
+    Returns up to top_n tuples (song_id, votes, best_offset, confidence), best first.
+    Ties go to the smaller offset / smaller song ID.
+    """
+    if not len(bin_songs):
+        return []
+
+    # prune: a song scores at most top_offsets × its fullest bin, and at least
+    # that bin, so songs that can't reach the top_n-th best lower bound drop out
+    starts = np.flatnonzero(np.r_[True, bin_songs[1:] != bin_songs[:-1]])
+    song_max = np.maximum.reduceat(bin_counts, starts)
+    if len(song_max) > top_n:
+        bound = np.partition(song_max, len(song_max) - top_n)[len(song_max) - top_n]
+        sizes = np.diff(np.r_[starts, len(bin_songs)])
+        keep = np.repeat(song_max * top_offsets >= bound, sizes)
+        bin_songs, bin_offsets, bin_counts = bin_songs[keep], bin_offsets[keep], bin_counts[keep]
+
+    # per song: bins by count desc, then offset asc
+    order = _group_order(bin_songs, bin_offsets, bin_counts)
+    songs = bin_songs[order]
+    counts = bin_counts[order]
+    offsets = bin_offsets[order]
+
+    group_starts = np.flatnonzero(np.r_[True, songs[1:] != songs[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(songs)])
+    rank = np.arange(len(songs)) - np.repeat(group_starts, group_sizes)
+
+    top = rank < top_offsets
+    votes = np.add.reduceat(np.where(top, counts, 0), group_starts)
+    best_offsets = offsets[group_starts]
+    group_songs = songs[group_starts]
+
+    ranked = np.argsort(-votes, kind="stable")[:top_n]
+    to_py = int if np.issubdtype(votes.dtype, np.integer) else float
+    return [
+        (
+            int(group_songs[i]),
+            to_py(votes[i]),
+            int(best_offsets[i]),
+            float(votes[i]) / n_query_hashes if n_query_hashes else 0.0,
+        )
+        for i in ranked
+    ]
+
+
+def _group_order(bin_songs, bin_offsets, bin_counts):
+    """Order bins by (song asc, count desc, offset asc); one int64 argsort when it fits."""
+    if len(bin_songs) and np.issubdtype(bin_counts.dtype, np.integer):
+        o_min = int(bin_offsets.min())
+        span = int(bin_offsets.max()) - o_min + 1
+        c_max = int(bin_counts.max())
+        if (int(bin_songs.max()) + 1) * (c_max + 1) * span < 2 ** 62:
+            key = (bin_songs * (c_max + 1) + (c_max - bin_counts)) * span + (bin_offsets - o_min)
+            return np.argsort(key)
+    return np.lexsort((bin_offsets, -bin_counts, bin_songs))
+
+
+def score_offsets(song_ids, offsets, n_query_hashes, weights=None,
+                  top_offsets=TOP_OFFSETS, top_n=TOP_MATCHES):
+    """Histogram + rank in one call (see offset_histogram / score_histogram)."""
+    return score_histogram(*offset_histogram(song_ids, offsets, weights),
+                           n_query_hashes, top_offsets=top_offsets, top_n=top_n)
@@ -0,0 +1,240 @@
+# match_verify.py
+"""
+Second-Pass Match Verification
+The offset-histogram vote (match_scoring) sums a song's TOP_OFFSETS fullest
+bins; on noisy clips several songs come out nearly tied and the raw
+confidence (votes / query hashes) says little. This pass re-checks only the
+top VERIFY_TOP_K candidates, reusing the postings already looked up:
+
+    coherence  → distinct query hashes voting within ±OFFSET_WINDOW frames of
+                 the candidate's best offset (bins far apart don't add up)
+    alignment  → share of the query's peaks that land, shifted by that offset,
+                 within PEAK_TOLERANCE of a peak in the song's constellation
+                 (FingerprintIndex peak store), minus the share expected by
+                 chance at that song's local peak density
+    runner-up  → coherence of the best other candidate, as its share of the pair
+                 runner_up / (coherent + runner_up): 0 for a clear winner, 0.5 for
+                 a tie, whatever the catalogue size or clip length
+
+A logistic model over log1p(coherence), the runner-up share and
+sqrt(alignment excess) gives a calibrated score in [0, 1]. Matches below
+MATCH_SCORE are dropped. Candidates with fewer than MIN_COHERENT aligned
+votes are rejected before any peak is compared, so a query whose best
+candidate falls short ends as no_match after the coherence count alone.
+
+Segments built before the peak store verify on coherence alone.
+"""
+
+import numpy as np
+from fingerprint_core import unpack_hashes, F_BITS, N_FFT
+
+# ==== CONFIG ====
+VERIFY = True
+VERIFY_TOP_K = 5             # vote candidates that get verified
+OFFSET_WINDOW = 1            # frames around the best offset counted as coherent
+PEAK_TOLERANCE = (1, 1)      # (bins, frames) a shifted query peak may be off by
+MIN_COHERENT = 2             # fewer coherent votes: rejected without the peak check
+MATCH_SCORE = 0.3            # score a reported match needs; benchmark operating point, see below
+# logistic weights: bias, log1p(coherent votes), runner-up share, sqrt(alignment excess).
+# Output of `python match_verify.py calibrate` (20-song synthetic corpus); the features are
+# scale-free (a refit on 100 songs moves top-1 accuracy by < 0.5%). To refit on a real catalogue:
+#     python match_verify.py calibrate --corpus index --index fingerprints_index --song-dir songs
+# (or --corpus songs for a folder of audio files), paste the printed tuple here and
+# compare `python benchmark.py --corpus index` against --no-verify. On the synthetic suite
+# (20/100 songs, 2-6 s clips, 3-10 dB) MATCH_SCORE 0.3 keeps top-1 accuracy level with the
+# plain vote; lower admits clips of unindexed songs, higher drops right answers on short clips.
+CALIBRATION = (3.06, -1.43, -24.2, 30.43)
+
+_N_BINS = N_FFT // 2 + 1
+_F_MASK = (1 << F_BITS) - 1
+
+
+# ==== FEATURES ====
+def query_peaks(q_hashes, q_times):
+    """Distinct (f, t) query peaks recovered from its hashes → (f, t) int64 arrays."""
+    f1, f2, dt = unpack_hashes(q_hashes)
+    t1 = np.asarray(q_times, dtype=np.int64)
+    packed = np.unique(np.concatenate([
+        (t1 << F_BITS) | f1.astype(np.int64),
+        ((t1 + dt.astype(np.int64)) << F_BITS) | f2.astype(np.int64),
+    ]))
+    return packed & _F_MASK, packed >> F_BITS
+
+
+def coherent_votes(q_idx, song_ids, offsets, song_id, offset, window=OFFSET_WINDOW):
+    """Distinct query hashes whose posting for song_id lies within ±window of offset."""
+    sel = (song_ids == song_id) & (np.abs(offsets - offset) <= window)
+    return len(np.unique(q_idx[sel]))
+
+
+def peak_alignment(f, t, song_peaks, offset, tolerance=PEAK_TOLERANCE):
+    """
+    (share of query peaks near a song peak after shifting by offset, share expected
+    by chance from the song's peak density in that span).
+    """
+    if not len(f):
+        return 0.0, 0.0
+    tol_f, tol_t = tolerance
+    t = t + offset
+    lo, hi = max(int(t.min()) - tol_t, 0), int(t.max()) + tol_t
+    start, stop = np.searchsorted(song_peaks, [lo << F_BITS, (hi + 1) << F_BITS])
+    window = np.asarray(song_peaks[start:stop], dtype=np.int64)
+    if not len(window):
+        return 0.0, 0.0
+    hit = np.zeros(len(f), dtype=bool)
+    for dt in range(-tol_t, tol_t + 1):
+        for df in range(-tol_f, tol_f + 1):
+            probe = ((t + dt) << F_BITS) | np.clip(f + df, 0, _N_BINS - 1)
+            pos = np.minimum(np.searchsorted(window, probe), len(window) - 1)
+            hit |= window[pos] == probe
+    cells = (2 * tol_f + 1) * (2 * tol_t + 1)
+    chance = min(len(window) * cells / ((hi - lo + 1) * _N_BINS), 1.0)
+    return float(hit.mean()), chance
+
+
+def candidate_features(candidates, q_hashes, q_times, postings, db):
+    """
+    Per candidate (song_id, votes, offset, confidence): dict with coherent,
+    runner_up, alignment, chance, excess (alignment None without a peak store).
+    """
+    q_idx, song_ids, song_times = postings
+    keep = np.isin(song_ids, [c[0] for c in candidates])
+    q_idx, song_ids = q_idx[keep], np.asarray(song_ids)[keep]
+    offsets = np.asarray(song_times)[keep].astype(np.int64) - np.asarray(q_times, dtype=np.int64)[q_idx]
+    coherent = [coherent_votes(q_idx, song_ids, offsets, sid, offset) for sid, _, offset, _ in candidates]
+
+    peaks_of = getattr(db, "song_peaks", None)
+    f = t = None
+    rows = []
+    for i, (sid, _, offset, _) in enumerate(candidates):
+        runner_up = max((c for j, c in enumerate(coherent) if j != i), default=0)
+        row = {"coherent": coherent[i], "runner_up": runner_up, "alignment": None, "chance": None, "excess": 0.0}
+        song_peaks = peaks_of(sid) if peaks_of is not None and coherent[i] >= MIN_COHERENT else None
+        if song_peaks is not None:
+            if f is None:
+                f, t = query_peaks(q_hashes, q_times)
+            alignment, chance = peak_alignment(f, t, song_peaks, offset)
+            row.update(alignment=round(alignment, 4), chance=round(chance, 4),
+                       excess=(alignment - chance) / (1 - chance) if chance < 1 else 0.0)
+        rows.append(row)
+    return rows
+
+
+def _feature_vector(row):
+    pair = row["coherent"] + row["runner_up"]
+    return [np.log1p(row["coherent"]), row["runner_up"] / pair if pair else 0.0,
+            np.sqrt(max(row["excess"], 0.0))]
+
+
+def calibrated_score(row, weights=CALIBRATION):
+    """Logistic score in [0, 1] from one candidate's features."""
+    z = weights[0] + float(np.dot(weights[1:], _feature_vector(row)))
+    return float(1 / (1 + np.exp(-z)))
+
+
+# ==== VERIFY ====
+def verify_matches(candidates, q_hashes, q_times, postings, db, min_score=MATCH_SCORE, top_n=None):
+    """
+    Verify score_offsets candidates → [(song_id, votes, offset, confidence, details)],
+    best calibrated score first, only those >= min_score (empty list: no match).
+    """
+    if not candidates:
+        return []
+    rows = candidate_features(candidates, q_hashes, q_times, postings, db)
+    if max(row["coherent"] for row in rows) < MIN_COHERENT:
+        return []
+    verified = []
+    for candidate, row in zip(candidates, rows):
+        row["score"] = round(calibrated_score(row), 4)
+        if row["coherent"] >= MIN_COHERENT and row["score"] >= min_score:
+            verified.append(candidate + (row,))
+    verified.sort(key=lambda c: -c[4]["score"])
+    return verified[:top_n] if top_n else verified
+
+
+# ==== CALIBRATION ====
+def fit_logistic(X, y, l2=0.01, iterations=50):
+    """Logistic regression by Newton/IRLS (small L2 on the weights) → [bias, w...]."""
+    X = np.column_stack([np.ones(len(X)), np.asarray(X, dtype=np.float64)])
+    y = np.asarray(y, dtype=np.float64)
+    w = np.zeros(X.shape[1])
+    reg = l2 * np.eye(X.shape[1])
+    reg[0, 0] = 0.0
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(X @ w, -30, 30)))
+        grad = X.T @ (p - y) + reg @ w
+        hess = (X * (p * (1 - p))[:, None]).T @ X + reg
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return w
+
+
+def calibration_rows(corpus="synthetic", songs=20, negatives=20, queries=30, seeds=(1, 2),
+                     snrs=(10, 3, 0), clips=(6, 3, 2), song_dir="songs", index_path=None):
+    """
+    Features of every verified candidate on a benchmark corpus (synthetic, songs or
+    index, as in benchmark.py), labelled 1 when it is the clip's song at the right
+    offset (clips of unindexed songs: all 0).
+    """
+    import benchmark
+    from live_recognize import query_hashes
+    from match_scoring import score_offsets, MAX_POSTINGS
+    audio, unknown, db = benchmark.benchmark_corpus(corpus, songs, negatives, benchmark.SONG_SECONDS, 0,
+                                                    song_dir, index_path or benchmark.INDEX_DIR)
+    if db is None:
+        db = benchmark.build_index(audio)
+    rows, labels = [], []
+    for seed in seeds:
+        for snr in snrs:
+            for clip in clips:
+                for clips_of, indexed in ((audio, True), (unknown, False)):
+                    if not clips_of:
+                        continue
+                    for q in benchmark.make_queries(clips_of, queries, clip, seed, snr_db=snr):
+                        q_hashes, q_times = query_hashes(q["clip"])
+                        postings = db.lookup(q_hashes, max_postings=MAX_POSTINGS)
+                        q_idx, song_ids, song_times = postings
+                        offsets = song_times.astype(np.int64) - q_times[q_idx].astype(np.int64)
+                        candidates = score_offsets(song_ids, offsets, len(q_hashes), top_n=VERIFY_TOP_K)
+                        if not candidates:
+                            continue
+                        for (sid, _, offset, _), row in zip(candidates, candidate_features(
+                                candidates, q_hashes, q_times, postings, db)):
+                            rows.append(row)
+                            labels.append(int(indexed and db.song_name(sid) == q["song"]
+                                              and abs(offset - q["start_frame"]) <= benchmark.OFFSET_TOLERANCE))
+    return rows, np.array(labels)
+
+
+def calibrate(**corpus):
+    """Fit CALIBRATION on a benchmark corpus and print it with its error rates."""
+    rows, labels = calibration_rows(**corpus)
+    if not labels.sum() or labels.all():
+        raise ValueError("Calibration needs both correct and wrong candidates; use more songs or clips")
+    X = np.array([_feature_vector(r) for r in rows])
+    weights = tuple(round(float(w), 2) for w in fit_logistic(X, labels))
+    scores = np.array([calibrated_score(r, weights) for r in rows])
+    accepted = scores >= MATCH_SCORE
+    print(f"📐 {len(rows)} candidates ({labels.sum()} correct)")
+    print(f"   CALIBRATION = {weights}")
+    print(f"   at MATCH_SCORE {MATCH_SCORE}: {accepted[labels == 1].mean():.1%} of correct candidates kept, "
+          f"{accepted[labels == 0].mean():.2%} of wrong ones")
+    return weights
+
+
+# ==== RUN ====
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fit the verifier's CALIBRATION weights.")
+    parser.add_argument("command", choices=("calibrate",))
+    parser.add_argument("--corpus", choices=("synthetic", "songs", "index"), default="synthetic")
+    parser.add_argument("--songs", type=int, default=20, help="songs to index (and load)")
+    parser.add_argument("--negatives", type=int, default=20, help="unindexed songs (synthetic/songs)")
+    parser.add_argument("--queries", type=int, default=30, help="clips per seed, SNR and clip length")
+    parser.add_argument("--song-dir", default="songs")
+    parser.add_argument("--index", default=None, help="index path for --corpus index")
+    args = parser.parse_args()
+    calibrate(corpus=args.corpus, songs=args.songs, negatives=args.negatives, queries=args.queries,
+              song_dir=args.song_dir, index_path=args.index)
@@ -0,0 +1,347 @@
+# metrics.py
+"""
+Pipeline Metrics (Prometheus text format, no extra dependency)
+Counters, gauges and histograms kept in-process and rendered by the /metrics
+route of both APIs:
+
+    serenity_query_stage_seconds{stage=...}   decode, resample, stft, db, max_filter,
+                                              threshold, peaks, hash, lookup, vote
+    serenity_query_{peaks,hashes,postings}_total
+    serenity_train_stage_seconds{stage=...}   load, stft, db, ..., hash, add
+    serenity_index_*, serenity_process_resident_memory_bytes (sampled at scrape)
+
+Recording is a lock + a few adds per observation. With EXECUTOR == "process"
+the recognition metrics stay in the worker processes.
+
+Slow-request profiler (opt-in, PROFILE_SLOW_MS > 0): one daemon thread samples
+the stacks of threads inside profiled() every PROFILE_INTERVAL_MS; requests
+slower than PROFILE_SLOW_MS dump their samples as collapsed stacks
+(flamegraph.pl / speedscope input) into PROFILE_DIR.
+"""
+
+import os, sys, threading, time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+# ==== CONFIG ====
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROFILE_SLOW_MS = 0         # > 0: profile requests slower than this (ms)
+PROFILE_INTERVAL_MS = 5     # stack sampling period
+PROFILE_DIR = "profiles"
+
+
+# ==== METRIC TYPES ====
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels() if not self.label_names else None
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self.name, self.label_names, values))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.fn = None
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, fn):
+        """Sample fn() at scrape time instead of storing a value."""
+        self.fn = fn
+
+    def samples(self, name, label_names, values):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:   # a broken callback must not break the scrape
+                return []
+            if value is None:
+                return []
+        return [f"{name}{_label_str(label_names, values)} {_fmt(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _new_child = _Value
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _new_child = _Value
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, fn):
+        self._default().set_function(fn)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, label_names, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_label_str(label_names, values, [('le', _fmt(float(bound)))])} {cumulative}")
+        lines.append(f"{name}_sum{_label_str(label_names, values)} {_fmt(total)}")
+        lines.append(f"{name}_count{_label_str(label_names, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    @contextmanager
+    def time(self, *label_values):
+        child = self.labels(*label_values) if label_values else self._default()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - start)
+
+
+# ==== REGISTRY ====
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(cls, name, help_text, labels=(), **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, labels, **kwargs)
+        return metric
+
+
+def counter(name, help_text, labels=()):
+    return _register(Counter, name, help_text, labels)
+
+
+def gauge(name, help_text, labels=()):
+    return _register(Gauge, name, help_text, labels)
+
+
+def histogram(name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help_text, labels, buckets=buckets)
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def export_stats(prefix, stats_fn, help_text):
+    """Expose every numeric field of a stats() dict as a gauge sampled at scrape time."""
+    for key, value in stats_fn().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauge(f"{prefix}_{key}", f"{help_text}: {key}").set_function(
+                lambda key=key: stats_fn().get(key))
+
+
+# ==== PIPELINE METRICS ====
+QUERY_STAGE_SECONDS = histogram("serenity_query_stage_seconds", "Recognition time per pipeline stage", ["stage"])
+QUERY_SECONDS = histogram("serenity_query_seconds", "Recognition time per clip not answered by the cache (after decode)")
+QUERY_PEAKS = counter("serenity_query_peaks_total", "Constellation peaks picked from queries")
+QUERY_HASHES = counter("serenity_query_hashes_total", "Peak-pair hashes generated from queries")
+QUERY_POSTINGS = counter("serenity_query_postings_total", "Index postings touched by query lookups")
+RECOGNITIONS = counter("serenity_recognitions_total", "Recognized clips by outcome", ["result"])
+
+TRAIN_STAGE_SECONDS = histogram("serenity_train_stage_seconds", "Fingerprinting time per pipeline stage", ["stage"])
+TRAIN_PEAKS = counter("serenity_train_peaks_total", "Constellation peaks picked while training")
+TRAIN_HASHES = counter("serenity_train_hashes_total", "Hashes added to the index while training")
+TRAIN_SONGS = counter("serenity_train_songs_total", "Songs fingerprinted by outcome", ["result"])
+
+
+def observe_stages(stage_histogram, timings):
+    """Record a ConstellationEngine-style timings dict ({"stft_ms": ...}) per stage."""
+    for key, ms in timings.items():
+        if key.endswith("_ms"):
+            stage_histogram.labels(key[:-3]).observe(ms / 1000)
+
+
+def resident_memory_bytes():
+    """Current RSS (Linux /proc), else the peak RSS from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+gauge("serenity_process_resident_memory_bytes", "Resident memory of this process").set_function(resident_memory_bytes)
+
+
+def track_index(get_index):
+    """
+    Index size gauges, read from get_index() at every scrape. get_index() returns
+    None until the index is open (a scrape never loads it); the gauges read 0 then.
+    """
+    def reader(attr):
+        def read():
+            index = get_index()
+            return 0 if index is None else attr(index)
+        return read
+
+    gauge("serenity_index_songs", "Songs in the serving index").set_function(reader(lambda i: len(i.songs)))
+    gauge("serenity_index_postings", "Postings in the serving index").set_function(reader(lambda i: i.num_postings))
+    gauge("serenity_index_bytes", "Bytes of index arrays mapped").set_function(reader(lambda i: i.nbytes))
+    gauge("serenity_index_generation", "Index generation being served").set_function(reader(lambda i: i.generation))
+
+
+# ==== SLOW-REQUEST PROFILER ====
+SLOW_PROFILES = counter("serenity_slow_profiles_total", "Slow requests whose stack samples were written", ["name"])
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads inside track(); dumps the ones that ran slow."""
+
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR):
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self._active = {}   # thread id → stack counter
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for tid, stacks in active.items():
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    stacks[";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def track(self, name):
+        if self.slow_ms <= 0:
+            yield
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._sample_loop, name="slow-request-sampler", daemon=True)
+                    self._thread.start()
+        tid, stacks = threading.get_ident(), StackCounter()
+        with self._lock:
+            self._active[tid] = stacks
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(tid, None)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= self.slow_ms and stacks:
+                self._dump(name, elapsed_ms, stacks)
+
+    def _dump(self, name, elapsed_ms, stacks):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed_ms)}ms.folded")
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            SLOW_PROFILES.labels(name).inc()
+            print(f"🐢 {name} took {elapsed_ms:.0f} ms, stack samples → {path}")
+        except OSError as e:
+            print("⚠️ Could not write profile:", e)
+
+
+PROFILER = SamplingProfiler()
+
+
+def profiled(name):
+    """Context manager: sample this thread's stacks if profiling is on (PROFILE_SLOW_MS > 0)."""
+    return PROFILER.track(name)
@@ -0,0 +1,100 @@
+# recognition_pool.py
+"""
+Bounded Recognition Executor
+Keeps CPU-bound recognition (decode, STFT, peaks, hashing, voting) off the
+asyncio event loop, so /user/* and history requests never wait behind a query.
+
+- At most MAX_WORKERS jobs run at once; up to MAX_QUEUE_DEPTH more may wait.
+- Beyond that, submit() raises PoolSaturated → the API answers 503 + Retry-After.
+- Every job reports how long it waited in the queue vs how long it computed.
+- local=True jobs (stateful per-connection work, e.g. a stream's recognizer)
+  run on threads in this process even with EXECUTOR = "process", under the
+  same admission limit.
+"""
+
+import asyncio, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# ==== CONFIG ====
+MAX_WORKERS = os.cpu_count() or 1
+MAX_QUEUE_DEPTH = 2 * MAX_WORKERS   # waiting jobs allowed on top of running ones
+RETRY_AFTER = 1                     # seconds, sent with 503 responses
+EXECUTOR = "thread"                 # "thread" (shares the index snapshot) or "process"
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool is at capacity; the client should retry later."""
+
+    def __init__(self, retry_after=RETRY_AFTER):
+        super().__init__(f"Recognition queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn, args):
+    """Run fn(*args) and return (result, compute seconds); runs inside the worker."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class RecognitionPool:
+    """Bounded executor with admission control and queue-wait/compute timing."""
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE_DEPTH,
+                 kind=EXECUTOR, initializer=None):
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers, initializer=initializer)
+            self._local = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recognize-local")
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recognize",
+                                                initializer=initializer)
+            self._local = self._executor
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def submit(self, fn, *args, local=False):
+        """
+        Run fn(*args) on the pool without blocking the event loop (local=True: on a
+        thread of this process, for callables that mutate in-process state).
+        Returns (result, timing) where timing has queue_wait_ms and compute_ms.
+        Raises PoolSaturated if MAX_WORKERS + MAX_QUEUE_DEPTH jobs are already admitted.
+        """
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturated()
+            self.in_flight += 1
+
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._local if local else self._executor
+            result, compute = await loop.run_in_executor(executor, _timed_call, fn, args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+        total = time.perf_counter() - submitted
+        return result, {
+            "queue_wait_ms": round(max(total - compute, 0.0) * 1000, 1),
+            "compute_ms": round(compute * 1000, 1),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._local is not self._executor:
+            self._local.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,171 @@
+# result_cache.py
+"""
+Recognition Result Cache
+Retries and popular clips hit /recognize with the same audio over and over.
+Results are kept in a bounded LRU with a TTL, looked up in two tiers:
+
+    1. PCM digest   → exact same decoded samples: skips STFT, peaks and voting
+    2. hash sketch  → near-duplicate clip (re-encoded, slightly trimmed): skips
+                      the posting lookup and voting once the hashes are known
+
+The sketch is a bottom-k MinHash of the query's hash set: hashes are mixed with
+a multiplicative hash, deduplicated and the SKETCH_SIZE smallest kept (sorted).
+Two clips whose sketches estimate a Jaccard similarity >= SKETCH_MIN_SIMILARITY
+share a result (a trimmed duplicate gets the original's offset, off by the trim).
+
+Every entry belongs to one index generation (plus the query options it was
+scored with); the first lookup against a new generation drops the whole cache.
+"""
+
+import hashlib, threading, time
+from collections import OrderedDict
+import numpy as np
+
+# ==== CONFIG ====
+CACHE_ENABLED = True
+CACHE_ENTRIES = 1024           # LRU bound
+CACHE_TTL = 300.0              # seconds an entry stays valid
+SKETCH_SIZE = 64               # bottom-k values per sketch
+SKETCH_MIN_SIMILARITY = 0.75   # estimated Jaccard needed for a near-duplicate hit
+SKETCH_MIX = np.uint64(2654435761)   # Knuth multiplicative hash, spreads packed hashes over 32 bits
+
+
+def pcm_digest(y):
+    """Content digest of decoded float32 PCM."""
+    return hashlib.blake2b(np.ascontiguousarray(y, dtype=np.float32).tobytes(), digest_size=16).digest()
+
+
+def hash_sketch(q_hashes, size=SKETCH_SIZE):
+    """Bottom-k MinHash sketch of a query's hash set (sorted tuple), or None if too few hashes."""
+    mixed = (np.asarray(q_hashes, dtype=np.uint64) * SKETCH_MIX) & np.uint64(0xFFFFFFFF)
+    bottom = np.unique(mixed)[:size]
+    return tuple(bottom.tolist()) if len(bottom) == size else None
+
+
+def sketch_similarity(a, b, size=SKETCH_SIZE):
+    """Bottom-k Jaccard estimate: shared values among the k smallest of the union."""
+    union = sorted(set(a) | set(b))[:size]
+    shared = set(a) & set(b)
+    return sum(1 for v in union if v in shared) / size
+
+
+class ResultCache:
+    """Thread-safe two-tier LRU/TTL cache of recognition results."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL,
+                 sketch_size=SKETCH_SIZE, min_similarity=SKETCH_MIN_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sketch_size = sketch_size
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # digest → (result, sketch, expires)
+        self._by_value = {}             # sketch value → digests whose sketch contains it
+        self.generation = None
+        self.lookups = 0
+        self.pcm_hits = 0
+        self.sketch_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ---- bookkeeping (lock held) ----
+    def _sync_generation(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_value.clear()
+            self.generation = generation
+
+    def _drop(self, digest):
+        _, sketch, _ = self._entries.pop(digest)
+        for v in sketch or ():
+            owners = self._by_value.get(v)
+            if owners is not None:
+                owners.discard(digest)
+                if not owners:
+                    del self._by_value[v]
+
+    def _live(self, digest, now):
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if entry[2] < now:
+            self._drop(digest)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(digest)
+        return entry
+
+    @staticmethod
+    def _copy(result):
+        return [dict(m) for m in result] if result else result
+
+    # ---- API ----
+    def get(self, digest, generation):
+        """Tier 1. Returns (hit, result); result may be None for a cached no-match."""
+        with self._lock:
+            self._sync_generation(generation)
+            self.lookups += 1
+            entry = self._live(digest, time.monotonic())
+            if entry is None:
+                return False, None
+            self.pcm_hits += 1
+            return True, self._copy(entry[0])
+
+    def get_similar(self, sketch, generation):
+        """Tier 2 (call after a tier-1 miss). Returns (hit, result)."""
+        if sketch is None:
+            return False, None
+        with self._lock:
+            self._sync_generation(generation)
+            now = time.monotonic()
+            votes = {}
+            for v in sketch:
+                for digest in self._by_value.get(v, ()):
+                    votes[digest] = votes.get(digest, 0) + 1
+            needed = self.min_similarity * self.sketch_size
+            for digest, shared in sorted(votes.items(), key=lambda kv: -kv[1]):
+                if shared < needed:
+                    break
+                entry = self._live(digest, now)
+                if entry is not None and sketch_similarity(sketch, entry[1], self.sketch_size) >= self.min_similarity:
+                    self.sketch_hits += 1
+                    return True, self._copy(entry[0])
+            return False, None
+
+    def put(self, digest, sketch, result, generation):
+        with self._lock:
+            self._sync_generation(generation)
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (self._copy(result), sketch, time.monotonic() + self.ttl)
+            for v in sketch or ():
+                self._by_value.setdefault(v, set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_value.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = self.pcm_hits + self.sketch_hits
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "generation": self.generation,
+                "lookups": self.lookups,
+                "pcm_hits": self.pcm_hits,
+                "sketch_hits": self.sketch_hits,
+                "misses": self.lookups - hits,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,361 @@
+# segment_store.py
+"""
+Log-Structured Fingerprint Store
+An index directory made of immutable FingerprintIndex segments plus a manifest:
+
+    fingerprints_index/
+        MANIFEST.json       → generation counter, build params, live segments + tombstones
+        seg-000001.fpidx    → base segment (full build or last compaction)
+        seg-000002.fpidx    → small delta segment (one /train upload)
+        ...
+
+- Adding a song writes a new delta segment; nothing existing is rewritten.
+- Deleting a song only records a tombstone for the segments that hold it.
+- compact() merges all live postings into a fresh base segment.
+- Every change bumps the manifest generation; the manifest is swapped atomically.
+
+Recognition goes through snapshot(), a SegmentedIndex that queries base + deltas
+with the same lookup() API as a single FingerprintIndex.
+
+Usage:
+    python segment_store.py info
+    python segment_store.py compact
+    python segment_store.py import fingerprints_index.fpidx
+"""
+
+import os, json, threading
+import numpy as np
+from fingerprint_index import FingerprintIndex, IndexBuilder, IndexFormatError, check_params, posting_stats
+
+# ==== CONFIG ====
+INDEX_DIR = "fingerprints_index"
+MANIFEST = "MANIFEST.json"
+COMPACT_MAX_SEGMENTS = 8        # compact once this many segments pile up
+COMPACT_DEAD_FRACTION = 0.25    # ... or once this share of postings is tombstoned
+
+
+# ==== READ VIEW ====
+class SegmentedIndex:
+    """Immutable view over a set of segments; lookups skip tombstoned songs."""
+
+    def __init__(self, segments, deleted, generation=0, params=None):
+        self.segments = segments
+        self.generation = generation
+        self.params = dict(params or {})
+        self.songs = []
+        self._remaps = []
+        self._owners = []   # global song ID → (segment, local ID) holding its live postings
+        song_ids = {}
+        for seg, dead in zip(segments, deleted):
+            remap = np.full(len(seg.songs), -1, dtype=np.int64)
+            for local_id, name in enumerate(seg.songs):
+                if name in dead:
+                    continue
+                if name not in song_ids:
+                    song_ids[name] = len(self.songs)
+                    self.songs.append(name)
+                    self._owners.append((seg, local_id))
+                remap[local_id] = song_ids[name]
+            self._remaps.append(remap)
+
+    def __len__(self):
+        return sum(len(seg) for seg in self.segments)
+
+    @property
+    def num_postings(self):
+        return sum(seg.num_postings for seg in self.segments)
+
+    @property
+    def nbytes(self):
+        return sum(seg.nbytes for seg in self.segments)
+
+    def song_name(self, song_id):
+        return self.songs[int(song_id)]
+
+    def song_peaks(self, song_id):
+        """Packed constellation of one song (None if its segment has no peak store)."""
+        seg, local_id = self._owners[int(song_id)]
+        return seg.song_peaks(local_id)
+
+    def posting_counts(self, query_keys):
+        """Posting-list length of every query key summed over segments (tombstones included)."""
+        counts = np.zeros(len(query_keys), dtype=np.int64)
+        for seg in self.segments:
+            counts += seg.posting_counts(query_keys)
+        return counts
+
+    def posting_stats(self):
+        """Posting-list length statistics over all segments."""
+        if len(self.segments) == 1:
+            return self.segments[0].stats
+        keys = np.concatenate([seg.keys for seg in self.segments] or [np.empty(0, np.uint32)])
+        counts = np.concatenate([np.diff(seg.offsets) for seg in self.segments] or [np.empty(0, np.int64)])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        return posting_stats(keys, np.bincount(inverse.ravel(), weights=counts, minlength=len(keys)))
+
+    def lookup(self, query_keys, max_postings=None):
+        """
+        Same contract as FingerprintIndex.lookup, with global song IDs.
+        The max_postings stop-list applies to a key's total over all segments.
+        """
+        query_keys = np.asarray(query_keys)
+        sel = None
+        if max_postings and len(self.segments) > 1:
+            sel = np.flatnonzero(self.posting_counts(query_keys) <= max_postings)
+            query_keys, max_postings = query_keys[sel], None
+        parts = []
+        for seg, remap in zip(self.segments, self._remaps):
+            q_idx, song_ids, times = seg.lookup(query_keys, max_postings=max_postings)
+            if sel is not None:
+                q_idx = sel[q_idx]
+            song_ids = remap[song_ids] if len(remap) else song_ids.astype(np.int64)
+            live = song_ids >= 0
+            parts.append((q_idx[live], song_ids[live], times[live]))
+        if not parts:
+            return np.empty(0, np.intp), np.empty(0, np.int64), np.empty(0, np.uint32)
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+
+# ==== WRITER ====
+class SegmentStore:
+    """
+    Owns an index directory. Writers in one process serialize through a lock.
+    strict=False skips the build-parameter check; only use it for a full
+    rebuild via replace_all(), which resets the stored parameters.
+    """
+
+    def __init__(self, path=INDEX_DIR, params=None, strict=True):
+        self.path = path
+        self.params = dict(params or {})
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self._manifest_path):
+            manifest = self.read_manifest()
+            if params is not None and strict:
+                check_params(manifest["params"], params, path)
+            if params is None:
+                self.params = manifest["params"]
+        else:
+            self._write_manifest({"generation": 0, "next_segment": 1,
+                                  "params": self.params, "segments": []})
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    # ---- manifest ----
+    def read_manifest(self):
+        with open(self._manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        tmp = f"{self._manifest_path}.tmp-{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._manifest_path)
+
+    @property
+    def generation(self):
+        return self.read_manifest()["generation"]
+
+    def snapshot(self):
+        """Open every live segment (memory-mapped) as one SegmentedIndex."""
+        return open_index(self.path)
+
+    @property
+    def songs(self):
+        """Live song names, in segment order (no segment needs to be opened)."""
+        songs, seen = [], set()
+        for entry in self.read_manifest()["segments"]:
+            dead = set(entry["deleted"])
+            for name in entry["songs"]:
+                if name not in dead and name not in seen:
+                    seen.add(name)
+                    songs.append(name)
+        return songs
+
+    # ---- writes ----
+    def _write_segment(self, manifest, index, deleted=()):
+        """Save `index` as the next segment file and return its manifest entry."""
+        name = f"seg-{manifest['next_segment']:06d}.fpidx"
+        manifest["next_segment"] += 1
+        index.save(os.path.join(self.path, name), params=self.params)
+        counts = np.bincount(np.asarray(index.song_ids, dtype=np.int64), minlength=len(index.songs))
+        return {"file": name, "deleted": sorted(deleted), "songs": index.songs,
+                "postings": dict(zip(index.songs, counts.tolist()))}
+
+    def add_songs(self, builder):
+        """Append every song in an IndexBuilder as one delta segment (re-adds replace)."""
+        return self.add_index(builder.build())
+
+    def add_index(self, index):
+        """Append a built FingerprintIndex as one delta segment (re-adds replace)."""
+        with self._lock:
+            manifest = self.read_manifest()
+            for entry in manifest["segments"]:
+                replaced = set(index.songs) & set(entry["songs"])
+                entry["deleted"] = sorted(set(entry["deleted"]) | replaced)
+            manifest["segments"].append(self._write_segment(manifest, index))
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        return manifest["generation"]
+
+    def add_song(self, name, hashes, times):
+        builder = IndexBuilder()
+        builder.add(name, hashes, times)
+        return self.add_songs(builder)
+
+    def delete_song(self, name):
+        """Tombstone a song in every segment holding it. Returns False if it isn't live."""
+        with self._lock:
+            manifest = self.read_manifest()
+            found = False
+            for entry in manifest["segments"]:
+                if name in entry["songs"] and name not in entry["deleted"]:
+                    entry["deleted"].append(name)
+                    found = True
+            if found:
+                manifest["generation"] += 1
+                self._write_manifest(manifest)
+        return found
+
+    def copy_songs(self, names, builder):
+        """Add the live postings of `names` to an IndexBuilder (rebuilds keep unchanged songs)."""
+        names = set(names)
+        for entry in self.read_manifest()["segments"]:
+            wanted = names & (set(entry["songs"]) - set(entry["deleted"]))
+            if wanted:
+                seg = FingerprintIndex.load(os.path.join(self.path, entry["file"]))
+                builder.add_index(seg, exclude=set(seg.songs) - wanted)
+        return builder
+
+    def replace_all(self, index):
+        """Swap in a full rebuild as the only (base) segment."""
+        with self._lock:
+            manifest = self.read_manifest()
+            old = [entry["file"] for entry in manifest["segments"]]
+            manifest["params"] = self.params
+            manifest["segments"] = [self._write_segment(manifest, index)]
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        self._remove(old)
+        return manifest["generation"]
+
+    # ---- compaction ----
+    def needs_compaction(self):
+        manifest = self.read_manifest()
+        segments = manifest["segments"]
+        if len(segments) >= COMPACT_MAX_SEGMENTS:
+            return True
+        total = sum(sum(entry["postings"].values()) for entry in segments)
+        dead = sum(entry["postings"].get(name, 0) for entry in segments for name in entry["deleted"])
+        return bool(total) and dead / total >= COMPACT_DEAD_FRACTION
+
+    def compact(self):
+        """
+        Merge all live postings into one base segment.
+        The merge runs without the lock; segments appended meanwhile are kept,
+        and deletes that raced with the merge are re-applied to the new base.
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            merged = [dict(entry) for entry in manifest["segments"]]
+        if len(merged) <= 1 and not any(entry["deleted"] for entry in merged):
+            return manifest["generation"]
+
+        builder = IndexBuilder()
+        for entry in merged:
+            seg = FingerprintIndex.load(os.path.join(self.path, entry["file"]))
+            builder.add_index(seg, exclude=entry["deleted"])
+        index = builder.build()
+
+        with self._lock:
+            manifest = self.read_manifest()
+            merged_files = {entry["file"]: entry for entry in merged}
+            raced_deletes = set()
+            remaining = []
+            for entry in manifest["segments"]:
+                if entry["file"] in merged_files:
+                    raced_deletes |= set(entry["deleted"]) - set(merged_files[entry["file"]]["deleted"])
+                else:
+                    remaining.append(entry)
+            base = self._write_segment(manifest, index, deleted=raced_deletes & set(index.songs))
+            manifest["segments"] = [base] + remaining
+            manifest["generation"] += 1
+            self._write_manifest(manifest)
+        self._remove(merged_files)
+        print(f"🧹 Compacted {len(merged)} segments → {base['file']} ({index.num_postings} postings)")
+        return manifest["generation"]
+
+    def _remove(self, files):
+        # open memory maps stay valid after unlink, so readers on old snapshots are safe
+        for name in files:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+
+# ==== OPEN ====
+def index_generation(path=INDEX_DIR):
+    """Cheap change marker: manifest generation for a directory, mtime for a single file."""
+    if os.path.isfile(path):
+        return os.stat(path).st_mtime_ns
+    with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)["generation"]
+
+
+def open_index(path=INDEX_DIR, params=None):
+    """Open an index directory (or a single .fpidx file) for querying."""
+    if os.path.isfile(path):
+        index = FingerprintIndex.load(path, params=params)
+        return SegmentedIndex([index], [set()], index_generation(path), index.params)
+
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"No fingerprint index at {path}")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if params is not None:
+        check_params(manifest["params"], params, path)
+
+    segments = [FingerprintIndex.load(os.path.join(path, entry["file"]), params=params)
+                for entry in manifest["segments"]]
+    deleted = [set(entry["deleted"]) for entry in manifest["segments"]]
+    return SegmentedIndex(segments, deleted, manifest["generation"], manifest["params"])
+
+
+# ==== RUN ====
+if __name__ == "__main__":
+    import sys
+    from fingerprint_train import BUILD_PARAMS, DB_PATH
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "info"
+    try:
+        store = SegmentStore(DB_PATH, BUILD_PARAMS)
+    except IndexFormatError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if cmd == "compact":
+        store.compact()
+    elif cmd == "import" and len(sys.argv) > 2:
+        store.replace_all(FingerprintIndex.load(sys.argv[2], params=BUILD_PARAMS))
+        print(f"✅ Imported {sys.argv[2]} into {DB_PATH}")
+    elif cmd != "info":
+        print("Usage: python segment_store.py [info | compact | import <file.fpidx>]")
+        sys.exit(1)
+
+    manifest = store.read_manifest()
+    snap = store.snapshot()
+    print(f"📂 {DB_PATH}: generation {manifest['generation']}, {len(manifest['segments'])} segments, "
+          f"{len(snap.songs)} songs, {snap.num_postings} postings, {snap.nbytes / 1e6:.1f} MB")
+    for entry in manifest["segments"]:
+        print(f"   {entry['file']}: {len(entry['songs'])} songs, "
+              f"{sum(entry['postings'].values())} postings, {len(entry['deleted'])} tombstones")
+    stats = snap.posting_stats()
+    print(f"📊 postings per key: mean {stats['mean']}, p50 {stats['p50']:g}, p99 {stats['p99']:g}, "
+          f"p99.9 {stats['p999']:g}, max {stats['max']}")
+    print("   heaviest keys: " + ", ".join(f"{key:#09x}×{count}" for key, count in stats["top"][:5]))
@@ -0,0 +1,255 @@
+# sharded_index.py
+"""
+Sharded Fingerprint Index (scatter-gather over local shard processes)
+The hash space is split into N contiguous key ranges, one per shard process.
+Every shard memory-maps the same index files (the page cache is shared), but
+only ever touches the postings of its own range:
+
+    query hashes → route by key range → shard lookups + partial (song, offset) histograms
+                 → gather → merge bins → score_histogram
+
+Range boundaries are chosen so each shard holds about the same number of
+postings, and are recomputed on every reload. Each request names the index
+generation it was routed for; shards keep the last KEEP_GENERATIONS snapshots
+open, so a hot reload never mixes two generations inside one query.
+
+Usage (live_recognize does this when SHARDS > 1):
+    pool = ShardPool(INDEX_DIR, 4, BUILD_PARAMS)
+    db = ShardedIndex(pool)        # snapshot; open a new one to reload
+"""
+
+import itertools, threading
+import multiprocessing as mp
+from concurrent.futures import Future
+import numpy as np
+from segment_store import open_index, INDEX_DIR
+from match_scoring import offset_histogram, score_histogram, idf_weights, TOP_MATCHES, MAX_POSTINGS
+
+# ==== CONFIG ====
+SHARD_TIMEOUT = 10.0     # seconds to wait for one shard's answer
+KEEP_GENERATIONS = 2     # snapshots each shard keeps open for in-flight queries
+OPEN_RETRIES = 3         # attempts to get every shard onto the same generation
+
+
+class ShardError(RuntimeError):
+    """A shard process failed or could not serve the requested generation."""
+
+
+# ==== SHARD PROCESS ====
+def _shard_main(conn, path, params):
+    """Shard loop: serve lookups/partial histograms for whatever keys get routed here."""
+    snapshots = {}
+
+    def open_latest():
+        index = open_index(path, params=params)
+        snapshots[index.generation] = index
+        for old in sorted(snapshots)[:-KEEP_GENERATIONS]:
+            del snapshots[old]
+        return index
+
+    def snapshot(generation):
+        if generation not in snapshots:
+            open_latest()
+        if generation not in snapshots:
+            raise ShardError(f"generation {generation} is gone (newest is {max(snapshots)})")
+        return snapshots[generation]
+
+    while True:
+        try:
+            req, op, generation, payload = conn.recv()
+        except EOFError:
+            return
+        if op == "stop":
+            return
+        try:
+            if op == "open":
+                result = open_latest().generation
+            elif op == "lookup":
+                keys, max_postings = payload
+                result = snapshot(generation).lookup(keys, max_postings=max_postings)
+            elif op == "votes":
+                hashes, times, max_postings, idf = payload
+                index = snapshot(generation)
+                q_idx, song_ids, song_times = index.lookup(hashes, max_postings=max_postings)
+                offsets = song_times.astype(np.int64) - times[q_idx].astype(np.int64)
+                weights = None
+                if idf and len(q_idx):
+                    weights = idf_weights(index.posting_counts(hashes), len(index.songs))[q_idx]
+                result = offset_histogram(song_ids, offsets, weights)
+            else:
+                raise ShardError(f"unknown shard op {op!r}")
+            conn.send((req, True, result))
+        except Exception as e:
+            conn.send((req, False, f"{type(e).__name__}: {e}"))
+
+
+class _ShardClient:
+    """Parent-side handle of one shard: a pipe, a reply thread and pending futures."""
+
+    def __init__(self, ctx, shard_id, path, params):
+        self.shard_id = shard_id
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_main, args=(child, path, params),
+                                   name=f"fingerprint-shard-{shard_id}", daemon=True)
+        self.process.start()
+        child.close()
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._reader = threading.Thread(target=self._read, name=f"shard-{shard_id}-reader", daemon=True)
+        self._reader.start()
+
+    def request(self, op, generation=None, payload=None):
+        future = Future()
+        with self._send_lock:
+            req = next(self._ids)
+            self._pending[req] = future
+            try:
+                self.conn.send((req, op, generation, payload))
+            except (OSError, BrokenPipeError) as e:
+                self._pending.pop(req, None)
+                raise ShardError(f"shard {self.shard_id} is gone: {e}") from e
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                req, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(req, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(ShardError(f"shard {self.shard_id}: {result}"))
+        for future in self._pending.values():   # process died: fail whatever was waiting
+            future.set_exception(ShardError(f"shard {self.shard_id} exited"))
+        self._pending.clear()
+
+    def stop(self):
+        try:
+            with self._send_lock:
+                self.conn.send((None, "stop", None, None))
+        except OSError:
+            pass
+        self.process.join(timeout=2)
+
+
+class ShardPool:
+    """N shard processes over one index path. Long-lived; ShardedIndex snapshots share it."""
+
+    def __init__(self, path=INDEX_DIR, n_shards=2, params=None):
+        ctx = mp.get_context("spawn")   # never fork a process that runs server threads
+        self.path = path
+        self.params = params
+        self.shards = [_ShardClient(ctx, i, path, params) for i in range(n_shards)]
+        print(f"🧩 Started {n_shards} fingerprint shard processes.")
+
+    def __len__(self):
+        return len(self.shards)
+
+    def broadcast(self, op, generation=None):
+        futures = [shard.request(op, generation) for shard in self.shards]
+        return [f.result(timeout=SHARD_TIMEOUT) for f in futures]
+
+    def scatter(self, op, generation, parts):
+        """Send parts[i] to shard i (None skips it); returns the gathered results."""
+        futures = [shard.request(op, generation, part) if part is not None else None
+                   for shard, part in zip(self.shards, parts)]
+        return [f.result(timeout=SHARD_TIMEOUT) if f is not None else None for f in futures]
+
+    def shutdown(self):
+        for shard in self.shards:
+            shard.stop()
+
+
+# ==== ROUTING ====
+def shard_bounds(index, n_shards):
+    """
+    Upper key bounds (exclusive) of shards 0 .. n-2, balanced by posting count.
+    A key k goes to shard searchsorted(bounds, k, side="right").
+    """
+    keys, counts = [], []
+    for seg in getattr(index, "segments", [index]):
+        keys.append(np.asarray(seg.keys))
+        counts.append(np.diff(np.asarray(seg.offsets)))
+    if not keys or not sum(len(k) for k in keys):
+        return np.zeros(0, dtype=np.uint32)
+    keys = np.concatenate(keys)
+    counts = np.concatenate(counts)
+    order = np.argsort(keys, kind="stable")
+    keys, cumulative = keys[order], np.cumsum(counts[order])
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    return keys[np.minimum(np.searchsorted(cumulative, targets), len(keys) - 1)]
+
+
+class ShardedIndex:
+    """
+    One index generation served by a ShardPool. Same read API as SegmentedIndex
+    (songs, song_name, lookup, generation) plus score(), which merges per-shard
+    (song, offset) histograms instead of shipping every posting back.
+    """
+
+    def __init__(self, pool, params=None):
+        self.pool = pool
+        for _ in range(OPEN_RETRIES):
+            local = open_index(pool.path, params=params or pool.params)
+            generations = pool.broadcast("open")
+            if all(g == local.generation for g in generations):
+                break
+        else:
+            raise ShardError(f"shards did not settle on one generation: {generations}")
+        # the parent view is only used for song names, sizes and range bounds
+        self.generation = local.generation
+        self.params = local.params
+        self.songs = local.songs
+        self._len = len(local)
+        self.num_postings = local.num_postings
+        self.nbytes = local.nbytes
+        self.bounds = shard_bounds(local, len(pool))
+
+    def __len__(self):
+        return self._len
+
+    def song_name(self, song_id):
+        return self.songs[int(song_id)]
+
+    def _route(self, query_keys):
+        """Split query positions by shard → list of index arrays (empty shards → None)."""
+        shard_of = np.searchsorted(self.bounds, query_keys, side="right")
+        order = np.argsort(shard_of, kind="stable")
+        splits = np.searchsorted(shard_of[order], np.arange(1, len(self.pool)))
+        return [sel if len(sel) else None for sel in np.split(order, splits)]
+
+    def lookup(self, query_keys, max_postings=None):
+        """Same contract as FingerprintIndex.lookup (postings are shipped back)."""
+        query_keys = np.asarray(query_keys)
+        routes = self._route(query_keys)
+        replies = self.pool.scatter("lookup", self.generation,
+                                    [(query_keys[sel], max_postings) if sel is not None else None
+                                     for sel in routes])
+        parts = [(sel[q_idx], song_ids, times)
+                 for sel, (q_idx, song_ids, times) in
+                 ((sel, reply) for sel, reply in zip(routes, replies) if sel is not None)]
+        if not parts:
+            return np.empty(0, np.intp), np.empty(0, np.int64), np.empty(0, np.uint32)
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+    def score(self, q_hashes, q_times, max_postings=MAX_POSTINGS, idf=False, top_n=TOP_MATCHES):
+        """Scatter hashes, gather partial histograms, merge and rank (score_histogram tuples)."""
+        q_hashes, q_times = np.asarray(q_hashes), np.asarray(q_times)
+        routes = self._route(q_hashes)
+        replies = self.pool.scatter("votes", self.generation,
+                                    [(q_hashes[sel], q_times[sel], max_postings, idf) if sel is not None else None
+                                     for sel in routes])
+        partial = [reply for reply in replies if reply is not None and len(reply[0])]
+        if not partial:
+            return []
+        songs, offsets, counts = (np.concatenate(cols) for cols in zip(*partial))
+        # the same (song, offset) bin can collect votes from several shards
+        bin_songs, bin_offsets, bin_counts = offset_histogram(songs, offsets, weights=counts)
+        if not idf:
+            bin_counts = bin_counts.astype(np.int64)
+        return score_histogram(bin_songs, bin_offsets, bin_counts, len(q_hashes), top_n=top_n)
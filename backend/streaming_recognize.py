@@ -0,0 +1,239 @@
+# streaming_recognize.py
+"""
+Streaming Early-Exit Recognition
+Consumes audio in small chunks instead of a fixed 7-second recording:
+
+    chunk → pre-emphasis → incremental STFT frames → peaks over a sliding window
+          → new peak-pair hashes → posting lookup → running (song, offset) histogram
+
+and stops as soon as the leading song's offset-aligned votes clear a confidence
+margin over the runner-up (often after 2–3 s).
+
+Differences from the one-shot query path (live_recognize.recognize_audio):
+- dB levels are relative to the loudest frame seen so far, not the whole clip.
+- The query path's adaptive-percentile peaks are a subset of its fixed
+  AMP_MIN peaks, so only the AMP_MIN threshold is applied here.
+
+Audio sources:
+    MicAudioSource   → sounddevice input stream (imported lazily)
+    FileAudioSource  → file-backed fake mic for tests and offline runs
+
+Usage:
+    python streaming_recognize.py                      → live mic
+    python streaming_recognize.py song.mp3 [--realtime] → file as a fake mic
+"""
+
+import time, queue
+import numpy as np
+from fingerprint_core import (extend_hashes, ConstellationEngine, SR, N_FFT, HOP_LENGTH,
+                              PEAK_NEIGHBORHOOD, FREQ_BIN_IGNORE, AMP_MIN, TOP_DB)
+from match_scoring import score_offsets, MAX_POSTINGS
+from live_recognize import RECORD_DURATION
+
+# ==== CONFIG ====
+CHUNK_SECONDS = 0.25      # audio per feed() call from the built-in sources
+MIN_SECONDS = 1.0         # never answer before this much audio
+MAX_SECONDS = RECORD_DURATION * 2   # give up (return best guess) after this much
+MIN_VOTES = 8             # leading song needs at least this many aligned votes...
+VOTE_MARGIN = 2.0         # ...and this many times the runner-up's votes
+
+# max filter window: PEAK_NEIGHBORHOOD=(10, 10) covers frames t-5 .. t+4
+_BACK = PEAK_NEIGHBORHOOD[1] // 2
+_AHEAD = PEAK_NEIGHBORHOOD[1] - _BACK - 1
+
+
+class StreamingRecognizer:
+    """Incremental recognizer for one audio stream against one index snapshot."""
+
+    def __init__(self, db, sr=SR):
+        if sr != SR:
+            raise ValueError(f"StreamingRecognizer expects {SR} Hz audio, got {sr}")
+        self.db = db
+        self._window = ConstellationEngine().window
+        self._samples = np.zeros(N_FFT // 2, dtype=np.float32)   # centre padding, like librosa
+        self._prev_sample = None                                  # pre-emphasis state
+        self._spec = np.empty((N_FFT // 2 + 1, 0), dtype=np.float32)
+        self._spec_start = 0      # absolute frame index of _spec[:, 0]
+        self._next_frame = 0      # first frame whose peaks are not final yet
+        self._ref = 0.0           # loudest magnitude so far (dB reference)
+        self._context = np.empty((0, 2), dtype=np.int64)
+        self._song_ids, self._offsets = [], []
+        self.samples_seen = 0
+        self.n_hashes = 0
+        self.matches = []
+
+    @property
+    def seconds(self):
+        return self.samples_seen / SR
+
+    # ---- pipeline ----
+    def feed(self, chunk):
+        """Add a chunk of mono float audio at SR. Returns the current top matches."""
+        chunk = np.asarray(chunk, dtype=np.float32).ravel()
+        if not len(chunk):
+            return self.matches
+        emph = np.empty_like(chunk)
+        emph[0] = chunk[0] if self._prev_sample is None else chunk[0] - 0.97 * self._prev_sample
+        emph[1:] = chunk[1:] - 0.97 * chunk[:-1]
+        self._prev_sample = chunk[-1]
+        self.samples_seen += len(chunk)
+
+        self._samples = np.concatenate([self._samples, emph])
+        self._stft()
+        self._emit_peaks(final=False)
+        return self.matches
+
+    def finish(self):
+        """Flush the last frames (end of stream) and return the final matches."""
+        self._samples = np.concatenate([self._samples, np.zeros(N_FFT // 2, dtype=np.float32)])
+        self._stft()
+        self._emit_peaks(final=True)
+        return self.matches
+
+    def _stft(self):
+        n_frames = (len(self._samples) - N_FFT) // HOP_LENGTH + 1
+        if n_frames <= 0:
+            return
+        frames = np.lib.stride_tricks.sliding_window_view(self._samples, N_FFT)[::HOP_LENGTH][:n_frames]
+        mags = np.abs(np.fft.rfft(frames * self._window, axis=1)).T.astype(np.float32)
+        self._samples = self._samples[n_frames * HOP_LENGTH:]
+        self._spec = np.concatenate([self._spec, mags], axis=1)
+        self._ref = max(self._ref, float(mags.max()))
+
+    def _emit_peaks(self, final):
+        end = self._spec_start + self._spec.shape[1]
+        last = end if final else end - _AHEAD          # frames still missing look-ahead wait
+        if last <= self._next_frame:
+            return
+
+        # dB relative to the loudest frame so far, floored at -TOP_DB
+        S = self._spec
+        ref_db = 20 * np.log10(max(self._ref + 1e-6, 1e-5))
+        S_db = np.maximum(20 * np.log10(np.maximum(S + 1e-6, 1e-5)) - ref_db, -TOP_DB)
+
+        local_max = ConstellationEngine.local_max(S_db)
+        lo, hi = self._next_frame - self._spec_start, last - self._spec_start
+        # digital silence (S == 0) is flat at 0 dB while nothing louder has been seen: no peaks there
+        mask = local_max[:, lo:hi] & (S_db[:, lo:hi] >= AMP_MIN) & (S[:, lo:hi] > 0)
+        mask[:FREQ_BIN_IGNORE] = False
+        t, f = np.nonzero(mask.T)                      # (t, f) order
+        peaks = np.stack([f, t + self._next_frame], axis=1)
+
+        hashes, q_times, self._context = extend_hashes(self._context, peaks)
+        self._next_frame = last
+
+        # keep only the look-back context the max filter needs
+        drop = max(0, self._next_frame - _BACK - self._spec_start)
+        self._spec = self._spec[:, drop:]
+        self._spec_start += drop
+
+        if len(hashes):
+            self._vote(hashes, q_times)
+
+    def _vote(self, hashes, q_times):
+        self.n_hashes += len(hashes)
+        q_idx, song_ids, song_times = self.db.lookup(hashes, max_postings=MAX_POSTINGS)
+        if len(song_ids):
+            self._song_ids.append(np.asarray(song_ids, dtype=np.int64))
+            self._offsets.append(song_times.astype(np.int64) - q_times[q_idx].astype(np.int64))
+            self.matches = [
+                {"song": self.db.song_name(sid), "votes": votes, "offset": offset, "confidence": conf}
+                for sid, votes, offset, conf in score_offsets(
+                    np.concatenate(self._song_ids), np.concatenate(self._offsets), self.n_hashes)
+            ]
+
+    # ---- decision ----
+    def confident(self, min_votes=MIN_VOTES, margin=VOTE_MARGIN, min_seconds=MIN_SECONDS):
+        """True once the leader clears min_votes and `margin` × the runner-up."""
+        if self.seconds < min_seconds or not self.matches:
+            return False
+        top = self.matches[0]["votes"]
+        runner_up = self.matches[1]["votes"] if len(self.matches) > 1 else 0
+        return top >= min_votes and top >= margin * max(runner_up, 1)
+
+
+def recognize_stream(source, db, max_seconds=MAX_SECONDS, **decision):
+    """
+    Feed chunks from `source` until the match is confident or max_seconds pass.
+    Returns (matches or None, info) where info has seconds, hashes and early_exit.
+    """
+    rec = StreamingRecognizer(db)
+    start = time.time()
+    early = False
+    for chunk in source:
+        rec.feed(chunk)
+        if rec.confident(**decision):
+            early = True
+            break
+        if rec.seconds >= max_seconds:
+            break
+    if not early:
+        rec.finish()
+    info = {
+        "audio_seconds": round(rec.seconds, 2),
+        "wall_seconds": round(time.time() - start, 2),
+        "hashes": rec.n_hashes,
+        "early_exit": early,
+    }
+    return (rec.matches or None), info
+
+
+# ==== AUDIO SOURCES ====
+class FileAudioSource:
+    """Yields a file (or array) in chunks, like a microphone would. realtime=True paces it."""
+
+    def __init__(self, source, chunk_seconds=CHUNK_SECONDS, realtime=False):
+        if isinstance(source, str):
+            import librosa
+            source, _ = librosa.load(source, sr=SR, mono=True)
+        self.y = np.asarray(source, dtype=np.float32)
+        self.chunk = max(1, int(chunk_seconds * SR))
+        self.realtime = realtime
+
+    def __iter__(self):
+        for i in range(0, len(self.y), self.chunk):
+            if self.realtime:
+                time.sleep(self.chunk / SR)
+            yield self.y[i:i + self.chunk]
+
+
+class MicAudioSource:
+    """Live microphone chunks via sounddevice (needs PortAudio)."""
+
+    def __init__(self, chunk_seconds=CHUNK_SECONDS, max_seconds=MAX_SECONDS):
+        self.chunk = int(chunk_seconds * SR)
+        self.max_chunks = int(np.ceil(max_seconds / chunk_seconds))
+
+    def __iter__(self):
+        import sounddevice as sd
+        chunks = queue.Queue()
+        with sd.InputStream(samplerate=SR, channels=1, dtype="float32", blocksize=self.chunk,
+                            callback=lambda data, frames, t, status: chunks.put(data[:, 0].copy())):
+            for _ in range(self.max_chunks):
+                yield chunks.get()
+
+
+# ==== MAIN ENTRY ====
+def main(argv=None):
+    import argparse
+    from live_recognize import get_db
+
+    parser = argparse.ArgumentParser(description="Streaming early-exit recognition.")
+    parser.add_argument("file", nargs="?", help="audio file to replay as a fake mic (default: live mic)")
+    parser.add_argument("--realtime", action="store_true", help="pace file playback at real time")
+    args = parser.parse_args(argv)
+
+    source = FileAudioSource(args.file, realtime=args.realtime) if args.file else MicAudioSource()
+    print("🎙️ Listening..." if not args.file else f"📀 Streaming {args.file}...")
+    matches, info = recognize_stream(source, get_db())
+    if matches:
+        top = matches[0]
+        print(f"\n✅ Match: {top['song']}  (votes={top['votes']}, offset={top['offset']})")
+    else:
+        print("\n❌ No match found.")
+    print(f"⏱️ {info['audio_seconds']} s of audio, {info['wall_seconds']} s wall, "
+          f"{'early exit' if info['early_exit'] else 'full window'}")
+
+
+if __name__ == "__main__":
+    main()
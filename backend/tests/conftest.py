@@ -0,0 +1,31 @@
+# conftest.py
+"""Shared fixtures: the backend modules are flat, so put backend/ on the path."""
+
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    """Three short synthetic songs (benchmark.make_corpus), name → float32 audio at SR."""
+    import benchmark
+    return benchmark.make_corpus(3, 20, seed=0)
+
+
+@pytest.fixture(scope="session")
+def song_db(corpus):
+    """Throwaway in-memory index of `corpus`."""
+    import benchmark
+    return benchmark.build_index(corpus)
+
+
+@pytest.fixture
+def recognizer(song_db, monkeypatch):
+    """This process's Recognizer, serving song_db (no index on disk)."""
+    import live_recognize
+    rec = live_recognize.Recognizer()
+    rec._db = song_db
+    monkeypatch.setattr(live_recognize, "_recognizer", rec)
+    return rec
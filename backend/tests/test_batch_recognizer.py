@@ -0,0 +1,49 @@
+# test_batch_recognizer.py
+import asyncio, io
+import numpy as np
+import pytest
+import soundfile as sf
+from fingerprint_core import SR
+from batch_recognizer import MicroBatcher
+from recognition_pool import RecognitionPool
+
+
+def wav_bytes(y, subtype="FLOAT"):
+    buf = io.BytesIO()
+    sf.write(buf, y, SR, format="WAV", subtype=subtype)
+    return buf.getvalue()
+
+
+def clip_of(corpus, name, start_s=5, seconds=5):
+    return corpus[name][start_s * SR:(start_s + seconds) * SR]
+
+
+def test_bad_clip_fails_alone_in_recognize_bytes_batch(corpus, recognizer):
+    name = sorted(corpus)[1]
+    bad = np.zeros(SR * 2, dtype=np.float32)
+    bad[100] = np.nan
+    results = recognizer.recognize_bytes_batch([wav_bytes(bad), wav_bytes(clip_of(corpus, name))])
+    assert isinstance(results[0], ValueError)
+    matches, timing = results[1]
+    assert matches[0]["song"] == name
+    assert set(timing) == {"decode_ms", "resample_ms", "recognize_ms"}
+
+
+def test_micro_batch_with_bad_and_good_clip(corpus, recognizer):
+    name = sorted(corpus)[2]
+    bad = np.zeros(SR * 2, dtype=np.float32)
+    bad[100] = np.nan
+
+    async def run():
+        batcher = MicroBatcher(RecognitionPool(max_workers=1, kind="thread"), window_ms=50, max_batch=2)
+        return await asyncio.gather(batcher.recognize(wav_bytes(bad)),
+                                    batcher.recognize(wav_bytes(clip_of(corpus, name))),
+                                    return_exceptions=True), batcher
+
+    (bad_result, good_result), batcher = asyncio.run(run())
+    assert batcher.batches == 1
+    assert isinstance(bad_result, ValueError)
+    assert "not finite" in str(bad_result)
+    matches, timing = good_result
+    assert matches[0]["song"] == name
+    assert timing["batch_size"] == 2
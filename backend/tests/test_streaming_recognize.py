@@ -0,0 +1,29 @@
+# test_streaming_recognize.py
+import numpy as np
+from fingerprint_core import SR
+from streaming_recognize import FileAudioSource, recognize_stream
+
+
+def test_indexed_song_exits_early(corpus, song_db):
+    name = sorted(corpus)[0]
+    clip = corpus[name][8 * SR:18 * SR]
+    matches, info = recognize_stream(FileAudioSource(clip), song_db)
+    assert info["early_exit"]
+    assert info["audio_seconds"] < 10
+    assert matches[0]["song"] == name
+
+
+def test_silence_is_no_match(song_db):
+    matches, info = recognize_stream(FileAudioSource(np.zeros(4 * SR, dtype=np.float32)), song_db)
+    assert matches is None
+    assert not info["early_exit"]
+    assert info["audio_seconds"] == 4.0
+    assert info["hashes"] == 0
+
+
+def test_max_seconds_stops_without_answer(corpus, song_db):
+    name = sorted(corpus)[1]
+    clip = corpus[name][8 * SR:18 * SR]
+    matches, info = recognize_stream(FileAudioSource(clip), song_db, max_seconds=0.5, min_votes=10 ** 6)
+    assert not info["early_exit"]
+    assert 0.5 <= info["audio_seconds"] <= 0.75   # stops within a chunk of max_seconds
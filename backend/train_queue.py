@@ -0,0 +1,371 @@
+# train_queue.py
+"""
+Background Training Queue
+/train used to decode, fingerprint and commit inside the request, so bulk
+uploads from the admin panel timed out. Uploads now become jobs:
+
+    submit()  → digest checks (unchanged / exact duplicate answer at once),
+                upload parked as a dotfile in SONG_DIR, job ID returned
+    workers   → TRAIN_WORKERS processes fingerprint queued files in parallel
+    writer    → one thread collects finished fingerprints (up to COMMIT_BATCH,
+                waiting COMMIT_WAIT for stragglers), drops near duplicates and
+                commits them as a single delta segment + ingest manifest update
+
+Only the writer touches the index, so concurrent uploads never race. A worker
+that dies (e.g. killed for memory on a long mix) fails the jobs it held; the
+pool is rebuilt for the next upload. Job state:
+
+    queued → fingerprinting → fingerprinted → committing → done
+                                          ↘ duplicate | superseded | failed
+"""
+
+import os, queue, threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fingerprint_train import compute_fingerprint, drop_near_duplicates
+from fingerprint_index import IndexBuilder
+from ingest_manifest import content_digest
+from metrics import TRAIN_SONGS, TRAIN_HASHES, TRAIN_STAGE_SECONDS, histogram
+
+# ==== CONFIG ====
+TRAIN_WORKERS = os.cpu_count() or 1
+MAX_PENDING_JOBS = 256    # jobs not yet committed; beyond this submit() raises TrainQueueFull
+COMMIT_BATCH = 32         # songs per delta segment at most
+COMMIT_WAIT = 1.0         # seconds the writer waits for other running jobs to join a batch
+JOB_HISTORY = 1000        # finished jobs kept for status polling
+RETRY_AFTER = 5           # seconds, sent with 503 responses
+
+TRAIN_JOB_SECONDS = histogram("serenity_train_job_seconds", "Upload to commit time per training job")
+
+
+class TrainQueueFull(Exception):
+    """Raised when MAX_PENDING_JOBS jobs are waiting; the client should retry later."""
+
+    def __init__(self, retry_after=RETRY_AFTER):
+        super().__init__(f"Training queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def check_song_name(song):
+    """Reject names that are not a plain file name in SONG_DIR (raises ValueError)."""
+    if (not song or song != os.path.basename(song) or "/" in song or "\\" in song
+            or song.startswith(".")):   # dotfiles are in-flight uploads
+        raise ValueError(f"Invalid song file name {song!r}")
+
+
+def _fingerprint_job(path):
+    """Worker entry point: (hashes, times, error, compute seconds); never raises."""
+    start = time.perf_counter()
+    try:
+        hashes, times = compute_fingerprint(path)
+        return hashes, times, None, time.perf_counter() - start
+    except Exception as e:
+        return None, None, str(e), time.perf_counter() - start
+
+
+class TrainJob:
+    """One uploaded song on its way into the index."""
+
+    def __init__(self, song, digest, size, path=None, force=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.song = song
+        self.force = force   # index even if it duplicates another song
+        self.digest = digest
+        self.size = size
+        self.path = path
+        self.status = "queued"
+        self.future = None
+        self.hashes = None
+        self.times = None
+        self.hashes_count = None
+        self.error = None
+        self.duplicate_of = None
+        self.coverage = None
+        self.created = time.time()
+        self.fingerprint_ms = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        self.hashes_count = 0 if self.hashes is None else len(self.hashes)
+        self.hashes = self.times = None   # the postings live in the index now
+        TRAIN_JOB_SECONDS.observe(self.finished - self.created)
+
+    def to_dict(self):
+        status = self.status
+        if status == "queued" and self.future is not None and self.future.running():
+            status = "fingerprinting"
+        message = None
+        if status == "duplicate":
+            message = (f"Not indexed: duplicates {self.duplicate_of} ({self.coverage:.0%} of its hashes "
+                       f"match at one offset); resend with force=true to index it anyway")
+        return {
+            "job_id": self.id,
+            "song": self.song,
+            "status": status,
+            "message": message,
+            "hashes": self.hashes_count,
+            "duplicate_of": self.duplicate_of,
+            "coverage": self.coverage,
+            "error": self.error,
+            "fingerprint_ms": self.fingerprint_ms,
+            "elapsed_s": round((self.finished or time.time()) - self.created, 3),
+        }
+
+
+class TrainQueue:
+    """Parallel fingerprinting, single-writer batched commits to a SegmentStore."""
+
+    def __init__(self, store, ingest, song_dir, workers=TRAIN_WORKERS, on_commit=None,
+                 commit_batch=COMMIT_BATCH, commit_wait=COMMIT_WAIT, max_pending=MAX_PENDING_JOBS):
+        self.store = store
+        self.ingest = ingest
+        self.song_dir = song_dir
+        self.workers = workers
+        self.on_commit = on_commit   # called after every commit (reload recognizer, compaction)
+        self.commit_batch = commit_batch
+        self.commit_wait = commit_wait
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()   # job id → TrainJob, oldest first
+        self._pending = 0            # submitted, not yet finished
+        self._running = 0            # handed to the workers, not yet fingerprinted
+        self._ready = queue.Queue()  # fingerprinted jobs for the writer
+        self._closed = False
+        self.commits = 0
+        self.committed = 0
+        self._writer = threading.Thread(target=self._write_loop, name="train-writer", daemon=True)
+        self._writer.start()
+
+    # ---- submit ----
+    def submit(self, song, data, force=False):
+        """
+        Queue one upload (filename, bytes). Returns the TrainJob; raises TrainQueueFull,
+        or ValueError for a file name with a path in it.
+        force=True skips the exact and near duplicate checks (re-uploads of the same file are still no-ops).
+        """
+        check_song_name(song)
+        job = TrainJob(song, content_digest(data), len(data), force=force)
+        live = set(self.store.songs)
+        entry = self.ingest.unchanged(song, job.digest, live)
+        original = None if entry or force else self.ingest.same_content(job.digest, live, exclude=song)
+        with self._lock:
+            if entry is None and original is None and not force:
+                # a song queued earlier in this session may carry the same bytes
+                for other in reversed(self._jobs.values()):
+                    if not other.done and other.digest == job.digest:
+                        original = other.song
+                        break
+            if entry is not None or original is not None:
+                job.duplicate_of = None if entry is not None else original
+                job.coverage = None if entry is not None else 1.0
+                job.finish("unchanged" if entry is not None or original == song else "duplicate")
+                job.hashes_count = entry["hashes"] if entry is not None else 0
+                TRAIN_SONGS.labels(job.status).inc()
+                self._remember(job)
+                return job
+            if self._pending >= self.max_pending:
+                raise TrainQueueFull()
+            self._pending += 1
+            self._running += 1
+            self._remember(job)
+
+        # fingerprint a dotfile copy; it only becomes SONG_DIR/<song> once committed
+        try:
+            os.makedirs(self.song_dir, exist_ok=True)
+            job.path = os.path.join(self.song_dir, f".upload-{job.id}-{song}")
+            with open(job.path, "wb") as f:
+                f.write(data)
+            executor = self._pool()
+            try:
+                job.future = executor.submit(_fingerprint_job, job.path)
+            except RuntimeError:   # broken (a worker died) or shut down by a concurrent reset: retry once
+                self._reset_pool(executor)
+                executor = self._pool()
+                job.future = executor.submit(_fingerprint_job, job.path)
+        except BaseException:
+            self._discard_upload(job)
+            with self._lock:
+                self._pending -= 1
+                self._running -= 1
+                self._jobs.pop(job.id, None)
+            raise
+        job.future.add_done_callback(lambda future, job=job, ex=executor: self._fingerprinted(job, future, ex))
+        return job
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _reset_pool(self, broken):
+        """Drop a broken executor; the next upload starts a fresh one."""
+        with self._lock:
+            if self._executor is not broken:   # already replaced
+                return
+            self._executor = None
+        print("⚠️ Fingerprinting pool is unusable (worker died or shut down), restarting it")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _remember(self, job):
+        self._jobs[job.id] = job
+        while len(self._jobs) > JOB_HISTORY:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.done:
+                break
+            self._jobs.popitem(last=False)
+
+    def _fingerprinted(self, job, future, executor):
+        try:
+            hashes, times, error, seconds = future.result()
+            job.fingerprint_ms = round(seconds * 1000, 1)
+        except BrokenProcessPool:   # its worker (or another) died: every job in that pool fails
+            hashes, times, error = None, None, "fingerprinting worker died (out of memory?)"
+            self._reset_pool(executor)
+        except Exception as e:   # pool shut down
+            hashes, times, error = None, None, str(e)
+        with self._lock:
+            self._running -= 1
+        if error is not None:
+            self._fail(job, error)
+            return
+        job.hashes, job.times = hashes, times
+        job.status = "fingerprinted"
+        self._ready.put(job)
+
+    def _fail(self, job, error):
+        print(f"❌ Training job {job.id} ({job.song}) failed: {error}")
+        self._discard_upload(job)
+        job.finish("failed", error)
+        TRAIN_SONGS.labels("error").inc()
+        with self._lock:
+            self._pending -= 1
+
+    def _discard_upload(self, job):
+        if job.path and os.path.exists(job.path):
+            os.remove(job.path)
+
+    # ---- writer ----
+    def _write_loop(self):
+        while not self._closed:
+            try:
+                batch = [self._ready.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.commit_wait
+            while len(batch) < self.commit_batch:
+                try:
+                    batch.append(self._ready.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    break
+                try:
+                    batch.append(self._ready.get(timeout=min(remaining, 0.05)))
+                except queue.Empty:
+                    pass
+            try:
+                self._commit(batch)
+            except Exception as e:
+                for job in batch:
+                    if not job.done:
+                        self._fail(job, f"commit failed: {e}")
+
+    def _commit(self, batch):
+        """Dedupe and commit fingerprinted jobs as one delta segment."""
+        for job in batch:
+            job.status = "committing"
+        # the newest upload of a name wins
+        latest = OrderedDict()
+        for job in batch:
+            older = latest.pop(job.song, None)
+            if older is not None:
+                self._settle(older, "superseded")
+            latest[job.song] = job
+
+        with TRAIN_STAGE_SECONDS.time("commit"):
+            builder = IndexBuilder()
+            for job in latest.values():
+                builder.add(job.song, job.hashes, job.times)
+            checked = [job.song for job in latest.values() if not job.force]
+            index, duplicates = drop_near_duplicates(builder.build(), checked, reference=self.store.snapshot())
+            for song, (of, coverage) in duplicates.items():
+                job = latest.pop(song)
+                job.duplicate_of, job.coverage = of, coverage
+                self._settle(job, "duplicate")
+            if not latest:
+                return
+            self.store.add_index(index)
+            # the songs are live from here on: a failure below is logged, never fails their jobs
+            for job in latest.values():
+                try:
+                    os.replace(job.path, os.path.join(self.song_dir, job.song))
+                except OSError as e:   # indexed anyway; the upload stays at job.path
+                    print(f"⚠️ {job.song} is indexed but its upload could not be moved: {e}")
+                if len(job.hashes):
+                    self.ingest.record(job.song, job.digest, job.size, len(job.hashes))
+                else:
+                    self.ingest.forget(job.song)
+            try:
+                self.ingest.save()
+            except OSError as e:   # the records stay in memory and go out with the next save
+                print("⚠️ Ingest manifest not saved:", e)
+
+        total = sum(len(job.hashes) for job in latest.values())
+        TRAIN_HASHES.inc(total)
+        TRAIN_SONGS.labels("ok").inc(len(latest))
+        self.commits += 1
+        self.committed += len(latest)
+        print(f"✅ Committed {len(latest)} songs ({total} hashes) as one segment")
+        for job in latest.values():
+            self._settle(job, "done", keep_file=True)
+        if self.on_commit is not None:
+            try:
+                self.on_commit()
+            except Exception as e:
+                print("⚠️ Post-commit hook failed:", e)
+
+    def _settle(self, job, status, keep_file=False):
+        if not keep_file:
+            self._discard_upload(job)
+        if status in ("duplicate", "superseded"):
+            TRAIN_SONGS.labels(status).inc()
+        job.finish(status)
+        with self._lock:
+            self._pending -= 1
+
+    # ---- status ----
+    def job(self, job_id):
+        job = self._jobs.get(job_id)
+        return None if job is None else job.to_dict()
+
+    def jobs(self, limit=100):
+        """Newest jobs first, plus a count per status."""
+        with self._lock:
+            jobs = [job.to_dict() for job in reversed(self._jobs.values())]
+        counts = {}
+        for job in jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"counts": counts, "jobs": jobs[:limit]}
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "pending": self._pending, "fingerprinting": self._running,
+                    "ready": self._ready.qsize(), "commits": self.commits, "committed": self.committed}
+
+    def close(self):
+        self._closed = True
+        self._writer.join(timeout=2)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,217 @@
+# user_store.py
+"""
+User & History Store (SQLite)
+Data-access layer for the user/history endpoints of audio_api_service:
+
+- A small pool of long-lived connections instead of connect/close per request;
+  each keeps its prepared-statement cache warm.
+- WAL journaling: readers never block the writer and vice versa.
+- history(user_id, timestamp, id) index + keyset pagination (no OFFSET scans).
+- Recognition logs are queued and written in batches by a background thread,
+  so /recognize never waits on a disk sync. A batch that fails (e.g. database
+  is locked) goes back to the front of the queue and is retried; the queue
+  holds at most MAX_QUEUED_ROWS, the oldest rows beyond that are dropped and
+  counted in stats().
+"""
+
+import queue, sqlite3, threading, time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==== CONFIG ====
+DB_PATH = "serenity_users.db"
+POOL_SIZE = 4             # pooled connections (reads run concurrently under WAL)
+BUSY_TIMEOUT_MS = 5000    # wait this long for a competing writer before failing
+CACHED_STATEMENTS = 64    # prepared statements kept per connection
+HISTORY_PAGE = 50         # default page size for history reads
+HISTORY_PAGE_MAX = 500
+FLUSH_INTERVAL = 0.25     # seconds between history write batches
+FLUSH_BATCH = 500         # flush early once this many rows are queued
+MAX_QUEUED_ROWS = 50000   # unwritten history rows kept while the database refuses writes
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        mood TEXT DEFAULT 'neutral'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        song TEXT,
+        emotion TEXT,
+        timestamp TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_user_time ON history(user_id, timestamp, id)",
+)
+
+SQL_INSERT_HISTORY = "INSERT INTO history (user_id, song, emotion, timestamp) VALUES (?, ?, ?, ?)"
+SQL_FIND_USER = "SELECT id FROM users WHERE username=?"
+SQL_CREATE_USER = "INSERT OR IGNORE INTO users (username) VALUES (?)"
+SQL_PROFILE = "SELECT username, mood FROM users WHERE id=?"
+SQL_HISTORY_FIRST = ("SELECT id, song, emotion, timestamp FROM history WHERE user_id=? "
+                     "ORDER BY timestamp DESC, id DESC LIMIT ?")
+SQL_HISTORY_AFTER = ("SELECT id, song, emotion, timestamp FROM history WHERE user_id=? "
+                     "AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?")
+
+
+# ==== CONNECTION POOL ====
+class ConnectionPool:
+    """Fixed set of WAL-mode connections shared across threads, one borrower at a time each."""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._all = []
+        for _ in range(size):
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                                   cached_statements=CACHED_STATEMENTS)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")   # safe under WAL, no fsync per commit
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._all.append(conn)
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success, rolls back on error."""
+        conn = self._idle.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+
+
+# ==== STORE ====
+class UserStore:
+    """Users, profiles and recognition history on top of a ConnectionPool."""
+
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        self._pending = deque()
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    # ---- users ----
+    def login(self, username):
+        """Return the user's ID, creating the user on first login."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SQL_FIND_USER, (username,)).fetchone()
+            if row:
+                return row[0]
+            conn.execute(SQL_CREATE_USER, (username,))
+            return conn.execute(SQL_FIND_USER, (username,)).fetchone()[0]
+
+    def profile(self, user_id):
+        """(username, mood) or None."""
+        with self.pool.connection() as conn:
+            return conn.execute(SQL_PROFILE, (user_id,)).fetchone()
+
+    # ---- history ----
+    def log_recognition(self, user_id, song, emotion="neutral"):
+        """Queue one history row; it is written with the next batch (never blocks on disk)."""
+        with self._pending_lock:
+            self._pending.append((user_id, song, emotion, datetime.now().isoformat()))
+            self._trim()
+            queued = len(self._pending)
+        if queued >= FLUSH_BATCH:
+            self._wake.set()
+
+    def _trim(self):
+        """Drop the oldest rows beyond MAX_QUEUED_ROWS (caller holds _pending_lock)."""
+        while len(self._pending) > MAX_QUEUED_ROWS:
+            self._pending.popleft()
+            self.dropped += 1
+
+    def history(self, user_id, limit=HISTORY_PAGE, cursor=None):
+        """
+        Newest-first page of a user's history.
+        Returns (rows, next_cursor); pass next_cursor back to get the following page.
+        """
+        try:
+            self.flush()   # read-your-writes for rows still queued
+        except sqlite3.Error as e:   # writer locked out: serve the committed rows, the queued ones stay queued
+            print("⚠️ History flush before read failed:", e)
+        limit = max(1, min(int(limit), HISTORY_PAGE_MAX))
+        with self.pool.connection() as conn:
+            if cursor:
+                timestamp, _, last_id = cursor.rpartition("|")
+                rows = conn.execute(SQL_HISTORY_AFTER, (user_id, timestamp, int(last_id), limit)).fetchall()
+            else:
+                rows = conn.execute(SQL_HISTORY_FIRST, (user_id, limit)).fetchall()
+        next_cursor = f"{rows[-1][3]}|{rows[-1][0]}" if len(rows) == limit else None
+        return [{"song": r[1], "emotion": r[2], "timestamp": r[3]} for r in rows], next_cursor
+
+    def flush(self):
+        """
+        Write every queued history row in one transaction. Returns rows written.
+        On a database error the batch is put back in front of the queue and the error re-raised.
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+            try:
+                with self.pool.connection() as conn:
+                    conn.executemany(SQL_INSERT_HISTORY, batch)
+            except sqlite3.Error:
+                with self._pending_lock:
+                    self._pending.extendleft(reversed(batch))
+                    self._trim()
+                    self.failed_batches += 1
+                raise
+            self.written += len(batch)
+            self.batches += 1
+            return len(batch)
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:   # keep the writer alive; flush() re-queued the rows
+                print("⚠️ History write failed:", e)
+                time.sleep(self.flush_interval)
+
+    def stats(self):
+        with self._pending_lock:
+            queued = len(self._pending)
+        return {"queued": queued, "written": self.written, "batches": self.batches,
+                "failed_batches": self.failed_batches, "dropped": self.dropped}
+
+    def close(self):
+        """Flush pending history and close every pooled connection."""
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=2)
+        self.flush()
+        self.pool.close()